@@ -1,34 +1,82 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g
 from flask_cors import CORS
-from parser import parse_marks_card
-from werkzeug.utils import secure_filename
-import tempfile
+from workers import parse_card, parse_pool
+from cache import result_cache
+from uploads import UploadRequest, read_pdf_upload
+from bulk import collect_pdfs, stream_results, BULK_MAX_CONTENT_LENGTH
+from jobs import job_manager, sse_stream, QueueFull
+from cohort import cohort_stats
+from store import result_store, merge_past_sgpas
+from tips import get_tip, tip_request, tip_events, tip_cache, TipError, tip_error_body
+from scheduler import ocr_scheduler, gemini_scheduler
+from metrics import registry, HTTP_REQUESTS, HTTP_SECONDS
+from logs import get_logger
 import os
-import numpy as np
-from sklearn.linear_model import LinearRegression
-import requests
-import json
+import math
+import threading
+import time
 from dotenv import load_dotenv # <-- NEW: Import dotenv
 
 # --- NEW: Load our secret .env file ---
 # This line reads your .env file and loads the variables
 load_dotenv() 
 
+log = get_logger("app")
+
 app = Flask(__name__)
+# Keep uploaded PDFs in memory instead of Werkzeug's temp files
+app.request_class = UploadRequest
 # Allow all origins for mobile devices (development only)
 CORS(app, resources={r"/*": {"origins": "*"}})
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
 ALLOWED_EXTENSIONS = {'pdf'}
 
-# (allowed_file and calculate_cgpa_data are unchanged)
+# Two-sided 95% Student-t critical values by degrees of freedom, for the
+# prediction interval. Past the table the normal value is close enough.
+T_CRITICAL_95 = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365,
+    8: 2.306, 9: 2.262, 10: 2.228, 11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145,
+    15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101, 19: 2.093, 20: 2.086,
+}
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def calculate_cgpa_data(past_sgpas_str, new_sgpa):
+def predict_next_sgpa(sgpas):
+    """
+    Least-squares line through (semester number, SGPA), evaluated at the
+    next semester. Closed form - the same fit LinearRegression gave, without
+    loading sklearn for a handful of points.
+
+    Returns (predicted, interval) where interval is the 95% prediction
+    interval as (low, high), or None with fewer than 3 semesters.
+    """
+    n = len(sgpas)
+    xs = range(1, n + 1)
+    x_mean = (n + 1) / 2
+    y_mean = sum(sgpas) / n
+    sxx = sum((x - x_mean) ** 2 for x in xs)
+    sxy = sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, sgpas))
+    slope = sxy / sxx
+    intercept = y_mean - slope * x_mean
+    next_x = n + 1
+    predicted = intercept + slope * next_x
+
+    interval = None
+    if n >= 3:
+        residual_ss = sum((y - (intercept + slope * x)) ** 2 for x, y in zip(xs, sgpas))
+        std_error = math.sqrt(residual_ss / (n - 2) * (1 + 1 / n + (next_x - x_mean) ** 2 / sxx))
+        margin = T_CRITICAL_95.get(n - 2, 1.96) * std_error
+        interval = (predicted - margin, predicted + margin)
+    return predicted, interval
+
+def calculate_cgpa_data(past_sgpas, new_sgpa):
+    """`past_sgpas` is a list of SGPAs or the comma-separated string users type."""
     try:
-        past_sgpas = [float(s.strip()) for s in past_sgpas_str.split(',') if s.strip()]
+        if isinstance(past_sgpas, str):
+            past_sgpas = [float(s.strip()) for s in past_sgpas.split(',') if s.strip()]
         all_sgpas = past_sgpas + [new_sgpa]
         
         cgpa = 0
@@ -45,20 +93,22 @@ def calculate_cgpa_data(past_sgpas_str, new_sgpa):
             
         prediction = None
         if len(all_sgpas) >= 2:
-            X = np.array(range(1, len(all_sgpas) + 1)).reshape(-1, 1)
-            y = np.array(all_sgpas)
-            model = LinearRegression()
-            model.fit(X, y)
-            next_sem_num = len(all_sgpas) + 1
-            predicted_sgpa = model.predict(np.array([[next_sem_num]]))[0]
-            predicted_sgpa = round(np.clip(predicted_sgpa, 0, 10), 2)
+            predicted_sgpa, interval = predict_next_sgpa(all_sgpas)
+            predicted_sgpa = round(min(max(predicted_sgpa, 0), 10), 2)
             new_sgpa_list = all_sgpas + [predicted_sgpa]
             predicted_cgpa = round(sum(new_sgpa_list) / len(new_sgpa_list), 2)
             prediction = {
                 "past_trend": all_sgpas,
                 "predicted_sgpa": predicted_sgpa,
-                "predicted_cgpa": predicted_cgpa
+                "predicted_cgpa": predicted_cgpa,
+                "interval": None
             }
+            if interval:
+                prediction["interval"] = {
+                    "low": round(min(max(interval[0], 0), 10), 2),
+                    "high": round(min(max(interval[1], 0), 10), 2),
+                    "confidence": 0.95
+                }
         return {
             "cgpa": cgpa,
             "percentage": percentage,
@@ -66,100 +116,274 @@ def calculate_cgpa_data(past_sgpas_str, new_sgpa):
             "prediction": prediction
         }
     except Exception as e:
-        print(f"CGPA/Prediction error: {e}")
+        log.warning("cgpa_failed", error=str(e))
         return None
 
-# (/ and /upload are unchanged)
+# Heavy native modules (PyMuPDF, NumPy) are imported lazily so the server
+# starts listening at once; this warms them up in the background and
+# /ready reports 503 until it's done, so a load balancer only routes
+# traffic to workers that won't stall the first upload.
+_ready = threading.Event()
+_warmup_error = None
+
+def _warm_up():
+    global _warmup_error
+    try:
+        import fitz  # noqa: F401
+        import numpy  # noqa: F401
+    except Exception as e:
+        _warmup_error = str(e)
+    finally:
+        _ready.set()
+
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_request(response):
+    # Label by route pattern, not raw path, so /jobs/<id> is one series
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if "request_start" in g:
+        HTTP_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
+registry.gauge("vtu_result_cache_lookups", "Result cache lookups since start, by outcome",
+               lambda: [({"outcome": "hit"}, result_cache.hits), ({"outcome": "miss"}, result_cache.misses)])
+registry.gauge("vtu_tip_cache_requests", "AI tip requests since start, by how they were answered",
+               lambda: [({"outcome": k}, v) for k, v in tip_cache.stats().items() if k != "entries"])
+registry.gauge("vtu_tip_cache_entries", "Tips currently cached", lambda: tip_cache.stats()["entries"])
+registry.gauge("vtu_parse_workers", "Parse worker processes running", lambda: parse_pool.stats()["workers"])
+registry.gauge("vtu_parse_queue", "Cards waiting for a parse worker", lambda: parse_pool.stats()["queued"])
+registry.gauge("vtu_upstream_queue", "Calls waiting for an upstream's rate limit",
+               lambda: [({"upstream": s.name}, s.stats()["queued"]) for s in (ocr_scheduler, gemini_scheduler)])
+registry.gauge("vtu_upstream_in_flight", "Calls in flight to an upstream",
+               lambda: [({"upstream": s.name}, s.stats()["in_flight"]) for s in (ocr_scheduler, gemini_scheduler)])
+
+@app.route("/metrics")
+def metrics():
+    # Prometheus text exposition format
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/")
 def index():
     return jsonify({"status": "Flask API is running!"})
 
+@app.route("/ready")
+def ready():
+    if not _ready.is_set():
+        return jsonify({"status": "warming_up"}), 503
+    if _warmup_error:
+        return jsonify({"status": "error", "message": _warmup_error}), 503
+    return jsonify({
+        "status": "ready",
+        "ocr_configured": bool(os.getenv("OCR_SPACE_API_KEY")),
+        "ai_configured": bool(os.getenv("GEMINI_API_KEY")),
+    })
+
+def read_upload_request():
+    """
+    Pull the PDF and past_sgpas out of an upload request.
+
+    Raw body uploads (Content-Type: application/pdf) skip multipart parsing
+    entirely; past_sgpas then comes in the query string.
+    Returns (upload, past_sgpas_str, None) or (None, None, error_response).
+    """
+    if request.mimetype == 'application/pdf':
+        stream = request.stream
+        past_sgpas_str = request.args.get('past_sgpas', '')
+    else:
+        if 'file' not in request.files:
+            return None, None, (jsonify({"status": "error", "message": "No file part"}), 400)
+        file = request.files['file']
+        past_sgpas_str = request.form.get('past_sgpas', '')
+        if file.filename == '' or not allowed_file(file.filename):
+            return None, None, (jsonify({"status": "error", "message": "Invalid or missing PDF file"}), 400)
+        stream = file.stream
+    # Hashes while reading; stays in memory unless it's unusually large
+    return read_pdf_upload(stream), past_sgpas_str, None
+
+def add_cgpa_data(results, past_sgpas_str):
+    """
+    Add CGPA and trend data. Earlier semesters are taken from the result
+    store where they are stored and from what the user typed (semester 1
+    first) where they aren't. A consolidated card's own earlier semesters
+    follow those.
+    """
+    on_card = results.get("semesters") or []
+    first_semester = on_card[0]["semester"] if on_card else results.get("semester")
+    past_sgpas = past_sgpas_str
+    if first_semester is not None:
+        try:
+            typed = [float(s.strip()) for s in past_sgpas_str.split(',') if s.strip()]
+        except ValueError:
+            typed = []
+        past_sgpas = merge_past_sgpas(result_store.semester_sgpas(results["usn"]), typed, first_semester)
+    earlier_on_card = [s["sgpa"] for s in on_card[:-1] if s["total_credits_attempted"]]
+    if earlier_on_card:
+        if isinstance(past_sgpas, str):
+            try:
+                past_sgpas = [float(s.strip()) for s in past_sgpas.split(',') if s.strip()]
+            except ValueError:
+                past_sgpas = []
+        past_sgpas = past_sgpas + earlier_on_card
+    if past_sgpas:
+        cgpa_data = calculate_cgpa_data(
+            past_sgpas, 
+            results["sgpa"]
+        )
+        results.update(cgpa_data)
+    return results
+
 @app.route("/upload", methods=["POST"])
 def upload_file():
-    # ... (this whole function is unchanged)
-    if 'file' not in request.files:
-        return jsonify({"status": "error", "message": "No file part"}), 400
-    file = request.files['file']
-    past_sgpas_str = request.form.get('past_sgpas', '')
-    if file.filename == '' or not allowed_file(file.filename):
-        return jsonify({"status": "error", "message": "Invalid or missing PDF file"}), 400
-    temp_pdf_path = ""
+    upload = None
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            file.save(temp_file.name)
-            temp_pdf_path = temp_file.name
-        results = parse_marks_card(temp_pdf_path)
+        upload, past_sgpas_str, error = read_upload_request()
+        if error:
+            return error
+        # Re-uploads of the same PDF are served from the result cache
+        results = result_cache.get_or_compute(
+            upload.digest,
+            lambda: parse_card(upload.source)
+        )
+        if results.get("retry_after"):
+            # OCR was shed under load: the client should come back later
+            return jsonify(results), 503, {"Retry-After": str(results["retry_after"])}
         if results["status"] == "error":
             return jsonify(results), 500
-        if past_sgpas_str:
-            cgpa_data = calculate_cgpa_data(
-                past_sgpas_str, 
-                results["sgpa"]
-            )
-            results.update(cgpa_data)
-        return jsonify(results)
+        cohort_stats.record(results)
+        result_store.save_result(results)
+        return jsonify(add_cgpa_data(results, past_sgpas_str))
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
     finally:
-        if os.path.exists(temp_pdf_path):
-            os.remove(temp_pdf_path)
+        if upload:
+            upload.close()
+
+@app.route("/upload/bulk", methods=["POST"])
+def upload_bulk():
+    # A whole section's cards won't fit under the single-upload limit
+    request.max_content_length = BULK_MAX_CONTENT_LENGTH
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({"status": "error", "message": "No files part"}), 400
+    try:
+        items, rejected = collect_pdfs(files)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if not items:
+        return jsonify({"status": "error", "message": "No PDF files found in upload"}), 400
+    # One JSON object per line, flushed as each card finishes parsing
+    return Response(stream_results(items, rejected), mimetype="application/x-ndjson")
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    # Same input as /upload, but returns at once with a job id to poll
+    try:
+        upload, past_sgpas_str, error = read_upload_request()
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    if error:
+        return error
+    try:
+        job = job_manager.submit(upload, finish=lambda results: add_cgpa_data(results, past_sgpas_str))
+    except QueueFull:
+        upload.close()
+        response = jsonify({"status": "error", "message": "Too many parses queued. Please retry shortly."})
+        response.headers["Retry-After"] = "10"
+        return response, 503
+    return jsonify({"status": "queued", "job_id": job.id}), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({"status": "error", "message": "Unknown job id"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({"status": "error", "message": "Unknown job id"}), 404
+    return Response(sse_stream(job), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/grades/batch", methods=["POST"])
+def grades_batch():
+    # Re-grade a whole cohort at once, e.g. after revaluation results
+    data = request.get_json(silent=True) or {}
+    students = data.get('students')
+    if not students:
+        return jsonify({"status": "error", "message": "No student data provided"}), 400
+    from grading import grade_cohort  # numpy is only loaded once this is used
+    try:
+        return jsonify({"status": "success", "students": grade_cohort(students)})
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": f"Malformed student data: {e}"}), 400
+
+@app.route("/what-if/target", methods=["POST"])
+def what_if_target():
+    # "What do I need in each subject for an 8.5?" - the least marks that reach
+    # target_sgpa, or target_cgpa on top of past_sgpas
+    data = request.get_json(silent=True) or {}
+    from grading import plan_for_target  # numpy is only loaded once this is used
+    try:
+        plan = plan_for_target(data.get('subjects'), data.get('target_sgpa'), data.get('target_cgpa'),
+                               data.get('past_sgpas') or ())
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": f"Malformed what-if request: {e}"}), 400
+    return jsonify({"status": "success", **plan})
+
+@app.route("/students/<usn>/history", methods=["GET"])
+def student_history(usn):
+    history = result_store.history(usn)
+    if not history:
+        return jsonify({"status": "error", "message": "No results stored for this USN"}), 404
+    return jsonify({"status": "success", **history})
+
+@app.route("/cohort", methods=["GET"])
+def cohort_summary():
+    return jsonify({"status": "success", **cohort_stats.summary()})
+
+@app.route("/cohort/rank/<usn>", methods=["GET"])
+def cohort_rank(usn):
+    rank = cohort_stats.percentile_rank(usn, request.args.get("semester", type=int))
+    if not rank:
+        return jsonify({"status": "error", "message": "No results recorded for this USN and semester"}), 404
+    return jsonify({"status": "success", **rank})
+
+@app.route("/cohort/subjects/<code>", methods=["GET"])
+def cohort_subject(code):
+    stats = cohort_stats.subject(code)
+    if not stats:
+        return jsonify({"status": "error", "message": "No results recorded for this subject"}), 404
+    return jsonify({"status": "success", **stats})
 
 @app.route("/get-ai-tip", methods=["POST"])
 def get_ai_tip():
-    data = request.get_json()
-    subjects = data.get('subjects')
-    sgpa = data.get('sgpa')
-    if not subjects:
-        return jsonify({"status": "error", "message": "No subject data provided"}), 400
     try:
-        passed_subjects = [s for s in subjects if s['result'] == 'P' and s['credits'] > 0]
-        worst_subject = min(passed_subjects, key=lambda x: x['points'])
-        failed_subjects = [s for s in subjects if s['result'] == 'F']
-        
-        prompt = (f"A VTU data science student just got their 4th sem results. "
-                  f"Their SGPA was {sgpa}. ")
-        if failed_subjects:
-            prompt += (f"They failed: {', '.join([s['title'] for s in failed_subjects])}. "
-                       f"Their worst *passed* subject was {worst_subject['title']} (Grade Points: {worst_subject['points']}). ")
-            prompt += "Please provide one paragraph of concise, actionable study advice focusing on how to recover from the failed subjects and improve."
-        else:
-            prompt += (f"Their worst passed subject was {worst_subject['title']} (Grade Points: {worst_subject['points']}). "
-                       f"Please provide one paragraph of concise, actionable study advice on how to improve this specific subject.")
-    except Exception:
-        prompt = f"A VTU data science student just got an SGPA of {sgpa}. Provide one paragraph of concise, positive study advice."
+        subjects, sgpa = tip_request(request.get_json(silent=True))
+        tip, cached = get_tip(subjects, sgpa)
+    except TipError as e:
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after else {}
+        return jsonify(tip_error_body(e)), e.status, headers
+    return jsonify({"status": "success", "tip": tip, "cached": cached})
 
+@app.route("/get-ai-tip/stream", methods=["POST"])
+def get_ai_tip_stream():
+    # Same request as /get-ai-tip; the tip arrives as SSE "chunk" events
     try:
-        # --- THIS IS THE FIX ---
-        # It now reads your secret key from the .env file
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            # This error will show if your .env file is wrong
-            return jsonify({"status": "error", "message": "API key not configured."}), 500
-            
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-09-2025:generateContent?key={api_key}"
-        
-        system_instruction = "You are a helpful and encouraging academic tutor for a data science engineering student."
-        payload = {
-            "contents": [{"parts": [{"text": prompt}]}],
-            "systemInstruction": {"parts": [{"text": system_instruction}]}
-        }
-        headers = {"Content-Type": "application/json"}
-        
-        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=20)
-        response.raise_for_status() # This will raise an error if Google sends a 4xx or 5xx
-        
-        api_result = response.json()
-        tip = api_result['candidates'][0]['content']['parts'][0]['text']
-        return jsonify({"status": "success", "tip": tip})
-        
-    except requests.exceptions.Timeout:
-        return jsonify({"status": "error", "message": "AI server (Gemini) timed out. Please try again."}), 504
-    except requests.exceptions.RequestException as e:
-        print(f"Gemini API Error: {e}")
-        # This will now catch the 403 error if the key is wrong
-        return jsonify({"status": "error", "message": f"AI server error: {e}"}), 500
-    except (KeyError, IndexError):
-        return jsonify({"status": "error", "message": "Failed to parse AI response."}), 500
+        subjects, sgpa = tip_request(request.get_json(silent=True))
+    except TipError as e:
+        return jsonify(tip_error_body(e)), e.status
+    return Response(tip_events(subjects, sgpa), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Started last so the warm-up doesn't compete with the rest of this import
+threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
 
 if __name__ == "__main__":
     # Bind to all interfaces so mobile devices on the same network can reach the API
@@ -0,0 +1,458 @@
+"""
+asyncio serving mode: the app.py API on an aiohttp event loop.
+
+    pip install aiohttp
+    python async_app.py          # HOST/PORT as for app.py, default 0.0.0.0:5000
+
+Nearly all of an OCR upload or an AI tip is spent waiting on OCR.space or
+Gemini. app.py holds a thread for that whole wait; here the waiting is
+done on the event loop over one shared connection pool (async_http.py), so
+a single process keeps hundreds of OCR and Gemini calls in flight.
+
+- /upload parses with parser.parse_steps: the PDF work between OCR calls
+  (opening, text extraction, rendering, reading the card) runs on a pool
+  of ASYNC_CPU_WORKERS threads, and each round of OCR is sent from the
+  loop. With PARSE_MODE=workers the card goes to the worker processes
+  instead, which make their own OCR calls.
+- /get-ai-tip and /get-ai-tip/stream call Gemini from the loop, sharing
+  the tip cache with app.py's code.
+- OCR and Gemini calls wait their turn in scheduler.py's queues without
+  holding a thread, and are shed with 503 + Retry-After as under app.py.
+- Every other route is handed to the Flask app on ASYNC_WSGI_THREADS
+  threads, so it behaves exactly as under app.py.
+
+load_test.py runs this server against the local stand-in upstreams.
+"""
+import asyncio
+import contextlib
+import copy
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from aiohttp import web
+from app import app as flask_app, add_cgpa_data, allowed_file
+from async_http import open_session, close_session, get_session, post_with_retries
+from bulk import BULK_MAX_CONTENT_LENGTH
+from cache import result_cache
+from cohort import cohort_stats
+from logs import get_logger
+from metrics import stage_timer, HTTP_REQUESTS, HTTP_SECONDS, OCR_PAGES, OCR_UPLOAD_BYTES, STAGE_SECONDS
+from parser import (parse_steps, ocr_api_key, ocr_response_text, ocr_priority, OCR_SPACE_URL, OCR_RETRIES,
+                    OCR_TIMEOUT, BUSY_STATUS)
+from scheduler import ocr_scheduler, gemini_scheduler, Overloaded, PRIORITY_INTERACTIVE
+from store import result_store
+from tips import (tip_cache, tip_request, tip_profile, build_prompt, gemini_request, sse_line_texts, sse_event,
+                  busy_error, tip_error_body, TipError, GEMINI_TIMEOUT, GEMINI_STREAM_IDLE_TIMEOUT)
+from uploads import read_pdf_upload
+from workers import parse_pool, WorkerCrashed, PARSE_MODE
+
+ASYNC_CPU_WORKERS = int(os.getenv("ASYNC_CPU_WORKERS", os.cpu_count() or 1))
+# Bridged Flask routes include the SSE job streams, which hold a thread each
+ASYNC_WSGI_THREADS = int(os.getenv("ASYNC_WSGI_THREADS", 32))
+
+log = get_logger("async_app")
+
+cpu_pool = ThreadPoolExecutor(max_workers=max(1, ASYNC_CPU_WORKERS), thread_name_prefix="cpu")
+wsgi_pool = ThreadPoolExecutor(max_workers=max(1, ASYNC_WSGI_THREADS), thread_name_prefix="wsgi")
+
+
+async def run_cpu(fn, *args):
+    """Run blocking `fn(*args)` on the CPU pool."""
+    return await asyncio.get_running_loop().run_in_executor(cpu_pool, fn, *args)
+
+
+# --- OCR ---
+
+def _retry_after(headers, default=10):
+    """Seconds from a Retry-After header (scheduler.retry_after_header for aiohttp's errors)."""
+    value = (headers or {}).get("Retry-After", "")
+    return int(value) if value.isdigit() else default
+
+
+async def _ocr_page(session, api_key, page_number, img_data):
+    log.debug("ocr_page_sent", page=page_number, png_bytes=len(img_data))
+    OCR_UPLOAD_BYTES.inc(len(img_data))
+
+    def form():
+        data = aiohttp.FormData()
+        data.add_field("file", img_data, filename="scan.png", content_type="image/png")
+        data.add_field("apikey", api_key)
+        data.add_field("language", "eng")
+        return data
+
+    try:
+        with stage_timer("ocr_request"):
+            response = await post_with_retries(session, OCR_SPACE_URL, retries=OCR_RETRIES, data=form,
+                                               timeout=aiohttp.ClientTimeout(total=OCR_TIMEOUT),
+                                               limiter=ocr_scheduler)
+        return ocr_response_text(await response.json(content_type=None), page_number)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        OCR_PAGES.inc(outcome="request_failed")
+        log.error("ocr_request_failed", page=page_number, error=str(e) or type(e).__name__)
+        if isinstance(e, aiohttp.ClientResponseError) and e.status in BUSY_STATUS:
+            raise Overloaded("ocr", _retry_after(e.headers)) from e
+        raise
+
+
+async def ocr_images(images, priority=PRIORITY_INTERACTIVE):
+    """parser.ocr_images on the event loop: every page of the round in flight at once."""
+    api_key = ocr_api_key()
+    if not images:
+        return {}
+    session = get_session()
+    async with ocr_scheduler.async_slot(len(images), priority):
+        tasks = {i: asyncio.ensure_future(_ocr_page(session, api_key, i + 1, png)) for i, png in images.items()}
+        try:
+            texts = await asyncio.gather(*tasks.values())
+        except Exception:
+            # One page failed for good - don't keep paying for the others
+            for task in tasks.values():
+                task.cancel()
+            raise
+    return dict(zip(tasks, texts))
+
+
+def _advance(step, value):
+    # A future can't carry StopIteration, so the generator's return value comes back as (True, value)
+    try:
+        return False, step(value)
+    except StopIteration as done:
+        return True, done.value
+
+
+async def parse_card(source):
+    """parse_marks_card with its OCR rounds awaited on the loop and everything else on the CPU pool."""
+    if PARSE_MODE == "workers":
+        try:
+            return await asyncio.wrap_future(parse_pool.submit(source, priority=PRIORITY_INTERACTIVE))
+        except WorkerCrashed as e:
+            return {"status": "error", "message": str(e)}
+
+    steps = parse_steps(source)
+    done, value = await run_cpu(_advance, steps.send, None)
+    while not done:
+        tier, images = value
+        try:
+            page_texts = await ocr_images(images, ocr_priority(PRIORITY_INTERACTIVE, tier))
+        except Exception as e:
+            done, value = await run_cpu(_advance, steps.throw, e)
+        else:
+            done, value = await run_cpu(_advance, steps.send, page_texts)
+    return value
+
+
+_parsing = {}
+
+
+async def parse_once(upload):
+    """
+    parse_card for one upload, shared by concurrent uploads of the same PDF
+    and cached. The task that parses takes over the upload's source and
+    removes it when it's done, as followers keep reading it after the
+    uploader's request has gone away.
+    """
+    digest = upload.digest
+    task = _parsing.get(digest)
+    if task is None:
+        owned = upload.detach()
+
+        async def parse_and_cache():
+            results = await parse_card(owned.source)
+            await run_cpu(result_cache.put, digest, results)
+            return results
+
+        task = _parsing[digest] = asyncio.ensure_future(parse_and_cache())
+        task.add_done_callback(lambda _: _parsing.pop(digest, None))
+        task.add_done_callback(lambda _: owned.close())
+    # Every caller adds its own CGPA data, so each gets its own copy
+    return copy.deepcopy(await asyncio.shield(task))
+
+
+# --- Gemini ---
+
+def _busy_response_error(e):
+    # tips.busy_error for an aiohttp 429/503
+    return busy_error(Overloaded("gemini", _retry_after(e.headers)))
+
+async def fetch_tip(prompt):
+    """tips.fetch_tip over the shared aiohttp session."""
+    url, headers, payload = gemini_request(prompt)
+    try:
+        async with gemini_scheduler.async_slot():
+            with stage_timer("ai_tip"):
+                response = await post_with_retries(get_session(), url, retries=1, headers=headers, json=payload,
+                                                   timeout=aiohttp.ClientTimeout(total=GEMINI_TIMEOUT),
+                                                   limiter=gemini_scheduler)
+        data = await response.json(content_type=None)
+        return data['candidates'][0]['content']['parts'][0]['text']
+    except Overloaded as e:
+        raise busy_error(e) from None
+    except asyncio.TimeoutError:
+        raise TipError("AI server (Gemini) timed out. Please try again.", 504) from None
+    except aiohttp.ClientError as e:
+        if isinstance(e, aiohttp.ClientResponseError) and e.status in BUSY_STATUS:
+            raise _busy_response_error(e) from None
+        log.error("gemini_request_failed", error=str(e))
+        raise TipError(f"AI server error: {e}") from None
+    except (KeyError, IndexError, ValueError):
+        raise TipError("Failed to parse AI response.") from None
+
+
+async def stream_tip(subjects, sgpa):
+    """tips.stream_tip as an async generator; closing it closes the upstream stream."""
+    profile = tip_profile(subjects, sgpa)
+    tip = tip_cache.get(profile["key"])
+    if tip is not None:
+        yield tip
+        return
+
+    url, headers, payload = gemini_request(build_prompt(profile), "streamGenerateContent")
+    timeout = aiohttp.ClientTimeout(sock_connect=5, sock_read=GEMINI_STREAM_IDLE_TIMEOUT)
+    pieces = []
+    start = time.perf_counter()
+    try:
+        async with gemini_scheduler.async_slot(), \
+                get_session().post(url, params={"alt": "sse"}, headers=headers, json=payload,
+                                   timeout=timeout) as response:
+            if response.status == 429:
+                gemini_scheduler.pause(_retry_after(response.headers))
+            response.raise_for_status()
+            async for line in response.content:
+                for text in sse_line_texts(line.decode("utf-8").strip()):
+                    if not pieces:
+                        STAGE_SECONDS.observe(time.perf_counter() - start, stage="ai_tip_first_chunk")
+                    pieces.append(text)
+                    yield text
+    except Overloaded as e:
+        raise busy_error(e) from None
+    except asyncio.TimeoutError:
+        raise TipError("AI server (Gemini) timed out. Please try again.", 504) from None
+    except aiohttp.ClientError as e:
+        if isinstance(e, aiohttp.ClientResponseError) and e.status in BUSY_STATUS:
+            raise _busy_response_error(e) from None
+        log.error("gemini_request_failed", error=str(e))
+        raise TipError(f"AI server error: {e}") from None
+    except (KeyError, IndexError, ValueError):
+        raise TipError("Failed to parse AI response.") from None
+
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="ai_tip_stream")
+    if pieces:
+        tip_cache.put(profile["key"], "".join(pieces))
+
+
+# --- Routes ---
+
+def _error(message, status):
+    return web.json_response({"status": "error", "message": message}, status=status)
+
+
+async def _json_body(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _finish_upload(results, past_sgpas_str):
+    # SQLite and the cohort lock - kept off the loop
+    cohort_stats.record(results)
+    result_store.save_result(results)
+    return add_cgpa_data(results, past_sgpas_str)
+
+
+async def upload(request):
+    # Same request and response as app.py's /upload
+    limit = flask_app.config['MAX_CONTENT_LENGTH']
+    if request.content_length and request.content_length > limit:
+        return _error("File too large", 413)
+    # The app-wide client_max_size is the bulk limit; a chunked body has no
+    # Content-Length, so the single-upload limit is applied to what's read
+    request = request.clone(client_max_size=limit)
+    try:
+        if request.content_type == 'application/pdf':
+            body = await request.read()
+        else:
+            form = await request.post()
+    except web.HTTPRequestEntityTooLarge:
+        return _error("File too large", 413)
+    if request.content_type == 'application/pdf':
+        stream = io.BytesIO(body)
+        past_sgpas_str = request.query.get('past_sgpas', '')
+    else:
+        file = form.get('file')
+        if not isinstance(file, web.FileField):
+            return _error("No file part", 400)
+        past_sgpas_str = form.get('past_sgpas', '')
+        if not file.filename or not allowed_file(file.filename):
+            return _error("Invalid or missing PDF file", 400)
+        stream = file.file
+
+    upload = await run_cpu(read_pdf_upload, stream)
+    try:
+        # Re-uploads of the same PDF are served from the result cache
+        results = await run_cpu(result_cache.get, upload.digest)
+        if results is None:
+            results = await parse_once(upload)
+        if results.get("retry_after"):
+            return web.json_response(results, status=503, headers={"Retry-After": str(results["retry_after"])})
+        if results["status"] == "error":
+            return web.json_response(results, status=500)
+        return web.json_response(await run_cpu(_finish_upload, results, past_sgpas_str))
+    except Exception as e:
+        log.exception("upload_failed")
+        return _error(str(e), 500)
+    finally:
+        upload.close()
+
+
+async def get_ai_tip(request):
+    try:
+        subjects, sgpa = tip_request(await _json_body(request))
+        profile = tip_profile(subjects, sgpa)
+        tip, cached = await tip_cache.get_or_fetch_async(profile["key"],
+                                                         lambda: fetch_tip(build_prompt(profile)))
+    except TipError as e:
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+        return web.json_response(tip_error_body(e), status=e.status, headers=headers)
+    return web.json_response({"status": "success", "tip": tip, "cached": cached})
+
+
+async def get_ai_tip_stream(request):
+    try:
+        subjects, sgpa = tip_request(await _json_body(request))
+    except TipError as e:
+        return web.json_response(tip_error_body(e), status=e.status)
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache",
+                                           "X-Accel-Buffering": "no"})
+    await response.prepare(request)
+    # A client that hangs up fails the next write, and aclosing then closes the upstream stream
+    async with contextlib.aclosing(stream_tip(subjects, sgpa)) as tips:
+        try:
+            async for text in tips:
+                await response.write(sse_event("chunk", {"text": text}).encode())
+            await response.write(sse_event("done", {"status": "success"}).encode())
+        except TipError as e:
+            await response.write(sse_event("error", tip_error_body(e)).encode())
+        except ConnectionResetError:
+            log.debug("client_went_away", path=request.path)
+    return response
+
+
+# --- Everything else: the Flask app ---
+
+def _wsgi_environ(request, body):
+    host, _, port = (request.host or "localhost").partition(":")
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        # WSGI carries the decoded path as latin-1 code points of its UTF-8 bytes
+        "PATH_INFO": request.path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": request.query_string,
+        "CONTENT_TYPE": request.headers.get("Content-Type", ""),
+        "CONTENT_LENGTH": str(len(body)),
+        "SERVER_NAME": host,
+        "SERVER_PORT": port or ("443" if request.secure else "80"),
+        "SERVER_PROTOCOL": f"HTTP/{request.version.major}.{request.version.minor}",
+        "REMOTE_ADDR": request.remote or "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.scheme,
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name in request.headers.keys():
+        key = "HTTP_" + name.upper().replace("-", "_")
+        if key not in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+            environ[key] = ",".join(request.headers.getall(name))
+    return environ
+
+
+async def flask_route(request):
+    """Serve `request` with the Flask app, streaming its response back (SSE job events, bulk results)."""
+    loop = asyncio.get_running_loop()
+    body = await request.read()
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"], started["headers"] = status, headers
+
+    result = await loop.run_in_executor(wsgi_pool, flask_app, _wsgi_environ(request, body), start_response)
+    chunks = iter(result)
+    try:
+        chunk = await loop.run_in_executor(wsgi_pool, next, chunks, None)
+        code, _, reason = started["status"].partition(" ")
+        response = web.StreamResponse(status=int(code), reason=reason or None)
+        for name, value in started["headers"]:
+            response.headers.add(name, value)
+        await response.prepare(request)
+        try:
+            while chunk is not None:
+                if chunk:
+                    await response.write(chunk)
+                chunk = await loop.run_in_executor(wsgi_pool, next, chunks, None)
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client hung up mid-stream; closing `result` below stops the Flask side
+            log.debug("client_went_away", path=request.path)
+        return response
+    finally:
+        if hasattr(result, "close"):
+            await loop.run_in_executor(wsgi_pool, result.close)
+
+
+@web.middleware
+async def observe(request, handler):
+    # Flask records its own routes (see app.py); this covers the native ones
+    if request.match_info.handler is flask_route:
+        return await handler(request)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        endpoint = request.match_info.route.resource.canonical
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=status)
+        HTTP_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+
+
+async def _allow_any_origin(request, response):
+    # What flask_cors adds in app.py; Flask's own responses already carry it
+    response.headers.setdefault("Access-Control-Allow-Origin", "*")
+
+
+async def _open_pool(app):
+    await open_session()
+
+
+async def _close_pool(app):
+    await close_session()
+
+
+def make_app():
+    # Bulk uploads are bridged to Flask, which applies the smaller /upload limit itself
+    app = web.Application(client_max_size=BULK_MAX_CONTENT_LENGTH, middlewares=[observe])
+    app.router.add_post("/upload", upload)
+    app.router.add_post("/get-ai-tip", get_ai_tip)
+    app.router.add_post("/get-ai-tip/stream", get_ai_tip_stream)
+    # CORS preflights for the routes above fall through to here as well
+    app.router.add_route("*", "/{tail:.*}", flask_route)
+    app.on_startup.append(_open_pool)
+    app.on_cleanup.append(_close_pool)
+    app.on_response_prepare.append(_allow_any_origin)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(make_app(), host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", 5000)),
+                access_log=None)
@@ -0,0 +1,77 @@
+"""
+The shared outbound connection pool for the asyncio server (async_app.py),
+and the aiohttp version of http_client.post_with_retries.
+
+One aiohttp session serves every upstream (OCR.space, Gemini). Its
+connector keeps up to ASYNC_HTTP_POOL_SIZE connections open, so that many
+calls can be in flight at once without a thread each.
+"""
+import asyncio
+import os
+import aiohttp
+from http_client import RETRY_STATUS, retry_delay
+from logs import get_logger
+
+ASYNC_HTTP_POOL_SIZE = int(os.getenv("ASYNC_HTTP_POOL_SIZE", 512))
+
+log = get_logger("http")
+
+_session = None
+
+
+async def open_session():
+    """Create the shared session; call once the event loop is running."""
+    global _session
+    if _session is None:
+        connector = aiohttp.TCPConnector(limit=ASYNC_HTTP_POOL_SIZE)
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+def get_session():
+    if _session is None:
+        raise RuntimeError("open_session() has not been called")
+    return _session
+
+
+async def post_with_retries(session, url, retries=2, backoff=0.5, max_backoff=8.0, data=None, limiter=None,
+                            **kwargs):
+    """
+    POST with jittered exponential backoff on connection errors, timeouts
+    and RETRY_STATUS responses, like http_client.post_with_retries (retries
+    and 429s use `limiter` the same way). Returns the 2xx response with its body
+    already read, and raises the last error when every attempt has failed.
+
+    `data` may be a function returning the body, for bodies that can only
+    be sent once (aiohttp.FormData).
+    """
+    for attempt in range(retries + 1):
+        response = None
+        if attempt and limiter is not None:
+            # The slot paid for the first attempt; each retry is another call against the rate limit
+            await limiter.async_acquire()
+        try:
+            body = data() if callable(data) else data
+            async with session.post(url, data=body, **kwargs) as response:
+                await response.read()
+            if response.status not in RETRY_STATUS:
+                response.raise_for_status()
+                return response
+            if response.status == 429 and limiter is not None:
+                limiter.pause(retry_delay(attempt, backoff, max_backoff, response))
+            if attempt == retries:
+                response.raise_for_status()
+            log.warning("upstream_retry", url=url.split('?')[0], status=response.status, attempt=attempt + 1)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt == retries:
+                raise
+            log.warning("upstream_retry", url=url.split('?')[0], error=type(e).__name__, attempt=attempt + 1)
+
+        await asyncio.sleep(retry_delay(attempt, backoff, max_backoff, response))
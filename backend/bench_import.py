@@ -0,0 +1,72 @@
+"""
+Measure how long a fresh interpreter takes to import the API server.
+
+    python bench_import.py                 # 5 cold imports of app.py
+    python bench_import.py --budget 0.5    # fail if the median is slower
+
+Each run is a separate `python -X importtime -c "import app"` so nothing
+is cached in-process. Prints the median wall time and the modules that
+cost the most, which is where to look when the budget is blown.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def cold_import(module):
+    """Import `module` in a fresh interpreter; return (seconds, importtime lines)."""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr}")
+    return elapsed, [line for line in proc.stderr.splitlines() if line.startswith("import time:")]
+
+
+def slowest_modules(lines, module, top):
+    """`top` direct imports of `module` by cumulative time, from -X importtime output."""
+    entries = []
+    for line in lines[1:]:  # first line is the header
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = len(name) - len(name.lstrip())
+        entries.append((depth, int(cumulative_us), name.strip()))
+
+    # Children are printed before their parent, one indent level deeper
+    target_depth = next((depth for depth, _, name in reversed(entries) if name == module), 1)
+    direct = [(us, name) for depth, us, name in entries if depth == target_depth + 2]
+    return sorted(direct, reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Cold import-time benchmark")
+    arg_parser.add_argument("--module", default="app")
+    arg_parser.add_argument("--runs", type=int, default=5)
+    arg_parser.add_argument("--budget", type=float, default=1.0, help="max median seconds")
+    arg_parser.add_argument("--top", type=int, default=10)
+    args = arg_parser.parse_args()
+
+    timings = []
+    lines = []
+    for _ in range(args.runs):
+        elapsed, lines = cold_import(args.module)
+        timings.append(elapsed)
+
+    median = statistics.median(timings)
+    print(f"import {args.module}: median {median * 1000:.0f} ms over {args.runs} runs "
+          f"(min {min(timings) * 1000:.0f}, max {max(timings) * 1000:.0f})")
+    print("\nSlowest imports (cumulative):")
+    for cumulative_us, name in slowest_modules(lines, args.module, args.top):
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    if median > args.budget:
+        print(f"\n✗ Median import time {median:.2f}s is over the {args.budget:.2f}s budget")
+        sys.exit(1)
+    print(f"\n✓ Within the {args.budget:.2f}s budget")
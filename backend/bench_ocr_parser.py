@@ -0,0 +1,125 @@
+"""
+Benchmark the OCR text parser on large and malformed OCR dumps.
+
+    python bench_ocr_parser.py            # run all cases, fail on a budget miss
+    python bench_ocr_parser.py --legacy   # also time the old DOTALL regex
+
+Each case is parsed at two sizes (n and 4n). The parser has to stay
+linear - 4x the input may cost at most MAX_GROWTH x the time - and keep
+above MIN_MB_PER_SEC, so a garbage scan can never pin a worker.
+"""
+import argparse
+import contextlib
+import io
+import random
+import re
+import sys
+import time
+from parser import parse_ocr_text
+
+MAX_GROWTH = 8.0
+MIN_MB_PER_SEC = 1.0
+
+# The subject regex parse_ocr_text used before the tokenizer, kept for --legacy
+LEGACY_SUBJECT_PATTERN = re.compile(
+    r"([A-Z]{3,}\d{3}[A-Z]?)\s+(.+?)\s+(\d{1,2})\s+(\d{1,2})\s+(\d{2,3})",
+    re.DOTALL
+)
+
+WORDS = ["ANALYSIS", "DESIGN", "OF", "ALGORITHMS", "MICROCONTROLLERS", "DATABASE",
+         "MANAGEMENT", "SYSTEMS", "LAB", "&", "BIOLOGY", "ENGINEERS"]
+
+
+def valid_dump(rows):
+    """A long, well-formed card: one subject per line."""
+    rng = random.Random(1)
+    lines = ["University Seat Number : 1AB23CS001", "Student Name : TEST STUDENT"]
+    for i in range(rows):
+        internal, external = rng.randint(20, 50), rng.randint(0, 50)
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+        result = "P" if external >= 18 else "F"
+        lines.append(f"BCS{i % 1000:03d} {title} {internal} {external} {internal + external} {result}")
+    return "\n".join(lines)
+
+
+def codes_without_marks(rows):
+    """Every line opens a subject that never gets its marks - worst case for a lazy title group."""
+    return "\n".join(f"BCS{i % 1000:03d} " + " ".join(WORDS) for i in range(rows))
+
+
+def number_soup(rows):
+    """Columns of numbers that almost, but never quite, look like marks."""
+    return "BCS401 " + " ".join("1234 5" for _ in range(rows * 4))
+
+
+def random_garbage(rows):
+    rng = random.Random(2)
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 \n|/-.:"
+    return "".join(rng.choice(alphabet) for _ in range(rows * 40))
+
+
+def one_huge_token(rows):
+    return "B" * (rows * 40)
+
+
+CASES = {
+    "valid": valid_dump,
+    "codes_without_marks": codes_without_marks,
+    "number_soup": number_soup,
+    "random_garbage": random_garbage,
+    "one_huge_token": one_huge_token,
+}
+
+
+def time_call(fn, text):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn(text)
+    return time.perf_counter() - start
+
+
+def legacy_parse(text):
+    return LEGACY_SUBJECT_PATTERN.findall(text)
+
+
+def run(base_rows, legacy):
+    failures = []
+    print(f"{'case':<22}{'size':>10}{'time (ms)':>12}{'MB/s':>9}{'4x growth':>11}")
+
+    for name, make in CASES.items():
+        small, large = make(base_rows), make(base_rows * 4)
+        t_small = time_call(parse_ocr_text, small)
+        t_large = time_call(parse_ocr_text, large)
+        growth = t_large / max(t_small, 1e-9)
+        mb_per_sec = len(large) / 1e6 / max(t_large, 1e-9)
+        print(f"{name:<22}{len(large):>10}{t_large * 1000:>12.1f}{mb_per_sec:>9.1f}{growth:>11.1f}")
+
+        if growth > MAX_GROWTH:
+            failures.append(f"{name}: 4x input took {growth:.1f}x longer (max {MAX_GROWTH})")
+        if mb_per_sec < MIN_MB_PER_SEC:
+            failures.append(f"{name}: {mb_per_sec:.2f} MB/s (min {MIN_MB_PER_SEC})")
+
+        if legacy:
+            # Keep the legacy inputs small - its worst cases are quadratic
+            sample = make(max(base_rows // 20, 10))
+            t_legacy = time_call(legacy_parse, sample)
+            t_new = time_call(parse_ocr_text, sample)
+            print(f"{'  legacy regex':<22}{len(sample):>10}{t_legacy * 1000:>12.1f}"
+                  f"{'':>9}{'':>11}  (tokenizer: {t_new * 1000:.1f} ms)")
+
+    return failures
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--rows", type=int, default=5000, help="base size of each case")
+    arg_parser.add_argument("--legacy", action="store_true", help="also time the old regex")
+    args = arg_parser.parse_args()
+
+    failures = run(args.rows, args.legacy)
+    if failures:
+        print("\n✗ OCR parser benchmark failed:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("\n✓ OCR parser stays linear on every case")
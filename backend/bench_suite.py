@@ -0,0 +1,253 @@
+"""
+End-to-end benchmark suite on synthetic marks cards.
+
+    python bench_suite.py                       # run, compare with bench_baselines.json
+    python bench_suite.py --update-baselines    # record this machine's numbers
+    python bench_suite.py --only digital        # cases whose name contains "digital"
+
+Cards come from synthetic_cards.py: digital cards of different sizes,
+a consolidated card with several semesters, rasterized scans (OCR'd through a local fake_ocr_server.py, so only our
+own overhead is timed), and OCR text dumps with and without noise or misread subject codes.
+
+parse_marks_card is timed per stage from its progress callback - open,
+extract (text layer, plus OCR for scans), parse and grade - alongside
+parse_ocr_text and calculate_cgpa_data. Each case reports p50/p95 over
+--runs iterations and the peak Python memory of one extra traced run.
+A case fails when its p95 or peak memory grows past the stored baseline
+by more than the tolerance, or its parse accuracy drops.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import parser as marks_parser
+from parser import parse_marks_card, parse_ocr_text
+from app import calculate_cgpa_data
+from fake_ocr_server import make_server
+from synthetic_cards import make_card, make_consolidated_card, rasterize, ocr_text
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baselines.json")
+# Allowed growth over the baseline before a case counts as a regression
+TIME_TOLERANCE = 0.5
+MEMORY_TOLERANCE = 0.25
+# Timings this small are noise; never flag a stage under it
+MIN_FLAGGED_MS = 1.0
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def _quiet(fn, *args):
+    # Keep anything still printed to stdout out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args)
+
+
+def _subject_keys(subjects):
+    return {(s["code"], s["internal"], s["external"], s["total"], s["result"]) for s in subjects or []}
+
+
+def accuracy(found, expected):
+    """Share of expected subjects parsed exactly, less a penalty for spurious ones."""
+    want = _subject_keys(expected)
+    got = _subject_keys(found)
+    return round(max(0.0, (len(got & want) - len(got - want)) / len(want)), 3)
+
+
+def time_card(pdf):
+    """parse_marks_card once; returns ({stage: seconds}, result)."""
+    marks = []
+    start = time.perf_counter()
+
+    def progress(stage, **_):
+        if stage in ("opened", "text_extracted", "parsed"):
+            marks.append(time.perf_counter())
+
+    result = _quiet(parse_marks_card, pdf, progress)
+    end = time.perf_counter()
+    if len(marks) < 3:
+        return None, result
+    opened, extracted, parsed = marks[:3]
+    return {"open": opened - start, "extract": extracted - opened,
+            "parse": parsed - extracted, "grade": end - parsed}, result
+
+
+def card_case(pdf, expected):
+    def run():
+        stages, result = time_card(pdf)
+        if stages is None:
+            raise RuntimeError(f"parse failed: {result.get('message')}")
+        if "semesters" in expected:
+            # Worst semester, so a row put under the wrong semester counts
+            found = {s["semester"]: s["subjects"] for s in result.get("semesters") or []}
+            return stages, min(accuracy(found.get(s["semester"]), s["subjects"]) for s in expected["semesters"])
+        return stages, accuracy(result.get("subjects"), expected["subjects"])
+    return run
+
+
+def ocr_text_case(text, expected):
+    def run():
+        start = time.perf_counter()
+        subjects = _quiet(parse_ocr_text, text)
+        return {"parse_ocr_text": time.perf_counter() - start}, accuracy(subjects, expected["subjects"])
+    return run
+
+
+def cgpa_case(past, new_sgpa):
+    past_str = ",".join(str(s) for s in past)
+
+    def run():
+        start = time.perf_counter()
+        calculate_cgpa_data(past_str, new_sgpa)
+        return {"calculate_cgpa_data": time.perf_counter() - start}, None
+    return run
+
+
+def build_cases(ocr_server):
+    """{name: (runs_scale, run)}; the raster cases point the fake OCR server at their text."""
+    cases = {}
+    for subjects, pages in ((9, 1), (9, 4), (24, 2), (60, 1)):
+        pdf, expected = make_card(subjects, pages, seed=subjects)
+        cases[f"digital-{subjects}x{pages}"] = (1.0, card_case(pdf, expected))
+    pdf, expected = make_consolidated_card((1, 2, 3, 4), 9, seed=4)
+    cases["digital-consolidated-4x9"] = (1.0, card_case(pdf, expected))
+
+    pdf, expected = make_card(9, 1, seed=9)
+    scan = rasterize(pdf)
+    text = ocr_text(expected)
+    run = card_case(scan, expected)
+
+    def raster_run():
+        ocr_server.config.text = text
+        return run()
+    cases["raster-9x1"] = (0.25, raster_run)
+
+    for subjects, noise in ((9, 0.0), (9, 0.3), (200, 0.3)):
+        _, expected = make_card(subjects, 1, seed=subjects)
+        cases[f"ocr-text-{subjects}-noise{noise}"] = (1.0, ocr_text_case(ocr_text(expected, noise, seed=1), expected))
+    _, expected = make_card(9, 1, seed=9)
+    cases["ocr-text-9-misreads0.5"] = (1.0, ocr_text_case(ocr_text(expected, 0.3, seed=1, misreads=0.5), expected))
+
+    cases["cgpa-2-semesters"] = (1.0, cgpa_case([7.2, 7.8], 8.1))
+    cases["cgpa-7-semesters"] = (1.0, cgpa_case([7.2, 7.8, 8.1, 6.9, 7.5, 8.4, 8.0], 8.3))
+    return cases
+
+
+def measure(run, runs):
+    """Time `runs` iterations after a warm-up, then one traced run for peak memory."""
+    run()
+    samples = {}
+    accuracies = []
+    for _ in range(runs):
+        stages, acc = run()
+        for stage, seconds in stages.items():
+            samples.setdefault(stage, []).append(seconds)
+        accuracies.append(acc)
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    report = {
+        "stages": {stage: {"p50_ms": round(percentile(values, 50) * 1000, 3),
+                           "p95_ms": round(percentile(values, 95) * 1000, 3)}
+                   for stage, values in samples.items()},
+        "peak_kb": round(peak / 1024, 1),
+    }
+    if accuracies[0] is not None:
+        report["accuracy"] = min(accuracies)
+    return report
+
+
+def regressions(name, report, baseline, time_tolerance, memory_tolerance):
+    """Human-readable reasons `report` is worse than `baseline`, if any."""
+    problems = []
+    for stage, numbers in report["stages"].items():
+        old = baseline.get("stages", {}).get(stage)
+        if not old:
+            continue
+        limit = max(old["p95_ms"] * (1 + time_tolerance), MIN_FLAGGED_MS)
+        if numbers["p95_ms"] > limit:
+            problems.append(f"{name} {stage}: p95 {numbers['p95_ms']:.2f} ms > {limit:.2f} ms "
+                            f"(baseline {old['p95_ms']:.2f} ms)")
+    if "peak_kb" in baseline:
+        limit = baseline["peak_kb"] * (1 + memory_tolerance)
+        if report["peak_kb"] > limit:
+            problems.append(f"{name}: peak memory {report['peak_kb']:.0f} KB > {limit:.0f} KB "
+                            f"(baseline {baseline['peak_kb']:.0f} KB)")
+    if "accuracy" in baseline and report.get("accuracy", 1.0) < baseline["accuracy"]:
+        problems.append(f"{name}: accuracy {report['accuracy']} < baseline {baseline['accuracy']}")
+    return problems
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Marks card benchmark suite")
+    arg_parser.add_argument("--runs", type=int, default=20)
+    arg_parser.add_argument("--only", help="run cases whose name contains this")
+    arg_parser.add_argument("--baselines", default=BASELINES_PATH)
+    arg_parser.add_argument("--update-baselines", action="store_true")
+    arg_parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    arg_parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    args = arg_parser.parse_args()
+    # One card_parsed line per iteration would drown the report
+    logging.getLogger("vtu").setLevel(logging.WARNING)
+
+    ocr_server = make_server(port=0, latency=0.0, jitter=0.0)
+    threading.Thread(target=ocr_server.serve_forever, daemon=True).start()
+    marks_parser.OCR_SPACE_URL = f"http://127.0.0.1:{ocr_server.server_port}/parse/image"
+    os.environ["OCR_SPACE_API_KEY"] = "bench"
+
+    reports = {}
+    for name, (scale, run) in build_cases(ocr_server).items():
+        if args.only and args.only not in name:
+            continue
+        reports[name] = report = measure(run, max(3, int(args.runs * scale)))
+        for stage, numbers in report["stages"].items():
+            print(f"{name:28} {stage:20} p50 {numbers['p50_ms']:9.2f} ms   p95 {numbers['p95_ms']:9.2f} ms")
+        extra = f"   accuracy {report['accuracy']:.3f}" if "accuracy" in report else ""
+        print(f"{name:28} {'peak memory':20} {report['peak_kb']:9.0f} KB{extra}")
+    ocr_server.shutdown()
+
+    if args.update_baselines:
+        baselines = {}
+        if os.path.exists(args.baselines):
+            with open(args.baselines, encoding="utf-8") as f:
+                baselines = json.load(f)
+        baselines.update(reports)
+        with open(args.baselines, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\n✓ Baselines for {len(reports)} case(s) written to {args.baselines}")
+        sys.exit(0)
+
+    if not os.path.exists(args.baselines):
+        print(f"\n⚠️  No baselines at {args.baselines}; run with --update-baselines first")
+        sys.exit(0)
+    with open(args.baselines, encoding="utf-8") as f:
+        baselines = json.load(f)
+
+    problems = []
+    for name, report in reports.items():
+        if name in baselines:
+            problems += regressions(name, report, baselines[name], args.time_tolerance, args.memory_tolerance)
+        else:
+            print(f"⚠️  {name} has no baseline yet")
+    if problems:
+        print("\n✗ Regressions against the baselines:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print(f"\n✓ {len(reports)} case(s) within the baselines")
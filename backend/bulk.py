@@ -0,0 +1,155 @@
+import io
+import json
+import os
+import zipfile
+import zlib
+from concurrent.futures import wait, FIRST_COMPLETED
+from cache import result_cache, content_hash
+from cohort import cohort_stats
+from store import result_store
+from scheduler import PRIORITY_BULK
+from workers import parse_pool
+
+# Parsing is CPU-bound (PyMuPDF + regex), so cards are spread over the
+# supervised worker processes in workers.py, not threads.
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", 500))
+BULK_MAX_CONTENT_LENGTH = int(os.getenv("BULK_MAX_CONTENT_LENGTH", 256 * 1024 * 1024))
+BULK_MAX_UNZIPPED_BYTES = int(os.getenv("BULK_MAX_UNZIPPED_BYTES", 512 * 1024 * 1024))
+# Parsed cards are written to the result store in batches of this many
+BULK_STORE_BATCH = 50
+
+def _is_pdf_name(name):
+    return name.lower().endswith('.pdf')
+
+
+def _pdfs_from_zip(archive_name, data, rejected, max_files=BULK_MAX_FILES):
+    """
+    Yield (name, bytes) for every PDF inside a ZIP archive. A member that
+    can't be extracted goes into `rejected` as (name, message) instead.
+    Raises ValueError, before inflating anything, when the archive holds
+    more than `max_files` PDFs or too many bytes.
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise ValueError(f"{archive_name} is not a valid ZIP file")
+
+    with archive:
+        members = [m for m in archive.infolist()
+                   if not m.is_dir()
+                   and _is_pdf_name(m.filename)
+                   and not m.filename.startswith('__MACOSX/')]
+        # Check the count and declared sizes up front so a zip bomb is rejected before inflating it
+        if len(members) > max_files:
+            raise ValueError(f"Too many files in batch (max {BULK_MAX_FILES})")
+        if sum(m.file_size for m in members) > BULK_MAX_UNZIPPED_BYTES:
+            raise ValueError(f"{archive_name} is too large once extracted")
+        for member in members:
+            name = f"{archive_name}/{member.filename}"
+            try:
+                yield name, archive.read(member)
+            except (zipfile.BadZipFile, zlib.error, EOFError, RuntimeError, NotImplementedError) as e:
+                # Corrupt, truncated, encrypted or oddly compressed: lose only this file
+                rejected.append((name, f"Could not extract this file from the ZIP ({e})"))
+
+
+def collect_pdfs(uploaded_files):
+    """
+    Flatten a multipart batch (loose PDFs and/or ZIPs of PDFs) into a list
+    of (name, bytes). Anything that isn't a PDF, or can't be extracted,
+    comes back in `rejected` as (name, message).
+    """
+    items = []
+    rejected = []
+
+    for file in uploaded_files:
+        name = file.filename or ''
+        lower = name.lower()
+        if lower.endswith('.zip'):
+            items.extend(_pdfs_from_zip(name, file.read(), rejected, BULK_MAX_FILES - len(items)))
+        elif _is_pdf_name(lower):
+            items.append((name, file.read()))
+        else:
+            rejected.append((name, "Not a PDF file"))
+
+        if len(items) > BULK_MAX_FILES:
+            raise ValueError(f"Too many files in batch (max {BULK_MAX_FILES})")
+
+    return items, rejected
+
+
+def _line(payload):
+    return json.dumps(payload) + "\n"
+
+
+def stream_results(items, rejected=()):
+    """
+    Parse every (name, bytes) item on the worker pool and yield one NDJSON
+    line per card as soon as it finishes, followed by a summary line.
+    Cards already in the result cache are answered without touching the pool.
+
+    At most 2 x workers cards are in flight at once so the pool queue never
+    holds the whole batch's bytes pickled at the same time.
+    """
+    succeeded = 0
+    failed = 0
+
+    for name, message in rejected:
+        failed += 1
+        yield _line({"file": name, "status": "error", "message": message})
+
+    max_in_flight = parse_pool.size * 2
+    pending = {}
+    queue = iter(items)
+    unsaved = []
+
+    try:
+        while True:
+            while len(pending) < max_in_flight:
+                item = next(queue, None)
+                if item is None:
+                    break
+                name, data = item
+                key = content_hash(data)
+                cached = result_cache.get(key)
+                if cached is not None:
+                    cohort_stats.record(cached)
+                    unsaved.append(cached)
+                    succeeded += 1
+                    yield _line({"file": name, **cached})
+                    continue
+                pending[parse_pool.submit(data, priority=PRIORITY_BULK)] = (name, key)
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, key = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # WorkerCrashed included: the pool has already replaced the worker; only this card is lost
+                    result = {"status": "error", "message": str(e)}
+
+                if result.get("status") == "success":
+                    result_cache.put(key, result)
+                    cohort_stats.record(result)
+                    unsaved.append(result)
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield _line({"file": name, **result})
+
+            if len(unsaved) >= BULK_STORE_BATCH:
+                result_store.save_results(unsaved)
+                unsaved = []
+    finally:
+        if unsaved:
+            result_store.save_results(unsaved)
+        # Client went away mid-stream: don't keep parsing cards nobody will read
+        for future in pending:
+            future.cancel()
+
+    yield _line({"status": "done", "total": succeeded + failed,
+                 "succeeded": succeeded, "failed": failed})
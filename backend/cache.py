@@ -0,0 +1,189 @@
+import copy
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from parser import PARSER_VERSION
+from catalog import credit_catalog
+from logs import get_logger
+
+log = get_logger("cache")
+
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 1024))
+# Set RESULT_CACHE_DIR to an empty string to keep the cache in memory only
+RESULT_CACHE_DIR = os.getenv(
+    "RESULT_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "results"),
+)
+
+
+def content_hash(pdf_bytes):
+    """SHA-256 of the uploaded file - identical PDFs share one cache entry."""
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def cache_version():
+    """
+    Fingerprint of everything that affects a parse result besides the PDF
+    itself. Changing the parser or the credit catalog gives a new version,
+    which makes every older entry a miss.
+    """
+    material = PARSER_VERSION + credit_catalog.version
+    return hashlib.sha256(material.encode()).hexdigest()[:16]
+
+
+class _Flight:
+    """A parse currently running for some key; latecomers wait on it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResultCache:
+    """
+    Two-tier cache of parse results keyed by PDF content hash:
+    a size-bounded in-memory LRU in front of JSON files on disk.
+
+    Concurrent requests for the same key are coalesced - only the first one
+    parses, the rest block until it finishes and reuse its result.
+    Only successful results are stored; errors (e.g. an OCR timeout) are
+    left uncached so the next upload gets a fresh attempt.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, cache_dir=RESULT_CACHE_DIR):
+        self.max_entries = max_entries
+        self.root_dir = cache_dir
+        self.version = None
+        self.cache_dir = None
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._check_version()
+
+    def _check_version(self):
+        """Start a fresh cache when the credit catalog has been reloaded."""
+        version = cache_version()
+        if version == self.version:
+            return
+        with self._lock:
+            if version == self.version:
+                return
+            self.version = version
+            self._memory.clear()
+            self.cache_dir = os.path.join(self.root_dir, version) if self.root_dir else None
+            if self.cache_dir:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                self._prune_old_versions(self.root_dir)
+
+    def _prune_old_versions(self, root):
+        # Only touch directories that look like one of our version stamps
+        for entry in os.listdir(root):
+            if entry != self.version and len(entry) == 16 and all(c in "0123456789abcdef" for c in entry):
+                shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def _remember(self, key, result):
+        # Caller holds self._lock
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return a copy of the cached result for `key`, or None."""
+        self._check_version()
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(result)
+
+        result = self._read_disk(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, result)
+        return copy.deepcopy(result)
+
+    def put(self, key, result):
+        if not result or result.get("status") != "success":
+            return
+        result = copy.deepcopy(result)
+        with self._lock:
+            self._remember(key, result)
+        self._write_disk(key, result)
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, result):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so readers never see half a file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(result, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.warning("cache_write_failed", key=key[:12], error=str(e))
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached result for `key`, or run `compute()` exactly once
+        across all concurrent callers and cache what it returns.
+        """
+        result = self.get(key)
+        if result is not None:
+            return result
+
+        with self._lock:
+            # Another leader may have finished between our miss and this lock
+            if key in self._memory:
+                return copy.deepcopy(self._memory[key])
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            flight.result = compute()
+            self.put(key, flight.result)
+            return copy.deepcopy(flight.result)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+
+result_cache = ResultCache()
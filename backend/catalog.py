@@ -0,0 +1,331 @@
+"""
+Credit catalog: subject code -> credits, title and maximum marks, for every
+scheme and semester listed in credits_catalog.csv.
+
+The shipped CSV only lists the 2022 scheme's 4th-semester codes (what the
+old CREDITS_MAP covered); rows for the other schemes and semesters still
+have to be added. Until then their codes have no credits, and a semester
+made only of such codes is reported without an SGPA rather than as 0.0.
+
+The CSV is compiled once into a flat binary hash table which every process
+mmaps read-only, so the OS keeps a single copy of it in the page cache no
+matter how many bulk/job workers are running, and nothing is unpacked into
+Python dicts up front. A lookup hashes the code, probes the slot table and
+unpacks one fixed-size record - O(1), with memory flat as the catalog grows.
+
+Editing the CSV is enough to change credits: each process notices the new
+file within CATALOG_CHECK_INTERVAL seconds, recompiles it if nobody else
+has yet and remaps the new table - no restart needed.
+
+    python catalog.py              # compile the catalog and self-check it
+"""
+import csv
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from logs import get_logger
+
+log = get_logger("catalog")
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+CREDITS_CATALOG = os.getenv("CREDITS_CATALOG", os.path.join(BACKEND_DIR, "credits_catalog.csv"))
+CREDITS_CATALOG_BIN = os.getenv(
+    "CREDITS_CATALOG_BIN", os.path.join(BACKEND_DIR, ".cache", "credits_catalog.bin")
+)
+# How often (seconds) a process checks the CSV for changes
+CATALOG_CHECK_INTERVAL = float(os.getenv("CATALOG_CHECK_INTERVAL", 2))
+
+# File layout: header, slot table, records, then the code/title strings.
+# Slots hold record index + 1 (0 = empty); records point into the strings.
+MAGIC = b"CRCAT\x00\x01\x00"
+HEADER = struct.Struct("<8sII16s")      # magic, slot count, record count, CSV digest
+SLOT = struct.Struct("<I")
+RECORD = struct.Struct("<IHIHBHHHB")    # code off/len, title off/len, credits,
+                                        # max internal, max external, scheme, semester
+FIELDS = ("code", "credits", "title", "max_internal", "max_external", "scheme", "semester")
+# Largest value each numeric column fits in its RECORD field
+FIELD_MAX = {"credits": 0xFF, "max_internal": 0xFFFF, "max_external": 0xFFFF, "scheme": 0xFFFF, "semester": 0xFF}
+
+
+def _hash(code_bytes):
+    # crc32, not hash(): it must agree across processes and interpreter runs
+    return zlib.crc32(code_bytes)
+
+
+def read_catalog_csv(path):
+    """Rows of the catalog CSV as tuples in FIELDS order; a later duplicate code wins."""
+    entries = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for line_number, row in enumerate(csv.DictReader(f), start=2):
+            code = (row.get("code") or "").strip().upper()
+            if not code or code.startswith("#"):
+                continue
+            try:
+                entry = (
+                    code,
+                    int(row["credits"]),
+                    (row.get("title") or "").strip(),
+                    int(row.get("max_internal") or 50),
+                    int(row.get("max_external") or 50),
+                    int(row.get("scheme") or 0),
+                    int(row.get("semester") or 0),
+                )
+            except (KeyError, ValueError) as e:
+                raise ValueError(f"{path}:{line_number}: bad catalog row ({e})") from None
+            for field, value in zip(FIELDS, entry):
+                if field in FIELD_MAX and not 0 <= value <= FIELD_MAX[field]:
+                    raise ValueError(f"{path}:{line_number}: {field} {value} is outside 0-{FIELD_MAX[field]}")
+            if code in entries:
+                log.warning("catalog_duplicate_code", path=path, line=line_number, code=code)
+            entries[code] = entry
+    return list(entries.values())
+
+
+def build_catalog(csv_path=CREDITS_CATALOG, bin_path=CREDITS_CATALOG_BIN):
+    """Compile the CSV into the binary table at `bin_path` (atomically). Returns the entry count."""
+    with open(csv_path, "rb") as f:
+        digest = hashlib.sha256(f.read()).digest()[:16]
+    entries = read_catalog_csv(csv_path)
+
+    # Power-of-two slot table at most half full keeps probe chains short
+    slot_count = 8
+    while slot_count < 2 * len(entries):
+        slot_count *= 2
+    slots = [0] * slot_count
+    strings_start = HEADER.size + SLOT.size * slot_count + RECORD.size * len(entries)
+    strings = bytearray()
+    records = bytearray()
+
+    for index, (code, credits, title, max_internal, max_external, scheme, semester) in enumerate(entries):
+        code_bytes, title_bytes = code.encode(), title.encode()[:0xFFFF]
+        code_offset = strings_start + len(strings)
+        strings += code_bytes
+        title_offset = strings_start + len(strings)
+        strings += title_bytes
+        records += RECORD.pack(code_offset, len(code_bytes), title_offset, len(title_bytes),
+                               credits, max_internal, max_external, scheme, semester)
+        slot = _hash(code_bytes) & (slot_count - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (slot_count - 1)
+        slots[slot] = index + 1
+
+    os.makedirs(os.path.dirname(bin_path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(bin_path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(HEADER.pack(MAGIC, slot_count, len(entries), digest))
+        f.write(struct.pack(f"<{slot_count}I", *slots))
+        f.write(records)
+        f.write(strings)
+    # The compiled file carries the CSV's mtime, so any edit - even one that
+    # restores an older copy - shows up as a mismatch
+    csv_stat = os.stat(csv_path)
+    os.utime(tmp_path, ns=(csv_stat.st_atime_ns, csv_stat.st_mtime_ns))
+    os.replace(tmp_path, bin_path)
+    return len(entries)
+
+
+class _Table:
+    """One mapped, immutable version of the compiled catalog."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.slot_count, self.count, digest = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a compiled credit catalog")
+        self.digest = digest.hex()
+        self.records_start = HEADER.size + SLOT.size * self.slot_count
+
+    def find(self, code):
+        """The raw record tuple for `code`, or None."""
+        code_bytes = code.encode()
+        buffer = self.buffer
+        mask = self.slot_count - 1
+        slot = _hash(code_bytes) & mask
+        while True:
+            index = SLOT.unpack_from(buffer, HEADER.size + SLOT.size * slot)[0]
+            if not index:
+                return None
+            record = RECORD.unpack_from(buffer, self.records_start + RECORD.size * (index - 1))
+            if buffer[record[0]:record[0] + record[1]] == code_bytes:
+                return record
+            slot = (slot + 1) & mask
+
+    def codes(self):
+        """Every code in the table, in record order."""
+        for i in range(self.count):
+            record = RECORD.unpack_from(self.buffer, self.records_start + RECORD.size * i)
+            yield self.buffer[record[0]:record[0] + record[1]].decode()
+
+
+class CreditCatalog:
+    """
+    Read-only view of the compiled catalog that follows edits to the CSV.
+    Lookups never take a lock: a reload builds a new _Table and swaps the
+    reference, and the old mapping is released once nothing uses it.
+    """
+
+    def __init__(self, csv_path=CREDITS_CATALOG, bin_path=CREDITS_CATALOG_BIN,
+                 check_interval=CATALOG_CHECK_INTERVAL):
+        self.csv_path = csv_path
+        self.bin_path = bin_path
+        self.check_interval = check_interval
+        self._table = None
+        self._checked_at = 0.0
+        # (mtime, size) of a CSV that failed to compile, so it isn't retried until it changes
+        self._failed_csv = None
+        self._reload_lock = threading.Lock()
+        self._reload()
+
+    def _stale(self):
+        try:
+            return os.stat(self.csv_path).st_mtime_ns != os.stat(self.bin_path).st_mtime_ns
+        except FileNotFoundError:
+            return True
+
+    def _reload(self):
+        with self._reload_lock:
+            self._checked_at = time.monotonic()
+            try:
+                if self._stale():
+                    csv_stat = os.stat(self.csv_path)
+                    csv_version = (csv_stat.st_mtime_ns, csv_stat.st_size)
+                    if csv_version == self._failed_csv:
+                        return
+                    try:
+                        count = build_catalog(self.csv_path, self.bin_path)
+                    except (OSError, ValueError):
+                        self._failed_csv = csv_version
+                        raise
+                    self._failed_csv = None
+                    log.info("catalog_compiled", codes=count)
+                stat = os.stat(self.bin_path)
+                table = self._table
+                if table is None or table.identity != (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+                    self._table = _Table(self.bin_path)
+            except (OSError, ValueError) as e:
+                # Keep serving the previous table rather than failing parses
+                log.error("catalog_load_failed", error=str(e))
+
+    def _current(self):
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self._reload()
+        return self._table
+
+    @property
+    def version(self):
+        """Digest of the CSV the current table was built from."""
+        table = self._current()
+        return table.digest if table else ""
+
+    def __len__(self):
+        table = self._current()
+        return table.count if table else 0
+
+    def codes(self):
+        """Every listed code - for building indexes over the catalog (see ocr_codes.py)."""
+        table = self._current()
+        return list(table.codes()) if table else []
+
+    def get(self, code):
+        """Catalog entry for `code` as a dict, or None if it isn't listed."""
+        table = self._current()
+        record = table.find(code.upper()) if table and code else None
+        if record is None:
+            return None
+        code_offset, code_len, title_offset, title_len = record[:4]
+        buffer = table.buffer
+        return dict(zip(FIELDS, (
+            buffer[code_offset:code_offset + code_len].decode(),
+            record[4],
+            buffer[title_offset:title_offset + title_len].decode(),
+            *record[5:],
+        )))
+
+    def credits(self, code, default=0):
+        """Credits for `code`, or `default` if it isn't listed."""
+        table = self._current()
+        record = table.find(code.upper()) if table and code else None
+        return record[4] if record else default
+
+
+credit_catalog = CreditCatalog()
+
+
+def test_catalog():
+    """Round-trip a large synthetic catalog and check hot reload."""
+    print("Running credit catalog checks...")
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "catalog.csv")
+        bin_path = os.path.join(tmp, "catalog.bin")
+        rows = [(f"B{dept}{sem}{n:02d}", (n % 4) + 1, f"SUBJECT {dept} {sem} {n}", 50, 50, 2022, sem)
+                for dept in ("CS", "EC", "ME", "CV", "AI", "IS") for sem in range(1, 9) for n in range(60)]
+        with open(csv_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            writer.writerows(rows)
+
+        catalog = CreditCatalog(csv_path, bin_path, check_interval=0)
+        assert len(catalog) == len(rows)
+        for row in rows:
+            assert catalog.get(row[0]) == dict(zip(FIELDS, row))
+        assert catalog.get("NOPE101") is None and catalog.credits("NOPE101") == 0
+        assert sorted(catalog.codes()) == sorted(row[0] for row in rows)
+
+        start = time.perf_counter()
+        for row in rows:
+            catalog.credits(row[0])
+        per_lookup = (time.perf_counter() - start) / len(rows)
+        print(f"✓ {len(rows)} codes, {os.path.getsize(bin_path) // 1024} KB mapped, "
+              f"{per_lookup * 1e6:.1f} µs per lookup")
+
+        version = catalog.version
+        with open(csv_path, "a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerow(("BCS101", 9, "CHANGED", 50, 50, 2022, 1))
+        os.utime(csv_path, ns=(time.time_ns() + 10**9,) * 2)
+        assert catalog.credits("BCS101") == 9 and catalog.version != version
+        print("✓ Catalog reloads after the CSV changes")
+
+        # A value that doesn't fit its field is rejected with its line, and
+        # the running catalog keeps the previous table
+        version = catalog.version
+        with open(csv_path, "a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerow(("BCS999", 300, "TOO MANY CREDITS", 50, 50, 2022, 1))
+        os.utime(csv_path, ns=(time.time_ns() + 2 * 10**9,) * 2)
+        try:
+            read_catalog_csv(csv_path)
+            raise AssertionError("out-of-range credits accepted")
+        except ValueError as e:
+            assert f":{len(rows) + 3}: credits 300" in str(e), e
+        assert catalog.credits("BCS101") == 9 and catalog.version == version
+
+        # The broken CSV isn't recompiled on every check, only once it changes
+        builds = []
+        real_build_catalog = build_catalog
+        globals()["build_catalog"] = lambda *args: builds.append(args) or real_build_catalog(*args)
+        try:
+            for _ in range(3):
+                catalog._reload()
+            assert not builds
+            with open(csv_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(FIELDS)
+                writer.writerows(rows)
+            os.utime(csv_path, ns=(time.time_ns() + 3 * 10**9,) * 2)
+            assert catalog.credits("BCS101") != 9 and catalog.credits("BCS999") == 0
+            assert len(builds) == 1
+        finally:
+            globals()["build_catalog"] = real_build_catalog
+        print("✓ Out-of-range rows are rejected, the previous catalog is kept and the bad CSV isn't retried")
+
+
+if __name__ == "__main__":
+    test_catalog()
+    print(f"✓ {CREDITS_CATALOG}: {len(credit_catalog)} codes, version {credit_catalog.version}")
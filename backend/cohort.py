@@ -0,0 +1,216 @@
+import threading
+from store import result_store
+
+# Subject totals are bucketed 0-9, 10-19, ..., 90-100
+MARK_BINS = 10
+# SGPA distribution in 0.1 steps, 0.0 to 10.0 inclusive
+SGPA_BINS = 101
+
+
+class RunningStats:
+    """Count, mean and variance updated one value at a time (Welford)."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def remove(self, value):
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        old_mean = self.mean
+        self.count -= 1
+        self.mean = (old_mean * (self.count + 1) - value) / self.count
+        self.m2 = max(0.0, self.m2 - (value - self.mean) * (value - old_mean))
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else 0.0
+
+
+class SubjectStats:
+    def __init__(self):
+        self.totals = RunningStats()
+        self.histogram = [0] * MARK_BINS
+        self.passed = 0
+        self.failed = 0
+
+    def update(self, total, result, sign):
+        """Add (sign=1) or take back (sign=-1) one student's marks."""
+        if sign > 0:
+            self.totals.add(total)
+        else:
+            self.totals.remove(total)
+        self.histogram[min(max(total, 0) // 10, MARK_BINS - 1)] += sign
+        if result == 'F':
+            self.failed += sign
+        else:
+            self.passed += sign
+
+    def to_dict(self, code):
+        count = self.passed + self.failed
+        return {
+            "code": code,
+            "students": count,
+            "mean_total": round(self.totals.mean, 2),
+            "std_total": round(self.totals.variance ** 0.5, 2),
+            "passed": self.passed,
+            "failed": self.failed,
+            "pass_rate": round(self.passed / count, 4) if count else None,
+            "histogram": [
+                {"range": f"{i * 10}-{i * 10 + 9 if i < MARK_BINS - 1 else 100}", "count": n}
+                for i, n in enumerate(self.histogram)
+            ],
+        }
+
+
+def _sgpa_bin(sgpa):
+    return min(max(int(round(sgpa * 10)), 0), SGPA_BINS - 1)
+
+
+class SemesterStats:
+    def __init__(self):
+        self.sgpa = RunningStats()
+        self.histogram = [0] * SGPA_BINS
+
+    def update(self, sgpa, sign):
+        self.histogram[_sgpa_bin(sgpa)] += sign
+        if sign > 0:
+            self.sgpa.add(sgpa)
+        else:
+            self.sgpa.remove(sgpa)
+
+
+class CohortStats:
+    """
+    Running class-wide aggregates, updated in O(subjects) per parsed card.
+
+    Every query reads fixed-size aggregates - a 101-bin SGPA histogram per
+    semester and per-subject counters - so answering never rescans past
+    cards. Records are keyed by (USN, semester): another semester of the
+    same student is a new record, while the same semester seen again (a
+    re-upload or revaluation) replaces its earlier numbers instead of being
+    counted twice. The aggregates are rebuilt from the result store on
+    first use, so a restart - or a new worker process - starts from every
+    stored card rather than an empty cohort.
+    """
+
+    def __init__(self, store=None):
+        self._lock = threading.Lock()
+        self._store = store
+        self._loaded = store is None
+        self._records = {}
+        self._usn_semesters = {}
+        self._subjects = {}
+        self._semesters = {}
+        self._sgpa = RunningStats()
+
+    def _apply(self, record, sign):
+        # Caller holds self._lock
+        self._semesters.setdefault(record["semester"], SemesterStats()).update(record["sgpa"], sign)
+        if sign > 0:
+            self._sgpa.add(record["sgpa"])
+        else:
+            self._sgpa.remove(record["sgpa"])
+        for code, (total, result) in record["subjects"].items():
+            self._subjects.setdefault(code, SubjectStats()).update(total, result, sign)
+
+    def _put(self, usn, record):
+        # Caller holds self._lock
+        key = (usn, record["semester"])
+        previous = self._records.get(key)
+        if previous:
+            self._apply(previous, -1)
+        self._records[key] = record
+        self._usn_semesters.setdefault(usn, set()).add(record["semester"])
+        self._apply(record, 1)
+
+    def _ensure_loaded(self):
+        # Caller holds self._lock
+        if self._loaded:
+            return
+        self._loaded = True
+        for usn, semester, sgpa, subjects in self._store.cohort_records():
+            self._put(usn, {"semester": semester, "sgpa": sgpa, "subjects": subjects})
+
+    def record(self, results):
+        """Fold a successful parse_marks_card result into the aggregates, one record per semester."""
+        if not results or results.get("status") != "success" or not results.get("usn"):
+            return
+        # Same rule as the result store: a card without a semester isn't kept
+        if results.get("semester") is None:
+            return
+        usn = results["usn"].upper()
+        records = [
+            {
+                "semester": graded["semester"],
+                "sgpa": graded["sgpa"],
+                "subjects": {s["code"]: (s["total"], s["result"]) for s in graded["subjects"]},
+            }
+            for graded in results.get("semesters") or [results]
+        ]
+        with self._lock:
+            self._ensure_loaded()
+            for record in records:
+                self._put(usn, record)
+
+    def percentile_rank(self, usn, semester=None):
+        """
+        Share of the semester's cohort (0-100) with a lower SGPA than `usn`,
+        ties counted half. Defaults to the latest semester recorded for `usn`.
+        """
+        usn = usn.upper()
+        with self._lock:
+            self._ensure_loaded()
+            if semester is None:
+                semester = max(self._usn_semesters.get(usn, ()), default=None)
+            record = self._records.get((usn, semester))
+            if not record:
+                return None
+            histogram = self._semesters[semester].histogram
+            bucket = _sgpa_bin(record["sgpa"])
+            below = sum(histogram[:bucket])
+            same = histogram[bucket]
+            size = self._semesters[semester].sgpa.count
+            return {
+                "usn": usn,
+                "semester": semester,
+                "sgpa": record["sgpa"],
+                "percentile": round(100 * (below + 0.5 * same) / size, 1),
+                "rank": size - below - same + 1,
+                "cohort_size": size,
+            }
+
+    def subject(self, code):
+        with self._lock:
+            self._ensure_loaded()
+            stats = self._subjects.get(code.upper())
+            return stats.to_dict(code.upper()) if stats and stats.totals.count else None
+
+    def summary(self):
+        with self._lock:
+            self._ensure_loaded()
+            return {
+                "students": len(self._usn_semesters),
+                "mean_sgpa": round(self._sgpa.mean, 2),
+                "std_sgpa": round(self._sgpa.variance ** 0.5, 2),
+                "semesters": {
+                    semester: {
+                        "students": stats.sgpa.count,
+                        "mean_sgpa": round(stats.sgpa.mean, 2),
+                        "std_sgpa": round(stats.sgpa.variance ** 0.5, 2),
+                    }
+                    for semester, stats in sorted(self._semesters.items()) if stats.sgpa.count
+                },
+                "subjects": sorted(code for code, s in self._subjects.items() if s.totals.count),
+            }
+
+
+cohort_stats = CohortStats(result_store)
@@ -0,0 +1,132 @@
+"""
+Local stand-in for the Gemini API, for testing /get-ai-tip offline.
+
+    python fake_gemini_server.py --port 8090 --latency 2
+
+then run the backend with
+
+    GEMINI_API_BASE=http://127.0.0.1:8090/v1beta
+    GEMINI_API_KEY=anything
+
+Every generateContent call gets a canned tip back after a random delay
+around --latency; --fail-rate of calls get a 503. streamGenerateContent
+(?alt=sse) sends the same tip a few words at a time, --chunk-delay apart.
+GET /stats reports how many calls reached the server and how many streams
+the client hung up on, which is how to check the tip cache, request
+coalescing and stream cancellation are doing their job.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_TIP = ("Start by reworking the problems you found hardest this semester: pick one topic a day, "
+              "solve a few previous-year questions on it without notes, then check where you went wrong. "
+              "Short, regular sessions beat one long night before the exam.")
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send(200, {"calls": self.server.calls, "cancelled": self.server.cancelled})
+        else:
+            self._send(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        streaming = ":streamGenerateContent" in self.path
+        if not streaming and ":generateContent" not in self.path:
+            self._send(404, {"error": {"message": f"Unknown method {self.path}"}})
+            return
+        if not self.headers.get("x-goog-api-key"):
+            self._send(403, {"error": {"message": "API key missing"}})
+            return
+
+        with self.server.lock:
+            self.server.calls += 1
+        config = self.server.config
+        time.sleep(max(0.0, random.gauss(config.latency, config.latency * config.jitter)))
+
+        if random.random() < config.fail_rate:
+            self._send(503, {"error": {"message": "Fake overload"}})
+            return
+
+        prompt = body["contents"][0]["parts"][0]["text"]
+        if config.verbose:
+            print(f"prompt: {prompt}")
+        if streaming:
+            self._stream(config.tip)
+        else:
+            self._send(200, {"candidates": [{"content": {"parts": [{"text": config.tip}], "role": "model"}}]})
+
+    def _stream(self, tip):
+        # Chunked SSE, one HTTP chunk per event like the real API
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = tip.split(" ")
+        try:
+            for start in range(0, len(words), 4):
+                text = " ".join(words[start:start + 4]) + (" " if start + 4 < len(words) else "")
+                chunk = {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\r\n\r\n".encode())
+                time.sleep(self.server.config.chunk_delay)
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+            with self.server.lock:
+                self.server.cancelled += 1
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.config.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(host="127.0.0.1", port=8090, latency=1.0, jitter=0.2, fail_rate=0.0,
+                chunk_delay=0.2, tip=SAMPLE_TIP, verbose=False):
+    server = ThreadingHTTPServer((host, port), FakeGeminiHandler)
+    server.daemon_threads = True
+    server.calls = 0
+    server.cancelled = 0
+    server.lock = threading.Lock()
+    server.config = argparse.Namespace(latency=latency, jitter=jitter, fail_rate=fail_rate,
+                                       chunk_delay=chunk_delay, tip=tip, verbose=verbose)
+    return server
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Fake Gemini API server")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8090)
+    arg_parser.add_argument("--latency", type=float, default=1.0, help="mean seconds per call")
+    arg_parser.add_argument("--jitter", type=float, default=0.2, help="latency std-dev as a fraction of the mean")
+    arg_parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of calls answered with 503")
+    arg_parser.add_argument("--chunk-delay", type=float, default=0.2, help="seconds between streamed chunks")
+    arg_parser.add_argument("--verbose", action="store_true")
+    args = arg_parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.jitter, args.fail_rate,
+                         args.chunk_delay, verbose=args.verbose)
+    print(f"Fake Gemini listening on http://{args.host}:{args.port}/v1beta")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,102 @@
+"""
+Local stand-in for the OCR.space API, for load-testing the OCR path offline.
+
+    python fake_ocr_server.py --port 8089 --latency 1.5 --fail-rate 0.1
+
+then run the backend with
+
+    OCR_SPACE_URL=http://127.0.0.1:8089/parse/image
+    OCR_SPACE_API_KEY=anything
+
+Every POST gets the same canned OCR text back (or --text-file) after a
+random delay around --latency, and --fail-rate of requests get a 503 so
+the retry/backoff path is exercised too.
+"""
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_TEXT = """VTU PROVISIONAL RESULTS OF UG / PG June / July-2025 EXAMINATION.
+University Seat Number : 1AB23CS001
+Student Name : TEST STUDENT
+Semester : 4
+Subject Code Subject Name Internal Marks External Marks Total Result
+BCS401 ANALYSIS & DESIGN OF ALGORITHMS 47 29 76 P
+BCS402 MICROCONTROLLERS 47 25 72 P
+BCS403 DATABASE MANAGEMENT SYSTEMS 50 27 77 P
+BCSL404 ANALYSIS & DESIGN OF ALGORITHMS LAB 48 48 96 P
+BBOC407 BIOLOGY FOR COMPUTER ENGINEERS 47 25 72 P
+BUHK408 UNIVERSAL HUMAN VALUES COURSE 46 34 80 P
+BCS405A DISCRETE MATHEMATICAL STRUCTURES 45 10 55 F
+"""
+
+
+class FakeOCRHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+    def do_POST(self):
+        # Drain the multipart body; we don't look at the image
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+
+        config = self.server.config
+        time.sleep(max(0.0, random.gauss(config.latency, config.latency * config.jitter)))
+
+        if random.random() < config.fail_rate:
+            self._send(503, {"IsErroredOnProcessing": True, "ErrorMessage": ["Fake overload"]},
+                       extra_headers={"Retry-After": "1"})
+            return
+
+        self._send(200, {
+            "IsErroredOnProcessing": False,
+            "ParsedResults": [{"ParsedText": config.text}],
+        })
+
+    def _send(self, status, payload, extra_headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.config.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(host="127.0.0.1", port=8089, latency=1.0, jitter=0.2, fail_rate=0.0,
+                text=SAMPLE_TEXT, verbose=False):
+    server = ThreadingHTTPServer((host, port), FakeOCRHandler)
+    server.daemon_threads = True
+    server.config = argparse.Namespace(latency=latency, jitter=jitter, fail_rate=fail_rate,
+                                       text=text, verbose=verbose)
+    return server
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Fake OCR.space server")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8089)
+    arg_parser.add_argument("--latency", type=float, default=1.0, help="mean seconds per page")
+    arg_parser.add_argument("--jitter", type=float, default=0.2, help="latency std-dev as a fraction of the mean")
+    arg_parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    arg_parser.add_argument("--text-file", help="return this file's contents as the OCR text")
+    arg_parser.add_argument("--verbose", action="store_true")
+    args = arg_parser.parse_args()
+
+    text = SAMPLE_TEXT
+    if args.text_file:
+        with open(args.text_file, encoding="utf-8") as f:
+            text = f.read()
+
+    server = make_server(args.host, args.port, args.latency, args.jitter, args.fail_rate, text, args.verbose)
+    print(f"Fake OCR.space listening on http://{args.host}:{args.port}/parse/image")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,380 @@
+"""
+Batch grading for whole cohorts with NumPy.
+
+Gives exactly the same grade points, SGPA and percentage as the per-card
+code in parser.py (get_grade_points and the SGPA sum in
+parse_marks_card), but for students x subjects arrays at once - used to
+recompute a whole department when revaluation results come in.
+
+Also the target solver behind POST /what-if/target: the fewest marks a
+student still has to score, subject by subject, to reach an SGPA (or a
+CGPA, given the earlier semesters' SGPAs).
+"""
+import itertools
+import math
+import numpy as np
+from parser import get_grade_points
+from catalog import credit_catalog
+from validation import max_marks, MIN_EXTERNAL_SHARE, MIN_TOTAL_SHARE
+
+# get_grade_points as a lookup table: np.digitize maps a total to the index
+# of its band, GRADE_POINTS_TABLE maps that index to points. Totals below 40
+# or above 100 fall into the 0-point slots at either end.
+GRADE_BAND_EDGES = np.array([40, 50, 55, 60, 70, 80, 90, 101])
+GRADE_POINTS_TABLE = np.array([0, 4, 5, 6, 7, 8, 9, 10, 0])
+
+
+def grade_points_array(totals, results):
+    """
+    Vectorized get_grade_points. `totals` is any array of marks (NaN for
+    missing), `results` a same-shape array of 'P'/'F' strings.
+    """
+    totals = np.asarray(totals, dtype=float)
+    results = np.asarray(results)
+    missing = np.isnan(totals)
+    # get_grade_points does int(total), which truncates towards zero
+    whole = np.trunc(np.where(missing, 0, totals))
+    points = GRADE_POINTS_TABLE[np.digitize(whole, GRADE_BAND_EDGES)]
+    return np.where(missing | (results == 'F'), 0, points)
+
+
+def _round2(values):
+    """
+    np.round(values, 2) that matches Python's round(x, 2) bit for bit.
+    np.round scales by 100 first, which can land the other side of a tie
+    from Python's exact decimal rounding; those few values are redone in Python.
+    """
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for index in zip(*np.nonzero(near_tie)):
+        rounded[index] = round(float(values[index]), 2)
+    return rounded
+
+
+def cohort_sgpa(totals, results, credits):
+    """
+    SGPA for every student in one go.
+
+    `totals` and `results` are (students, subjects); `credits` is
+    (subjects,) or (students, subjects), with 0 credits for subjects a
+    student didn't take. Returns a dict of per-student arrays: sgpa,
+    percentage, total_credits_attempted, total_grade_points_earned.
+    """
+    points = grade_points_array(totals, results)
+    credits = np.broadcast_to(np.asarray(credits, dtype=float), points.shape)
+
+    total_credits = credits.sum(axis=1)
+    total_grade_points = (points * credits).sum(axis=1)
+    attempted = total_credits > 0
+    sgpa = np.where(attempted, _round2(total_grade_points / np.where(attempted, total_credits, 1)), 0.0)
+    percentage = np.clip(_round2(sgpa * 10), 0, 100)
+
+    return {
+        "sgpa": sgpa,
+        "percentage": percentage,
+        "total_credits_attempted": total_credits,
+        "total_grade_points_earned": _round2(total_grade_points),
+        "points": points,
+    }
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _check_cohort(students):
+    """Raise ValueError naming the first malformed student or subject field."""
+    if not isinstance(students, list):
+        raise ValueError("students must be a list")
+    for i, student in enumerate(students):
+        if not isinstance(student, dict):
+            raise ValueError(f"students[{i}] must be an object")
+        if not isinstance(student.get("subjects"), list):
+            raise ValueError(f"students[{i}].subjects must be a list")
+        for j, subject in enumerate(student["subjects"]):
+            where = f"students[{i}].subjects[{j}]"
+            if not isinstance(subject, dict):
+                raise ValueError(f"{where} must be an object")
+            if not isinstance(subject.get("code"), str):
+                raise ValueError(f"{where}.code must be a string")
+            if "result" in subject and not isinstance(subject["result"], str):
+                raise ValueError(f"{where}.result must be a string")
+            if "credits" in subject and not _is_number(subject["credits"]):
+                raise ValueError(f"{where}.credits must be a number")
+
+
+def grade_cohort(students):
+    """
+    Grade a list of students as given to POST /grades/batch:
+    [{"usn": ..., "subjects": [{"code", "total", "result", "credits"?}, ...]}]
+
+    Subjects are laid out in one column per distinct code; credits default
+    to the credit catalog. Returns one summary dict per student, in input
+    order. Raises ValueError for malformed input.
+    """
+    _check_cohort(students)
+    codes = sorted({s["code"] for student in students for s in student["subjects"]})
+    column = {code: i for i, code in enumerate(codes)}
+    catalog_credits = {code: credit_catalog.credits(code) for code in codes}
+    shape = (len(students), len(codes))
+
+    totals = np.full(shape, np.nan)
+    results = np.full(shape, 'P', dtype='<U1')
+    credits = np.zeros(shape)
+    for row, student in enumerate(students):
+        for subject in student["subjects"]:
+            col = column[subject["code"]]
+            try:
+                totals[row, col] = int(subject["total"])
+            except (ValueError, TypeError):
+                pass  # same as get_grade_points: unreadable marks earn 0 points
+            results[row, col] = subject.get("result", 'P')
+            credits[row, col] = subject.get("credits", catalog_credits[subject["code"]])
+
+    graded = cohort_sgpa(totals, results, credits)
+    return [
+        {
+            "usn": student.get("usn"),
+            "sgpa": float(graded["sgpa"][row]),
+            "percentage": float(graded["percentage"][row]),
+            "total_credits_attempted": float(graded["total_credits_attempted"][row]),
+            "total_grade_points_earned": float(graded["total_grade_points_earned"][row]),
+        }
+        for row, student in enumerate(students)
+    ]
+
+
+# The pass grades: the lowest total in each band and its points
+PASS_BAND_TOTALS = GRADE_BAND_EDGES[:-1]
+PASS_BAND_POINTS = GRADE_POINTS_TABLE[1:-1]
+
+
+def subject_options(subject):
+    """
+    The pass grades still open to one subject, as (credits, points, totals,
+    marks_needed) with one array entry per grade: the lowest total that
+    earns it and the marks still to score for that total.
+
+    `subject` has a "code" and optionally "credits" (else the catalog's),
+    "internal" (the external exam is still to come) or "total" (the marks
+    so far, to be improved on). A failed subject is sat again, keeping its
+    internal marks.
+    """
+    entry = credit_catalog.get(subject["code"])
+    credits = int(subject.get("credits", entry["credits"] if entry else 0))
+    max_internal, max_external = max_marks(entry)
+    min_total = math.ceil(MIN_TOTAL_SHARE * (max_internal + max_external))
+    totals = np.maximum(PASS_BAND_TOTALS, min_total)
+    highest = max_internal + max_external
+
+    if subject.get("total") is not None and subject.get("result", "P") != "F":
+        current = int(subject["total"])
+        totals = np.maximum(totals, current)
+        needed = totals - current
+    elif subject.get("internal") is not None:
+        internal = int(subject["internal"])
+        totals = np.maximum(totals, internal + math.ceil(MIN_EXTERNAL_SHARE * max_external))
+        needed = totals - internal
+        highest = internal + max_external
+    else:
+        needed = totals
+
+    points = GRADE_POINTS_TABLE[np.digitize(totals, GRADE_BAND_EDGES)]
+    # Raising a floor can put several grades on the same total; keep one of each
+    _, first = np.unique(points, return_index=True)
+    keep = first[totals[first] <= highest]
+    return credits, points[keep], totals[keep], needed[keep]
+
+
+def _pareto(points, needed):
+    """
+    Indices of the states no other state beats: fewer marks needed for at
+    least as many points. Ordered by points, highest first.
+    """
+    order = np.lexsort((needed, -points))
+    needed = needed[order]
+    least_so_far = np.minimum.accumulate(np.concatenate(([np.iinfo(needed.dtype).max], needed[:-1])))
+    return order[needed < least_so_far]
+
+
+def target_frontier(options):
+    """
+    Every SGPA worth aiming for, with the fewest marks that reach it.
+
+    Runs through the subjects keeping only undominated states: each step
+    scores every (state, grade) pair at once, then drops the pairs that
+    another pair beats for points and marks. There can't be more states
+    than distinct credit-point sums (10 x credits), so ten subjects take a
+    few hundred pairs a step instead of 7^10 combinations.
+
+    Returns (points, needed, choices): arrays of the undominated states,
+    highest points first, and `choices[i]` the grade index per subject.
+    """
+    points = np.zeros(1, dtype=np.int64)
+    needed = np.zeros(1, dtype=np.int64)
+    trail = []
+    for credits, grade_points, _, grade_needed in options:
+        all_points = (points[:, None] + credits * grade_points[None, :]).ravel()
+        all_needed = (needed[:, None] + grade_needed[None, :]).ravel()
+        keep = _pareto(all_points, all_needed)
+        trail.append(keep)
+        points, needed = all_points[keep], all_needed[keep]
+
+    # Walk back from every final state to the grade each subject got
+    choices = np.zeros((len(points), len(options)), dtype=np.int64)
+    state = np.arange(len(points))
+    for step in range(len(options) - 1, -1, -1):
+        flat = trail[step][state]
+        grades = len(options[step][1])
+        choices[:, step] = flat % grades
+        state = flat // grades
+    return points, needed, choices
+
+
+def _required_points(target_sgpa, total_credits):
+    """Fewest credit points whose SGPA rounds to `target_sgpa` or more, or None if over 10 x credits."""
+    need = max(0, math.ceil((target_sgpa - 0.005) * total_credits - 1e-9))
+    while need > 0 and round((need - 1) / total_credits, 2) >= target_sgpa:
+        need -= 1
+    while round(need / total_credits, 2) < target_sgpa:
+        need += 1
+        if need > 10 * total_credits:
+            return None
+    return need
+
+
+def required_sgpa(target_cgpa, past_sgpas):
+    """The lowest SGPA this semester that brings the CGPA (calculate_cgpa_data's mean) to `target_cgpa`."""
+    semesters = len(past_sgpas) + 1
+    done = sum(past_sgpas)
+    sgpa = max(0.0, math.ceil(((target_cgpa - 0.005) * semesters - done) * 100 - 1e-6) / 100)
+    while sgpa >= 0.01 and round((done + sgpa - 0.01) / semesters, 2) >= target_cgpa:
+        sgpa = round(sgpa - 0.01, 2)
+    while round((done + sgpa) / semesters, 2) < target_cgpa:
+        sgpa = round(sgpa + 0.01, 2)
+    return sgpa
+
+
+def plan_for_target(subjects, target_sgpa=None, target_cgpa=None, past_sgpas=()):
+    """
+    The marks to aim for in each subject to reach `target_sgpa`, or
+    `target_cgpa` on top of `past_sgpas`, scoring as few marks as possible.
+    Every subject is passed. Raises ValueError for an unusable request.
+    """
+    if target_sgpa is None:
+        if target_cgpa is None:
+            raise ValueError("Give target_sgpa or target_cgpa")
+        target_sgpa = required_sgpa(float(target_cgpa), [float(s) for s in past_sgpas])
+    target_sgpa = float(target_sgpa)
+    if not subjects:
+        raise ValueError("No subject data provided")
+
+    options = [subject_options(subject) for subject in subjects]
+    plan = {"target_sgpa": target_sgpa, "feasible": False}
+    if target_cgpa is not None:
+        plan["target_cgpa"] = float(target_cgpa)
+    cannot_pass = [subject["code"] for subject, option in zip(subjects, options) if not len(option[1])]
+    if cannot_pass:
+        plan["message"] = f"Can't pass {', '.join(cannot_pass)} with the marks left"
+        return plan
+
+    total_credits = sum(credits for credits, *_ in options)
+    if total_credits <= 0:
+        raise ValueError("None of these subjects carry credits")
+    points, needed, choices = target_frontier(options)
+    sgpas = _round2(points / total_credits)
+    plan["max_sgpa"] = float(sgpas[0])
+    plan["frontier"] = [{"sgpa": float(s), "marks_needed": int(n)} for s, n in zip(sgpas[::-1], needed[::-1])]
+
+    need = _required_points(target_sgpa, total_credits) if target_sgpa <= 10 else None
+    reachable = np.nonzero(points >= need)[0] if need is not None else []
+    if not len(reachable):
+        plan["message"] = f"The highest SGPA still possible is {plan['max_sgpa']}"
+        return plan
+
+    # States run from most points to least, so the last one that's enough needs the fewest marks
+    best = reachable[-1]
+    plan.update(feasible=True, sgpa=float(sgpas[best]), marks_needed=int(needed[best]), subjects=[])
+    for subject, (credits, grade_points, totals, grade_needed), grade in zip(subjects, options, choices[best]):
+        row = {
+            "code": subject["code"],
+            "credits": credits,
+            "grade_points": int(grade_points[grade]),
+            "target_total": int(totals[grade]),
+            "marks_needed": int(grade_needed[grade]),
+        }
+        if subject.get("internal") is not None and (subject.get("total") is None or subject.get("result") == "F"):
+            row["target_external"] = int(totals[grade]) - int(subject["internal"])
+        plan["subjects"].append(row)
+    return plan
+
+
+def test_target_solver():
+    """Check the frontier against trying every combination of grades."""
+    print("Running target solver checks...")
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        subjects = []
+        for i in range(int(rng.integers(1, 6))):
+            subject = {"code": f"TST{i:03d}", "credits": int(rng.integers(0, 5))}
+            kind = rng.integers(0, 3)
+            if kind == 1:
+                subject["internal"] = int(rng.integers(10, 51))
+            elif kind == 2:
+                subject["total"] = int(rng.integers(40, 101))
+            subjects.append(subject)
+        options = [subject_options(subject) for subject in subjects]
+        total_credits = sum(credits for credits, *_ in options)
+        if total_credits == 0:
+            continue
+
+        best = {}
+        for grades in itertools.product(*(range(len(option[1])) for option in options)):
+            points = sum(o[0] * int(o[1][g]) for o, g in zip(options, grades))
+            needed = sum(int(o[3][g]) for o, g in zip(options, grades))
+            best[points] = min(best.get(points, needed), needed)
+
+        target = round(float(rng.uniform(4, 10)), 2)
+        plan = plan_for_target(subjects, target_sgpa=target)
+        fits = [needed for points, needed in best.items() if round(points / total_credits, 2) >= target]
+        assert plan["feasible"] == bool(fits)
+        if fits:
+            assert plan["marks_needed"] == min(fits)
+            assert plan["sgpa"] >= target
+            earned = sum(get_grade_points(s["target_total"], 'P') * s["credits"] for s in plan["subjects"])
+            assert round(earned / total_credits, 2) == plan["sgpa"]
+
+    for past in ([7.2, 8.1], [9.9], []):
+        for target in (7.5, 8.0, 8.77):
+            sgpa = required_sgpa(target, past)
+            cgpa = lambda s, past=past: round((sum(past) + s) / (len(past) + 1), 2)
+            assert cgpa(sgpa) >= target and (sgpa < 0.01 or cgpa(round(sgpa - 0.01, 2)) < target)
+    print("✓ Target solver matches an exhaustive search")
+
+
+def test_vectorized_grading():
+    """Check the vectorized engine against the scalar code it replaces."""
+    print("Running vectorized grading parity checks...")
+    totals = np.arange(-5, 106)
+    for result in ('P', 'F'):
+        expected = [get_grade_points(int(t), result) for t in totals]
+        assert grade_points_array(totals, np.full(totals.shape, result)).tolist() == expected
+
+    rng = np.random.default_rng(0)
+    totals = rng.integers(0, 101, size=(2000, 9))
+    results = np.where(rng.random((2000, 9)) < 0.1, 'F', 'P')
+    credits = rng.choice([0, 1, 2, 3, 4], size=9)
+    graded = cohort_sgpa(totals, results, credits)
+    for row in range(totals.shape[0]):
+        attempted = sum(int(c) for c in credits)
+        earned = sum(get_grade_points(int(t), r) * int(c) for t, r, c in zip(totals[row], results[row], credits))
+        sgpa = round(earned / attempted, 2) if attempted > 0 else 0.0
+        assert graded["sgpa"][row] == sgpa
+        assert graded["percentage"][row] == max(0, min(100, round(sgpa * 10, 2)))
+    print("✓ Vectorized grading matches get_grade_points and the per-card SGPA")
+
+
+if __name__ == "__main__":
+    test_vectorized_grading()
+    test_target_solver()
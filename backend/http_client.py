@@ -0,0 +1,75 @@
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from logs import get_logger
+
+# Connections kept alive per upstream host (OCR.space, Gemini, ...)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 16))
+
+# Status codes worth retrying - rate limiting and transient server trouble
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+log = get_logger("http")
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(name):
+    """
+    Return a shared keep-alive session for the named upstream, so repeated
+    calls reuse TCP/TLS connections instead of handshaking every time.
+    """
+    with _sessions_lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[name] = session
+        return session
+
+
+def retry_delay(attempt, backoff, max_backoff, response=None):
+    # Honour Retry-After when the upstream tells us how long to wait
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), max_backoff)
+    # "Full jitter" exponential backoff so parallel retries don't stampede
+    return random.uniform(0, min(max_backoff, backoff * (2 ** attempt)))
+
+
+def post_with_retries(session, url, retries=2, backoff=0.5, max_backoff=8.0, limiter=None, **kwargs):
+    """
+    POST with jittered exponential backoff on connection errors, timeouts
+    and RETRY_STATUS responses. Returns the response once it is 2xx and
+    raises the last error when every attempt has failed. Each retry takes
+    a token from `limiter` (a scheduler.Scheduler), and a 429 also pauses
+    it for everyone else.
+    """
+    for attempt in range(retries + 1):
+        response = None
+        if attempt and limiter is not None:
+            # The slot paid for the first attempt; each retry is another call against the rate limit
+            limiter.acquire()
+        try:
+            response = session.post(url, **kwargs)
+            if response.status_code not in RETRY_STATUS:
+                response.raise_for_status()
+                return response
+            if response.status_code == 429 and limiter is not None:
+                limiter.pause(retry_delay(attempt, backoff, max_backoff, response))
+            if attempt == retries:
+                response.raise_for_status()
+            log.warning("upstream_retry", url=url.split('?')[0], status=response.status_code, attempt=attempt + 1)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt == retries:
+                raise
+            log.warning("upstream_retry", url=url.split('?')[0], error=type(e).__name__, attempt=attempt + 1)
+
+        time.sleep(retry_delay(attempt, backoff, max_backoff, response))
@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from scheduler import PRIORITY_BACKGROUND
+from workers import parse_card
+from cache import result_cache
+from cohort import cohort_stats
+from store import result_store
+
+# Parses running in the background at once; the rest wait in the queue
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+# Jobs allowed to wait for a worker before POST /jobs starts refusing
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", 100))
+# Finished jobs are kept this long (seconds) for polling clients
+JOB_TTL = int(os.getenv("JOB_TTL", 15 * 60))
+# Idle SSE streams send a comment this often so proxies don't drop them
+SSE_HEARTBEAT = 15
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "error"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    """A background parse and the stage events it has reported so far."""
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = QUEUED
+        self.events = []
+        self.result = None
+        self.finished_at = None
+        self._changed = threading.Condition()
+        self.report("queued")
+
+    def report(self, stage, **details):
+        """Record a stage event and wake any SSE streams waiting on this job."""
+        with self._changed:
+            self.events.append({"stage": stage, "time": round(time.time(), 3), **details})
+            self._changed.notify_all()
+
+    def finish(self, status, result):
+        with self._changed:
+            self.status = status
+            self.result = result
+            self.finished_at = time.time()
+            self.events.append({"stage": status, "time": round(self.finished_at, 3)})
+            self._changed.notify_all()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self):
+        with self._changed:
+            data = {
+                "job_id": self.id,
+                "status": self.status,
+                "stage": self.events[-1]["stage"],
+                "events": list(self.events),
+            }
+            if self.finished:
+                data["result"] = self.result
+            return data
+
+    def wait_for_events(self, seen, timeout):
+        """Block until there are more than `seen` events or the job is finished."""
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.events) > seen or self.finished, timeout)
+            return list(self.events[seen:]), self.finished
+
+
+class JobManager:
+    """
+    Runs parses on a bounded thread pool so slow scans never hold a request
+    thread. OCR time is spent waiting on the network, so threads - not
+    processes - are enough to keep the slow jobs out of everyone's way.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED, ttl=JOB_TTL):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="parse-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _expire_finished(self):
+        # Caller holds self._lock
+        cutoff = time.time() - self.ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def submit(self, upload, finish=None):
+        """
+        Queue a parse of `upload` (see uploads.PdfUpload) and return its Job.
+        `finish(result)` may post-process a successful result. The upload is
+        closed once the job is done. Raises QueueFull when too many jobs wait.
+        """
+        with self._lock:
+            self._expire_finished()
+            queued = sum(1 for j in self._jobs.values() if j.status == QUEUED)
+            if queued >= self.max_queued:
+                raise QueueFull()
+            job = Job(uuid.uuid4().hex)
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job, upload, finish)
+        return job
+
+    def _run(self, job, upload, finish):
+        job.status = RUNNING
+        job.report("running")
+        try:
+            result = result_cache.get_or_compute(
+                upload.digest,
+                lambda: parse_card(upload.source, progress=job.report, priority=PRIORITY_BACKGROUND)
+            )
+            if result["status"] == "success":
+                cohort_stats.record(result)
+                result_store.save_result(result)
+                if finish:
+                    result = finish(result)
+            job.finish(DONE if result["status"] == "success" else FAILED, result)
+        except Exception as e:
+            job.finish(FAILED, {"status": "error", "message": str(e)})
+        finally:
+            upload.close()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+def sse_stream(job):
+    """Yield a job's stage events as Server-Sent Events until it finishes."""
+    seen = 0
+    while True:
+        events, finished = job.wait_for_events(seen, SSE_HEARTBEAT)
+        if not events and not finished:
+            yield ": keep-alive\n\n"
+            continue
+        for event in events:
+            yield f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+        seen += len(events)
+        if finished and seen >= len(job.events):
+            yield f"event: result\ndata: {json.dumps(job.result)}\n\n"
+            return
+
+
+job_manager = JobManager()
@@ -0,0 +1,230 @@
+"""
+Load-test the asyncio server (async_app.py) against local stand-in upstreams.
+
+    python load_test.py                                   # 200 uploads + 300 tips, up to 500 in flight
+    python load_test.py --uploads 500 --tips 0 --ocr-latency 15
+    python load_test.py --ocr-rate 120 --gemini-rate 60   # see load shedding
+
+Starts fake_ocr_server and fake_gemini_server in this process and
+async_app.py as a child process pointed at them, then sends scanned-card
+uploads and AI tip requests with up to --concurrency in flight. Every
+upload is a different PDF and every tip a different profile, so neither
+cache answers them and each one really waits on an upstream.
+
+Reports throughput, latency percentiles and errors per endpoint, and the
+most calls the stand-ins saw in flight at once - that number is how many
+requests the one server process was holding open. Uploads still need
+CPU time for rendering, so on a small machine their throughput is bound
+by cores; raise --ocr-latency to see how many the loop can hold.
+
+The server's upstream rate limits are off unless --ocr-rate/--gemini-rate
+are given; with them, requests it sheds (503 + Retry-After) are counted
+apart from errors.
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import aiohttp
+import fake_gemini_server
+import fake_ocr_server
+import synthetic_cards
+
+
+class InFlight:
+    """Count concurrent calls into a stand-in and remember the peak."""
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def wrap(self, handler_class):
+        counter = self
+
+        class Counted(handler_class):
+            def do_POST(self):
+                with counter._lock:
+                    counter.current += 1
+                    counter.peak = max(counter.peak, counter.current)
+                try:
+                    super().do_POST()
+                finally:
+                    with counter._lock:
+                        counter.current -= 1
+
+        return Counted
+
+
+def start_stand_in(server, counter):
+    # The default listen backlog of 5 would refuse a burst of connections
+    server.socket.listen(1024)
+    server.RequestHandlerClass = counter.wrap(server.RequestHandlerClass)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def start_server(args, ocr_url, gemini_url, results_db):
+    # Admission limits sized so that only the rates, if given, hold calls back
+    limits = str(10 * args.concurrency)
+    env = dict(os.environ,
+               PORT=str(args.port), HOST="127.0.0.1",
+               OCR_SPACE_URL=f"{ocr_url}/parse/image", OCR_SPACE_API_KEY="load-test",
+               GEMINI_API_BASE=f"{gemini_url}/v1beta", GEMINI_API_KEY="load-test",
+               OCR_RATE_PER_MINUTE=str(args.ocr_rate), GEMINI_RATE_PER_MINUTE=str(args.gemini_rate),
+               OCR_MAX_IN_FLIGHT=limits, OCR_MAX_QUEUED=limits,
+               GEMINI_MAX_IN_FLIGHT=limits, GEMINI_MAX_QUEUED=limits,
+               RESULT_CACHE_DIR="", RESULTS_DB=results_db, LOG_LEVEL="ERROR")
+    here = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.Popen([sys.executable, os.path.join(here, "async_app.py")], cwd=here, env=env,
+                            stdout=subprocess.DEVNULL)
+
+
+async def wait_ready(session, url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{url}/ready") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+def scanned_card(pdf):
+    """The card as a scan, compressed like a real one (rasterize() leaves the images raw)."""
+    import fitz
+    doc = fitz.open(stream=synthetic_cards.rasterize(pdf), filetype="pdf")
+    data = doc.tobytes(garbage=3, deflate=True, deflate_images=True)
+    doc.close()
+    return data
+
+
+def tip_request(i):
+    # A different weakest subject each time, so every request is a tip cache miss
+    subjects = [
+        {"code": f"LT{i:05d}", "title": f"LOAD TEST SUBJECT {i}", "points": 6, "credits": 3, "result": "P"},
+        {"code": "BCS401", "title": "ANALYSIS & DESIGN OF ALGORITHMS", "points": 9, "credits": 3, "result": "P"},
+    ]
+    return {"subjects": subjects, "sgpa": 7.5}
+
+
+async def timed(results, endpoint, call):
+    # ok is True, False, or "shed" for a 503 with Retry-After
+    start = time.perf_counter()
+    try:
+        ok = await call()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        ok = False
+    results.setdefault(endpoint, []).append((time.perf_counter() - start, ok))
+
+
+def outcome(response, ok):
+    if response.status == 503 and "Retry-After" in response.headers:
+        return "shed"
+    return response.status == 200 and ok
+
+
+async def run(args, url, scan, expected):
+    limit = asyncio.Semaphore(args.concurrency)
+    results = {}
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await wait_ready(session, url)
+
+        async def upload(i):
+            # Bytes after %%EOF are ignored by PDF readers but change the hash
+            body = scan + f"\n% load-test {i}\n".encode()
+            async with session.post(f"{url}/upload", data=body,
+                                    headers={"Content-Type": "application/pdf"}) as response:
+                data = await response.json()
+            return outcome(response, data.get("sgpa") == expected["sgpa"])
+
+        async def tip(i):
+            async with session.post(f"{url}/get-ai-tip", json=tip_request(i)) as response:
+                data = await response.json()
+            return outcome(response, not data.get("cached"))
+
+        async def limited(endpoint, call, i):
+            async with limit:
+                await timed(results, endpoint, lambda: call(i))
+
+        calls = ([limited("/upload", upload, i) for i in range(args.uploads)]
+                 + [limited("/get-ai-tip", tip, i) for i in range(args.tips)])
+        # Interleave the two kinds so both are in flight together
+        random.Random(0).shuffle(calls)
+        start = time.perf_counter()
+        await asyncio.gather(*calls)
+        elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def report(results, elapsed, ocr, gemini):
+    print(f"\n{'endpoint':<14} {'requests':>8} {'errors':>7} {'shed':>6} {'req/s':>8} "
+          f"{'p50':>9} {'p95':>9} {'p99':>9}")
+    for endpoint, samples in sorted(results.items()):
+        latencies = sorted(seconds for seconds, _ in samples)
+        errors = sum(1 for _, ok in samples if ok is False)
+        shed = sum(1 for _, ok in samples if ok == "shed")
+        print(f"{endpoint:<14} {len(samples):>8} {errors:>7} {shed:>6} {len(samples) / elapsed:>8.1f} "
+              + " ".join(f"{percentile(latencies, q) * 1000:>7.0f}ms" for q in (0.5, 0.95, 0.99)))
+    print(f"\nwall time {elapsed:.1f}s; peak calls in flight upstream: "
+          f"OCR {ocr.peak}, Gemini {gemini.peak}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Load-test async_app.py against local stand-ins")
+    arg_parser.add_argument("--uploads", type=int, default=200, help="scanned-card uploads to send")
+    arg_parser.add_argument("--tips", type=int, default=300, help="AI tip requests to send")
+    arg_parser.add_argument("--concurrency", type=int, default=500, help="requests in flight at once")
+    arg_parser.add_argument("--ocr-latency", type=float, default=3.0, help="mean seconds per OCR call")
+    arg_parser.add_argument("--gemini-latency", type=float, default=3.0, help="mean seconds per Gemini call")
+    arg_parser.add_argument("--fail-rate", type=float, default=0.0, help="share of upstream calls answered 503")
+    arg_parser.add_argument("--ocr-rate", type=float, default=0,
+                            help="server's OCR calls per minute (default: no limit)")
+    arg_parser.add_argument("--gemini-rate", type=float, default=0,
+                            help="server's Gemini calls per minute (default: no limit)")
+    arg_parser.add_argument("--timeout", type=float, default=120, help="seconds before a request counts as failed")
+    arg_parser.add_argument("--port", type=int, default=5055)
+    args = arg_parser.parse_args()
+
+    pdf, expected = synthetic_cards.make_card(subjects=9, seed=1)
+    ocr_server = fake_ocr_server.make_server(port=0, latency=args.ocr_latency, fail_rate=args.fail_rate,
+                                             text=synthetic_cards.ocr_text(expected))
+    gemini_server = fake_gemini_server.make_server(port=0, latency=args.gemini_latency, fail_rate=args.fail_rate)
+    ocr, gemini = InFlight(), InFlight()
+    ocr_url = start_stand_in(ocr_server, ocr)
+    gemini_url = start_stand_in(gemini_server, gemini)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server = start_server(args, ocr_url, gemini_url, os.path.join(tmp, "results.db"))
+        try:
+            results, elapsed = asyncio.run(run(args, f"http://127.0.0.1:{args.port}",
+                                               scanned_card(pdf), expected))
+        finally:
+            server.terminate()
+            server.wait(10)
+    report(results, elapsed, ocr, gemini)
+    failed = sum(1 for samples in results.values() for _, ok in samples if ok is False)
+    if failed:
+        print(f"\n✗ {failed} request(s) failed")
+        sys.exit(1)
+    shed = sum(1 for samples in results.values() for _, ok in samples if ok == "shed")
+    print(f"\n✓ All requests succeeded or were shed ({shed} shed)" if shed else "\n✓ All requests succeeded")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Leveled, structured logging for the backend.
+
+    from logs import get_logger
+    log = get_logger("parser")
+    log.info("pdf_opened", pages=2)
+    log.debug("ocr_text", page=1, preview=text[:200])
+
+Each record is an event name plus key=value fields, written as one line
+(LOG_FORMAT=text) or one JSON object (LOG_FORMAT=json). Records go through
+a queue and are written by a background thread, so a request thread never
+blocks on stderr. LOG_LEVEL picks the threshold (DEBUG, INFO, WARNING, ...).
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, as_json=False):
+        super().__init__()
+        self.as_json = as_json
+
+    def format(self, record):
+        fields = getattr(record, "fields", {})
+        trace = record.exc_text or (self.formatException(record.exc_info) if record.exc_info else None)
+        if self.as_json:
+            entry = {
+                "time": round(record.created, 3),
+                "level": record.levelname.lower(),
+                "logger": record.name,
+                "event": record.getMessage(),
+                **fields,
+            }
+            if trace:
+                entry["traceback"] = trace
+            return json.dumps(entry, default=str)
+
+        line = (f"{self.formatTime(record, '%Y-%m-%d %H:%M:%S')} {record.levelname:<7} "
+                f"{record.name}: {record.getMessage()}")
+        if fields:
+            line += " " + " ".join(f"{k}={json.dumps(v, default=str)}" for k, v in fields.items())
+        if trace:
+            line += "\n" + trace
+        return line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Keep the event and fields apart for the formatter; only the
+        # traceback has to be rendered now, while exc_info is still valid
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _configure():
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        handler = logging.StreamHandler()
+        handler.setFormatter(StructuredFormatter(as_json=LOG_FORMAT == "json"))
+        records = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(records, handler)
+        listener.start()
+        atexit.register(listener.stop)
+
+        root = logging.getLogger("vtu")
+        root.addHandler(_QueueHandler(records))
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+        _configured = True
+
+
+def _reconfigure_in_child():
+    # A forked worker (bulk uploads) inherits the handler but not the
+    # listener thread, so it needs a queue and listener of its own
+    global _configured, _configure_lock
+    _configure_lock = threading.Lock()
+    root = logging.getLogger("vtu")
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if _configured:
+        _configured = False
+        _configure()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reconfigure_in_child)
+
+
+class EventLogger:
+    """logging.Logger wrapper taking an event name and keyword fields."""
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def _log(self, level, event, exc_info, fields):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, None, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, None, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, None, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, None, fields)
+
+    def exception(self, event, **fields):
+        self._log(logging.ERROR, event, True, fields)
+
+
+def get_logger(name):
+    _configure()
+    return EventLogger(logging.getLogger(f"vtu.{name}"))
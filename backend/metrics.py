@@ -0,0 +1,221 @@
+"""
+In-process counters and latency histograms, exported in the Prometheus
+text format by GET /metrics.
+
+    from metrics import stage_timer, OCR_FALLBACKS
+    with stage_timer("render"):
+        ...
+    OCR_FALLBACKS.inc()
+
+Everything is plain Python behind one lock per metric, so recording is a
+few dict operations on the hot path. Bulk uploads parse in worker
+processes; bulk.py ships each worker's numbers back with its result
+(drain/merge) so /metrics still sees every parse.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency buckets: sub-millisecond parsing up
+# to OCR calls that take tens of seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def drain(self):
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values):
+        with self._lock:
+            for key, amount in values.items():
+                self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as Prometheus expects it."""
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}   # label key -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            # First bucket whose bound is >= value; past the end is the +Inf slot
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def drain(self):
+        with self._lock:
+            series, self._series = self._series, {}
+        return series
+
+    def merge(self, series_by_key):
+        with self._lock:
+            for key, series in series_by_key.items():
+                mine = self._series.setdefault(key, [0] * (len(self.buckets) + 2))
+                for i, value in enumerate(series):
+                    mine[i] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                cumulative += series[len(self.buckets)]
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-1]:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """A value read at scrape time: `fn()` returns a number or a list of (labels dict, number)."""
+
+    def __init__(self, name, help_text, fn):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        values = self.fn()
+        if not isinstance(values, list):
+            values = [({}, values)]
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def gauge(self, name, help_text, fn):
+        return self.register(Gauge(name, help_text, fn))
+
+    def drain(self):
+        """Take (and reset) everything recorded here - for shipping a worker's numbers home."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.drain() for m in metrics if hasattr(m, "drain")}
+
+    def merge(self, drained):
+        for name, values in drained.items():
+            metric = self._metrics.get(name)
+            if metric is not None:
+                metric.merge(values)
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        return "\n".join(line for m in metrics for line in m.render()) + "\n"
+
+
+registry = Registry()
+
+# A forked bulk worker starts with a copy of the parent's numbers; clear
+# them so drain() only ships home what the worker itself recorded
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=registry.drain)
+
+STAGE_SECONDS = registry.histogram(
+    "vtu_stage_seconds", "Time spent in each stage of handling a marks card or tip")
+OCR_FALLBACKS = registry.counter(
+    "vtu_ocr_fallbacks_total", "Marks cards that needed OCR for at least one page")
+OCR_PAGES = registry.counter(
+    "vtu_ocr_pages_total", "Pages sent to OCR.space, by outcome")
+OCR_UPLOAD_BYTES = registry.counter(
+    "vtu_ocr_upload_bytes_total", "Image bytes sent to OCR.space")
+ALTERNATIVE_PARSER_HITS = registry.counter(
+    "vtu_alternative_parser_hits_total", "Parses that fell back to a secondary parser, by parser")
+SKIPPED_SUBJECTS = registry.counter(
+    "vtu_skipped_subjects_total", "Subject rows dropped while parsing, by reason")
+PARSE_TIERS = registry.counter(
+    "vtu_parse_tier_total", "Cards by the reading that was kept: text_layer, ocr_low or ocr_full")
+VALIDATION_FAILURES = registry.counter(
+    "vtu_validation_failures_total", "Validation problems found in a reading, by tier and rule")
+OCR_CORRECTIONS = registry.counter(
+    "vtu_ocr_corrections_total", "OCR misreads put right from the catalog or the marks sum, by kind")
+PARSES = registry.counter(
+    "vtu_parses_total", "parse_marks_card calls, by outcome")
+UPSTREAM_SHED = registry.counter(
+    "vtu_upstream_shed_total", "OCR/Gemini calls refused by admission control, by upstream and reason")
+UPSTREAM_WAIT_SECONDS = registry.histogram(
+    "vtu_upstream_wait_seconds", "Time OCR/Gemini calls waited for admission, by upstream")
+WORKER_RECYCLES = registry.counter(
+    "vtu_worker_recycles_total", "Parse worker processes retired, by reason")
+HTTP_REQUESTS = registry.counter(
+    "vtu_http_requests_total", "HTTP requests served, by endpoint, method and status")
+HTTP_SECONDS = registry.histogram(
+    "vtu_http_request_seconds", "HTTP request latency until the response starts, by endpoint")
+
+
+@contextmanager
+def stage_timer(stage):
+    """Record how long the block took under vtu_stage_seconds{stage=...}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
@@ -0,0 +1,277 @@
+"""
+Fixes for OCR misreads that the credit catalog and the marks columns can
+put right on their own, so a card doesn't need a second OCR pass or the
+alternative parser over a few confused characters:
+
+- subject codes: OCR mixes up O/0, I/1, S/5 and friends, so `BCSL4O4`
+  comes back instead of `BCSL404`. Each catalog code is indexed under a
+  canonical form with every confusable character folded to one symbol, so
+  a misread finds its code with one dict lookup. Stray marks are dropped
+  first (`BCS-401`). Tokens that still don't look like a code (`BCS4A01`)
+  are looked up in a BK-tree over the canonical forms of the codes with
+  the same digits, which only visits the branches within one edit of the
+  token - the number is what tells courses apart, so it must have been
+  read as printed.
+- numbers: a short token like `4O` in the marks columns is the number 40.
+- marks: when internal + external != total and exactly one of the three
+  can be changed by one digit to make the row add up (within the course's
+  maximums), that digit was the misread.
+
+Only unambiguous fixes are made; anything else is left for validation to
+reject, so the card still escalates to a better reading.
+
+    python ocr_codes.py     # self-check against a large synthetic catalog
+"""
+import csv
+import os
+import re
+import tempfile
+import threading
+import time
+from catalog import credit_catalog, CreditCatalog, FIELDS
+
+# Characters OCR engines confuse with each other in subject codes, folded to one symbol
+CODE_CONFUSIONS = str.maketrans("OQILSBZG", "00115826")
+# ... and in marks, where only digits can be meant
+NUMBER_CONFUSIONS = str.maketrans("OoQIlSs", "0001155")
+
+DIGIT = re.compile(r"\d")
+NOT_ALNUM = re.compile(r"[^0-9A-Za-z]")
+MIN_CODE_LENGTH = 5
+MAX_CODE_LENGTH = 12
+
+
+def edit_distance(a, b):
+    """Levenshtein distance between two short strings."""
+    # Codes share long prefixes and suffixes, which never add to the distance
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """Burkhard-Keller tree: finds the words within a given edit distance without scanning them all."""
+
+    def __init__(self, words=()):
+        self.root = None
+        self.size = 0
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        self.size += 1
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            d = edit_distance(word, node[0])
+            if d == 0:
+                self.size -= 1
+                return
+            if d not in node[1]:
+                node[1][d] = (word, {})
+                return
+            node = node[1][d]
+
+    def search(self, word, radius):
+        """[(distance, word)] for every word within `radius` edits, and the number of nodes visited."""
+        found = []
+        visited = 0
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            visited += 1
+            d = edit_distance(word, node[0])
+            if d <= radius:
+                found.append((d, node[0]))
+            # Triangle inequality: only children at distance d +/- radius can match
+            for child_distance, child in node[1].items():
+                if d - radius <= child_distance <= d + radius:
+                    stack.append(child)
+        return found, visited
+
+
+def canonical(code):
+    return code.upper().translate(CODE_CONFUSIONS)
+
+
+def _digits(code):
+    return "".join(DIGIT.findall(code))
+
+
+class CodeCorrector:
+    """Snaps misread subject codes to the catalog; rebuilds when the catalog changes."""
+
+    def __init__(self, catalog=credit_catalog):
+        self.catalog = catalog
+        self._index = None  # (catalog version, codes, canonical -> code, digits -> BKTree)
+        self._lock = threading.Lock()
+
+    def _current(self):
+        version = self.catalog.version
+        index = self._index
+        if index is None or index[0] != version:
+            with self._lock:
+                index = self._index
+                if index is None or index[0] != version:
+                    index = self._index = self._build(version)
+        return index
+
+    def _build(self, version):
+        codes = frozenset(self.catalog.codes())
+        by_canonical = {}
+        for code in codes:
+            form = canonical(code)
+            # Two codes that only differ in confusable characters can't be told apart
+            by_canonical[form] = None if form in by_canonical else code
+        trees = {}
+        for form, code in sorted(by_canonical.items()):
+            if code is not None:
+                trees.setdefault(_digits(code), BKTree()).add(form)
+        return version, codes, by_canonical, trees
+
+    def snap(self, token, fuzzy=False):
+        """
+        The catalog code `token` is a misreading of, or None. `fuzzy` also
+        allows one letter too many, too few or unreadable - for tokens that
+        don't match the code pattern at all.
+        """
+        # Most tokens are title words: no digit, no code
+        if not DIGIT.search(token):
+            return None
+        if not token.isalnum():
+            token = NOT_ALNUM.sub("", token)
+        # A code has letters too; all digits is a date or a number
+        if not MIN_CODE_LENGTH <= len(token) <= MAX_CODE_LENGTH or token.isdigit():
+            return None
+        token = token.upper()
+        _, codes, by_canonical, trees = self._current()
+        if token in codes:
+            return token
+        form = canonical(token)
+        if form in by_canonical:
+            return by_canonical[form]
+        # A code one digit away is a different course, not a misread
+        tree = trees.get(_digits(token)) if fuzzy else None
+        if tree is None:
+            return None
+        matches, _ = tree.search(form, 1)
+        return by_canonical[matches[0][1]] if len(matches) == 1 else None
+
+
+code_corrector = CodeCorrector()
+
+
+def snap_code(token, fuzzy=False):
+    """code_corrector.snap() for the shared credit catalog."""
+    return code_corrector.snap(token, fuzzy)
+
+
+def misread_number(token):
+    """`token` as a number when it's a short mark with letters for digits (`4O` -> `40`), else None."""
+    if len(token) > 3 or not any(c.isdigit() for c in token):
+        return None
+    number = token.translate(NUMBER_CONFUSIONS)
+    return number if number.isdigit() else None
+
+
+def _one_digit_apart(read, fixed):
+    read, fixed = str(read), str(fixed)
+    return len(read) == len(fixed) and sum(a != b for a, b in zip(read, fixed)) == 1
+
+
+def repair_marks(internal, external, total, max_internal, max_external):
+    """
+    (internal, external, total) with one misread digit put right so the
+    row adds up within the maximums, or None when the marks are fine or
+    more than one fix would do.
+    """
+    if internal + external == total and internal <= max_internal and external <= max_external:
+        return None
+    internal_ok, external_ok = internal <= max_internal, external <= max_external
+    fixes = []
+    if internal_ok and external_ok and _one_digit_apart(total, internal + external):
+        fixes.append((internal, external, internal + external))
+    if internal_ok and 0 <= total - internal <= max_external and _one_digit_apart(external, total - internal):
+        fixes.append((internal, total - internal, total))
+    if external_ok and 0 <= total - external <= max_internal and _one_digit_apart(internal, total - external):
+        fixes.append((total - external, external, total))
+    return fixes[0] if len(fixes) == 1 else None
+
+
+def test_code_correction():
+    """Snap misread codes against a large synthetic catalog and repair marks."""
+    print("Running OCR correction checks...")
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "catalog.csv")
+        rows = [(f"B{dept}{lab}{sem}{n:02d}", 3, "SUBJECT", 50, 50, 2022, sem)
+                for dept in ("CS", "EC", "ME", "CV", "AI", "IS") for lab in ("", "L")
+                for sem in range(1, 9) for n in range(60)]
+        with open(csv_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            writer.writerows(rows)
+        corrector = CodeCorrector(CreditCatalog(csv_path, os.path.join(tmp, "catalog.bin"), check_interval=0))
+
+        cases = {
+            "BCSL404": "BCSL404",   # listed as read
+            "BCSL4O4": "BCSL404",   # O for 0
+            "8CSL404": "BCSL404",   # 8 for B
+            "BC5I4O4": "BCSL404",   # 5 for S, I for L, O for 0
+            "bcs401": "BCS401",
+            "BCS-401": "BCS401",    # stray mark
+            "BCS4A01": "BCS401",    # stray letter: one edit, same number
+            "BBCS401": "BCS401",
+            "BCSS401": None,        # BCS401 or BCSL401?
+            "BCS4X1": None,         # the number itself is unreadable
+            "BCS4011": None,
+            "BC401": None,          # BCS401, BEC401, BAI401... can't tell which
+            "BCS999": None,         # not a misread of anything listed
+            "THEORY": None,
+            "MATHEMATICS": None,
+            "1AB23CS001": None,     # the USN
+        }
+        for token, expected in cases.items():
+            assert corrector.snap(token, fuzzy=True) == expected, (token, corrector.snap(token, fuzzy=True))
+        # Without fuzzy, only confusions are undone
+        assert corrector.snap("BCS4A01") is None and corrector.snap("BCSL4O4") == "BCSL404"
+
+        tree = corrector._current()[3]["401"]
+        misreads = [row[0].replace("0", "O").replace("S", "5") for row in rows]
+        start = time.perf_counter()
+        assert [corrector.snap(token) for token in misreads] == [row[0] for row in rows]
+        per_snap = (time.perf_counter() - start) / len(rows)
+        start = time.perf_counter()
+        _, visited = tree.search(canonical("BCS4A01"), 1)
+        fuzzy_time = time.perf_counter() - start
+        print(f"✓ {len(rows)} codes: a misread snaps in {per_snap * 1e6:.1f} µs; a fuzzy lookup takes "
+              f"{fuzzy_time * 1e6:.0f} µs and visits {visited} of the {tree.size} codes numbered 401")
+
+    assert misread_number("4O") == "40" and misread_number("S5") == "55" and misread_number("1l") == "11"
+    assert misread_number("IS") is None and misread_number("5G") is None and misread_number("THE") is None
+
+    assert repair_marks(20, 35, 55, 50, 50) is None             # nothing to fix
+    assert repair_marks(20, 35, 95, 50, 50) == (20, 35, 55)     # 5 read as 9: only the total can be it
+    assert repair_marks(80, 35, 65, 50, 50) == (30, 35, 65)     # 3 read as 8, internal over its maximum
+    assert repair_marks(20, 95, 65, 50, 50) == (20, 45, 65)     # 4 read as 9, external over its maximum
+    assert repair_marks(20, 35, 56, 50, 50) is None             # total or external: can't tell
+    assert repair_marks(20, 35, 75, 50, 50) is None             # two digits off
+    print("✓ Misread numbers and marks sums repaired only when unambiguous")
+
+
+if __name__ == "__main__":
+    test_code_correction()
@@ -0,0 +1,188 @@
+"""
+Page images for OCR: only the parts of a scan that hold text, as 1-bit PNG.
+
+    from ocr_image import page_image
+    png, details = page_image(page, dpi=300, max_pixels=9_000_000)
+
+A full A4 page at 300 DPI as colour PNG is megabytes, most of it margins,
+blank space between the header and the table, logos and table rules -
+none of which we parse. page_image() first renders the page at a tiny
+probe DPI to find where the text is, then renders only that part at the
+OCR DPI in grayscale, cuts out the blank bands between blocks of text and
+any picture-like blocks, binarizes what is left (Bradley adaptive
+threshold, so uneven lighting on phone photos doesn't black out a corner),
+erases long table rules, and packs the result as a 1-bit PNG.
+"""
+import struct
+import zlib
+import numpy as np
+
+# The probe render only has to show where the ink is
+PROBE_DPI = 40
+# Blank gaps taller than this (inches) split the page into separate bands
+BAND_GAP = 0.12
+# White space kept around each band, and put between bands when stacked
+BAND_PADDING = 0.05
+# Bands this dark overall are pictures (logos, photos, stamps), not text
+PICTURE_DENSITY = 0.4
+PICTURE_MIN_HEIGHT = 0.4
+# Bradley threshold: a pixel is ink when darker than its neighbourhood mean by this much
+ADAPTIVE_WINDOW = 0.3
+ADAPTIVE_DARKER = 0.15
+# Rows/columns inked across more than this share of a band are table rules
+RULE_FRACTION = 0.6
+
+
+def _gray(pix):
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+
+
+def otsu_threshold(gray):
+    """The gray level that best splits `gray` into ink and paper (Otsu's method)."""
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight = np.cumsum(histogram)
+    total = weight[-1]
+    mass = np.cumsum(histogram * levels)
+    background = total - weight
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_ink = mass / weight
+        mean_paper = (mass[-1] - mass) / background
+        between = weight * background * (mean_ink - mean_paper) ** 2
+    return int(np.nanargmax(between))
+
+
+def find_bands(ink, dpi):
+    """
+    Row ranges [(top, bottom)] of `ink` (a boolean probe image) that hold
+    text, plus the (left, right) column span they share. Pictures and
+    isolated specks are left out.
+    """
+    rows = np.flatnonzero(ink.sum(axis=1) > 1)
+    if rows.size == 0:
+        return [], None
+    # A new band starts wherever the gap to the previous inked row is too tall
+    breaks = np.flatnonzero(np.diff(rows) > BAND_GAP * dpi)
+    starts = np.concatenate(([rows[0]], rows[breaks + 1]))
+    ends = np.concatenate((rows[breaks], [rows[-1]])) + 1
+
+    bands = []
+    left, right = ink.shape[1], 0
+    for top, bottom in zip(starts, ends):
+        block = ink[top:bottom]
+        columns = np.flatnonzero(block.any(axis=0))
+        area = (bottom - top) * (columns[-1] - columns[0] + 1)
+        if bottom - top < 2 and block.sum() < 4:
+            continue  # dust
+        if bottom - top >= PICTURE_MIN_HEIGHT * dpi and block.sum() / area > PICTURE_DENSITY:
+            continue
+        bands.append((int(top), int(bottom)))
+        left, right = min(left, columns[0]), max(right, columns[-1] + 1)
+    return bands, ((int(left), int(right)) if bands else None)
+
+
+def _bradley(gray, half):
+    height, width = gray.shape
+    # Summed-area table with a zero row/column in front, so any window sum is four lookups
+    table = np.zeros((height + 1, width + 1), dtype=np.uint32 if gray.size < 2 ** 24 else np.uint64)
+    np.cumsum(gray, axis=0, out=table[1:, 1:])
+    np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+    y0 = np.clip(np.arange(height) - half, 0, height)
+    y1 = np.clip(np.arange(height) + half + 1, 0, height)
+    x0 = np.clip(np.arange(width) - half, 0, width)
+    x1 = np.clip(np.arange(width) + half + 1, 0, width)
+    window_sum = (table[y1][:, x1].astype(np.int64) - table[y0][:, x1]
+                  - table[y1][:, x0] + table[y0][:, x0])
+    count = (y1 - y0)[:, None] * (x1 - x0)[None, :]
+    return gray.astype(np.int64) * count * 100 < window_sum * int(100 * (1 - ADAPTIVE_DARKER))
+
+
+def binarize(gray, dpi, stripe=512):
+    """
+    Ink mask by Bradley's adaptive threshold over a window of
+    ADAPTIVE_WINDOW inches. Worked in stripes of `stripe` rows (plus the
+    window's overlap) so a full page never needs full-size int64 buffers.
+    """
+    half = max(1, int(ADAPTIVE_WINDOW * dpi) // 2)
+    height = gray.shape[0]
+    ink = np.empty(gray.shape, dtype=bool)
+    for start in range(0, height, stripe):
+        top = max(0, start - half)
+        stop = min(height, start + stripe)
+        window = _bradley(gray[top:min(height, stop + half)], half)
+        ink[start:stop] = window[start - top:stop - top]
+    return ink
+
+
+def erase_rules(ink):
+    """Clear table borders: rows or columns inked across most of the band."""
+    height, width = ink.shape
+    ink[ink.sum(axis=1) > RULE_FRACTION * width, :] = False
+    if height > 2:
+        ink[:, ink.sum(axis=0) > RULE_FRACTION * height] = False
+    return ink
+
+
+def encode_bilevel_png(ink):
+    """A 1-bit grayscale PNG of `ink` (True = black)."""
+    height, width = ink.shape
+    # Bit depth 1: 0 is black, so pack the paper pixels as 1s; each row starts with filter type 0
+    rows = np.packbits(~ink, axis=1)
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rows]).tobytes()
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 1, 0, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(raw, 9)) + chunk(b"IEND", b""))
+
+
+def page_image(page, dpi, max_pixels, roi=True):
+    """
+    PNG bytes to OCR for a PyMuPDF `page`, and a dict of what was done.
+    With roi=False the whole page is sent (still 1-bit). Returns
+    (None, details) when the page has no text-like ink at all.
+    """
+    import fitz  # deferred like parser.open_document
+
+    rect = page.rect
+    bands, span = [(0, None)], None
+    if roi:
+        probe = page.get_pixmap(dpi=PROBE_DPI, colorspace=fitz.csGRAY)
+        gray = _gray(probe)
+        probe_ink = gray < otsu_threshold(gray)
+        if probe_ink.mean() > 0.5:
+            probe_ink = ~probe_ink  # light text on a dark background
+        bands, span = find_bands(probe_ink, PROBE_DPI)
+        if not bands:
+            return None, {"regions": 0}
+        scale = 72 / PROBE_DPI
+        pad = BAND_PADDING * 72
+        rect = fitz.Rect(span[0] * scale - pad, bands[0][0] * scale - pad,
+                         span[1] * scale + pad, bands[-1][1] * scale + pad) & page.rect
+
+    # The clip is rendered whole before blank bands are cut, so it is what the budget caps
+    area = (rect.width / 72) * (rect.height / 72)
+    if area > 0:
+        dpi = max(1, min(dpi, int((max_pixels / area) ** 0.5)))
+
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, clip=rect)
+    gray = _gray(pix)
+    if roi:
+        ratio = dpi / PROBE_DPI
+        pad = int(BAND_PADDING * dpi)
+        origin = rect.y0 * dpi / 72
+        pieces = []
+        for top, bottom in bands:
+            start = max(0, int(top * ratio - origin) - pad)
+            stop = min(gray.shape[0], int(bottom * ratio - origin) + pad)
+            if stop > start:
+                pieces.append(erase_rules(binarize(gray[start:stop], dpi)))
+                pieces.append(np.zeros((pad, gray.shape[1]), dtype=bool))
+        ink = np.vstack(pieces)
+    else:
+        ink = erase_rules(binarize(gray, dpi))
+    del pix, gray
+    return encode_bilevel_png(ink), {"regions": len(bands), "dpi": dpi,
+                                      "width": ink.shape[1], "height": ink.shape[0]}
@@ -1,19 +1,71 @@
-import fitz
 import re
 import json
+import bisect
 import sys
 import requests
 import os
-import traceback
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from http_client import get_session, post_with_retries
+from catalog import credit_catalog
+from validation import validate_card, max_marks
+from ocr_codes import snap_code, misread_number, repair_marks
+from scheduler import (ocr_scheduler, Overloaded, retry_after_header, PRIORITY_INTERACTIVE,
+                       PRIORITY_RETRY)
+from logs import get_logger
+from metrics import (stage_timer, OCR_FALLBACKS, OCR_PAGES, ALTERNATIVE_PARSER_HITS,
+                     SKIPPED_SUBJECTS, PARSES, OCR_UPLOAD_BYTES, PARSE_TIERS, VALIDATION_FAILURES,
+                     OCR_CORRECTIONS)
 
 load_dotenv()
 
-CREDITS_MAP = {
-    'BCS401': 3, 'BCS402': 4, 'BCS403': 4, 'BCSL404': 1, 'BBOC407': 2,
-    'BUHK408': 1, 'BPEK459': 0, 'BCS405A': 3, 'BDSL456B': 1, 'BCSL405': 1, 'BCSL406': 1,
-}
+log = get_logger("parser")
 
+# Bump whenever a change to the parsing logic can change the output for the
+# same PDF - cached results from older versions are then ignored.
+PARSER_VERSION = "9"
+
+# Point OCR_SPACE_URL at fake_ocr_server.py to exercise the OCR path offline
+OCR_SPACE_URL = os.getenv("OCR_SPACE_URL", "https://api.ocr.space/parse/image")
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", 4))
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", 60))
+OCR_RETRIES = int(os.getenv("OCR_RETRIES", 2))
+
+# Scans are rendered at OCR_RENDER_DPI for OCR, but never past
+# OCR_MAX_PIXELS: an A4 page at 300 DPI is ~8.7 MP (~26 MB as RGB), and an
+# oversized page at full DPI could take many times that
+OCR_RENDER_DPI = int(os.getenv("OCR_RENDER_DPI", 300))
+OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", 9_000_000))
+# Send only the text regions of a page, binarized (see ocr_image.py);
+# OCR_ROI=0 sends the whole page, still binarized
+OCR_ROI = os.getenv("OCR_ROI", "1") != "0"
+# Scans are first OCR'd cheaply - text regions at OCR_LOW_DPI - and read
+# again as a whole page at OCR_RENDER_DPI only if that fails validation
+OCR_LOW_DPI = int(os.getenv("OCR_LOW_DPI", 150))
+OCR_TIERS = (("ocr_low", OCR_LOW_DPI, OCR_ROI), ("ocr_full", OCR_RENDER_DPI, False))
+
+# Returned when a parse runs out of memory (see workers.py for the limit)
+OUT_OF_MEMORY_MESSAGE = "This PDF needs more memory to parse than one upload is allowed."
+# Returned, with "retry_after", when OCR is too busy to take the card (see scheduler.py)
+OCR_BUSY_MESSAGE = "Too many scanned cards are being read right now. Please retry shortly."
+# OCR.space answers these when we are over its rate or it is overloaded
+BUSY_STATUS = (429, 503)
+
+# A page with less text than this is treated as a scan and sent to OCR
+PAGE_TEXT_MIN_CHARS = 50
+
+USN_PATTERN = re.compile(r"University Seat Number\s*:?\s*(\w+)", re.IGNORECASE)
+NAME_PATTERN = re.compile(r"Student Name\s*:?\s*(.+?)(?:\n|$)", re.IGNORECASE)
+SEMESTER_PATTERN = re.compile(r"Semester\s*:?\s*(\d{1,2})\b", re.IGNORECASE)
+# The word after "Semester" in a semester heading, as get_text("words") splits it
+SEMESTER_WORD_AFTER = re.compile(r":?\d{0,2}$")
+# The legend printed right under the results table - once we've seen it the
+# whole table has been read and later pages (notes, signatures) can be skipped
+TABLE_END_PATTERN = re.compile(r"Nomenclature|Abbreviations", re.IGNORECASE)
+DIGITAL_SUBJECT_PATTERN = re.compile(
+    r"([A-Z]{3,}\d{3}[A-Z]?)\s+(.+?)\s+(\d+)\s+(\d+)\s+(\d+)\s+([PF])\s*",
+    re.DOTALL | re.MULTILINE
+)
 
 def get_grade_points(total_marks, result_status):
     if result_status == 'F':
@@ -45,276 +97,798 @@ def test_grade_logic():
         sys.exit(1)
 
 
-def extract_text_with_ocrspace(doc):
-    """Extract text from PDF using ocr.space API."""
-    print("--- Starting OCR.space extraction ---")
-    full_text = ""
-    api_key = os.getenv("OCR_SPACE_API_KEY")
-    
-    if not api_key:
-        raise ValueError("OCR_SPACE_API_KEY not found in .env file")
-        
-    url = "https://api.ocr.space/parse/image"
-    
-    for i, page in enumerate(doc):
-        print(f"Processing page {i+1} with OCR.space...")
-        
-        pix = page.get_pixmap(dpi=300)
-        img_data = pix.tobytes("png")
-        
-        try:
-            response = requests.post(
+def ocr_response_text(api_result, page_number):
+    """The text in one OCR.space response; raises if the API reports an error."""
+    if api_result.get('IsErroredOnProcessing'):
+        OCR_PAGES.inc(outcome="api_error")
+        log.error("ocr_api_error", page=page_number, error=api_result.get('ErrorMessage'))
+        raise Exception(f"OCR.space Error: {api_result.get('ErrorMessage')}")
+
+    if api_result.get('ParsedResults'):
+        page_text = api_result['ParsedResults'][0]['ParsedText']
+        OCR_PAGES.inc(outcome="ok")
+        log.debug("ocr_page_done", page=page_number, characters=len(page_text))
+        return page_text
+
+    OCR_PAGES.inc(outcome="empty")
+    log.warning("ocr_page_empty", page=page_number)
+    return ""
+
+
+def _ocr_page(session, url, api_key, page_number, img_data):
+    """Send one rendered page to OCR.space and return its text."""
+    log.debug("ocr_page_sent", page=page_number, png_bytes=len(img_data))
+    OCR_UPLOAD_BYTES.inc(len(img_data))
+    try:
+        with stage_timer("ocr_request"):
+            response = post_with_retries(
+                session,
                 url,
+                retries=OCR_RETRIES,
                 files={'file': ('scan.png', img_data, 'image/png')},
                 data={'apikey': api_key, 'language': 'eng'},
-                timeout=60
+                timeout=OCR_TIMEOUT,
+                limiter=ocr_scheduler
             )
-            
-            response.raise_for_status()
-            api_result = response.json()
+        return ocr_response_text(response.json(), page_number)
 
-            if api_result.get('IsErroredOnProcessing'):
-                print(f"❌ API Error: {api_result.get('ErrorMessage')}")
-                raise Exception(f"OCR.space Error: {api_result.get('ErrorMessage')}")
+    except requests.exceptions.HTTPError as e:
+        OCR_PAGES.inc(outcome="request_failed")
+        log.error("ocr_request_failed", page=page_number, error=str(e))
+        if e.response is not None and e.response.status_code in BUSY_STATUS:
+            raise Overloaded("ocr", retry_after_header(e.response) or 10) from e
+        raise
+
+    except requests.exceptions.RequestException as e:
+        OCR_PAGES.inc(outcome="request_failed")
+        log.error("ocr_request_failed", page=page_number, error=str(e))
+        raise
+
+
+def _report(progress, stage, **details):
+    """Tell an optional progress callback (see jobs.py) which stage we reached."""
+    if progress:
+        progress(stage, **details)
+
+
+def render_png(page, dpi=OCR_RENDER_DPI, roi=OCR_ROI):
+    """
+    The image of `page` to send to OCR (see ocr_image.py), within the pixel
+    budget, as PNG bytes - or None when there is nothing on it to read.
+    """
+    from ocr_image import page_image  # deferred: pulls in NumPy, only needed for scans
+    try:
+        img_data, details = page_image(page, dpi, OCR_MAX_PIXELS, roi)
+        log.debug("ocr_page_rendered", page=page.number + 1, **details)
+        return img_data
+    except Exception as e:
+        # MuPDF reports a failed allocation as a plain error
+        if "malloc" in str(e):
+            raise MemoryError(str(e)) from e
+        raise
+
+
+def ocr_api_key():
+    api_key = os.getenv("OCR_SPACE_API_KEY")
+    if not api_key:
+        raise ValueError("OCR_SPACE_API_KEY not found in .env file")
+    return api_key
 
-            if api_result.get('ParsedResults'):
-                page_text = api_result['ParsedResults'][0]['ParsedText']
-                print(f"  ✓ Extracted {len(page_text)} characters from page {i+1}")
-                full_text += page_text + "\n"
-            else:
-                print(f"  ✗ No text found on page {i+1}")
 
-        except requests.exceptions.RequestException as e:
-            print(f"❌ API Request Failed for page {i+1}: {e}")
+def render_pages(doc, page_numbers, dpi=OCR_RENDER_DPI, roi=OCR_ROI):
+    """
+    {page_number: png} for the given 0-based pages of `doc`. Blank pages
+    are left out. Rendering is one page at a time - PyMuPDF documents
+    aren't thread-safe - but each image is a small 1-bit PNG, so holding
+    a whole card's pages is cheap.
+    """
+    images = {}
+    for i in page_numbers:
+        with stage_timer("render"):
+            img_data = render_png(doc[i], dpi, roi)
+        if img_data is not None:
+            images[i] = img_data
+    return images
+
+
+def ocr_priority(priority, tier):
+    """The scheduler priority for an OCR round of `tier` on a card parsed at `priority`."""
+    return priority if tier == OCR_TIERS[0][0] else priority + PRIORITY_RETRY
+
+
+def ocr_images(images, progress=None, priority=PRIORITY_INTERACTIVE):
+    """
+    OCR rendered pages ({page_number: png}) and return {page_number: text},
+    with up to OCR_CONCURRENCY requests in flight over a shared keep-alive
+    session. All the pages are admitted by ocr_scheduler together; raises
+    Overloaded when it sheds them. async_app.py has the asyncio version.
+    """
+    api_key = ocr_api_key()
+    if not images:
+        return {}
+    session = get_session("ocrspace")
+    with ocr_scheduler.slot(len(images), priority), \
+            ThreadPoolExecutor(max_workers=max(1, OCR_CONCURRENCY)) as executor:
+        futures = {}
+        for i, img_data in images.items():
+            futures[i] = executor.submit(_ocr_page, session, OCR_SPACE_URL, api_key, i + 1, img_data)
+            if progress:
+                futures[i].add_done_callback(
+                    lambda f, page=i + 1: f.exception() is None and _report(progress, "ocr_page", page=page)
+                )
+        
+        try:
+            return {i: future.result() for i, future in futures.items()}
+        except Exception:
+            # One page failed for good - don't keep paying for the others
+            for future in futures.values():
+                future.cancel()
             raise
-            
-    print("--- OCR.space complete ---")
+
+
+def join_page_texts(page_texts):
+    """The OCR text of a card from {page_number: text}, in page order."""
+    full_text = "".join(page_texts[i] + "\n" for i in sorted(page_texts) if page_texts[i])
+    log.debug("ocr_complete", pages=len(page_texts), characters=len(full_text))
     return full_text
 
 
+def extract_text_with_ocrspace(doc, page_numbers=None, progress=None, dpi=OCR_RENDER_DPI, roi=OCR_ROI):
+    """Extract text from PDF (or just `page_numbers`) using ocr.space API."""
+    if page_numbers is None:
+        page_numbers = range(doc.page_count)
+    ocr_api_key()  # fail before rendering anything
+    return join_page_texts(ocr_images(render_pages(doc, page_numbers, dpi, roi), progress))
+
+
+# OCR text is split into whitespace-separated tokens by one precompiled
+# pattern with no nested quantifiers, so tokenizing is linear in the input
+# and a garbage scan can't trigger catastrophic backtracking. Table rules
+# that OCR reads as '|' separate tokens like whitespace does.
+OCR_TOKEN_PATTERN = re.compile(r"\n|[^\s|]+")
+SUBJECT_CODE_WORD = re.compile(r"^[A-Z]{3,}\d{3}[A-Z]?$")
+# Longest plausible subject code; longer tokens are never matched against it
+MAX_CODE_LENGTH = 12
+# Tokens without a digit are title words: no misread code or mark to put right
+HAS_DIGIT = re.compile(r"\d")
+
+TOKEN_CODE = "code"
+TOKEN_INT = "int"
+TOKEN_RESULT = "result"
+TOKEN_TEXT = "text"
+TOKEN_NEWLINE = "newline"
+
+# Digit counts the marks columns can have: internal, external, total
+MARK_DIGITS = ((1, 2), (1, 2), (2, 3))
+
+
+def tokenize_ocr_text(full_text):
+    """
+    Yield (kind, value) for every token of OCR output, in order. Misread
+    subject codes and marks are put right on the way (see ocr_codes.py),
+    so one confused character doesn't cost the whole row.
+    """
+    for match in OCR_TOKEN_PATTERN.finditer(full_text):
+        token = match.group()
+        if token == "\n":
+            yield TOKEN_NEWLINE, token
+        elif token.isdigit():
+            yield TOKEN_INT, token
+        elif token == "P" or token == "F":
+            yield TOKEN_RESULT, token
+        elif len(token) <= MAX_CODE_LENGTH and SUBJECT_CODE_WORD.match(token):
+            yield TOKEN_CODE, _corrected("code", token, snap_code(token) or token)
+        elif not HAS_DIGIT.search(token):
+            yield TOKEN_TEXT, token
+        else:
+            code = snap_code(token, fuzzy=True)
+            number = None if code else misread_number(token)
+            if code:
+                yield TOKEN_CODE, _corrected("code", token, code)
+            elif number:
+                yield TOKEN_INT, _corrected("number", token, number)
+            else:
+                yield TOKEN_TEXT, token
+
+
+def _corrected(kind, read, value):
+    if value != read:
+        log.debug("ocr_corrected", kind=kind, read=read, value=value)
+        OCR_CORRECTIONS.inc(kind=kind)
+    return value
+
+
+def _marks_fit(numbers):
+    return all(lo <= len(n) <= hi for n, (lo, hi) in zip(numbers, MARK_DIGITS))
+
+
+def assemble_ocr_rows(tokens, line_mode=False):
+    """
+    State machine that turns OCR tokens into subject rows in one pass.
+
+    A row is a subject code, title words, then three integers (internal,
+    external, total) and, if it follows directly, a P/F result. Numbers that
+    don't fit the marks columns are pushed into the title, like the
+    original lazy title regex did. In `line_mode` a row must finish on the
+    line its code starts on.
+
+    Returns (rows, results) where `results` lists every standalone P/F in
+    the text, for OCR output that prints the result column separately.
+    """
+    rows = []
+    results = []
+    row = None
+    numbers = []
+    awaiting_result = False
+    
+    def drop_row():
+        nonlocal row, numbers, awaiting_result
+        row = None
+        numbers = []
+        awaiting_result = False
+    
+    for kind, value in tokens:
+        if kind == TOKEN_RESULT:
+            results.append(value)
+            if awaiting_result:
+                row["result"] = value
+                drop_row()
+            elif row is not None:
+                row["title"].append(value)
+            continue
+        
+        if kind == TOKEN_CODE:
+            # A new code always starts a new row; an unfinished one is dropped
+            drop_row()
+            row = {"code": value, "title": [], "marks": None, "result": None}
+            continue
+        
+        if row is None:
+            continue
+        
+        if kind == TOKEN_NEWLINE:
+            if line_mode:
+                drop_row()
+            continue
+        
+        if awaiting_result:
+            # Anything other than P/F after the marks: result isn't inline
+            if kind == TOKEN_TEXT:
+                drop_row()
+            continue
+        
+        if kind == TOKEN_INT:
+            numbers.append(value)
+            if len(numbers) == 3:
+                if _marks_fit(numbers):
+                    row["marks"] = [int(n) for n in numbers]
+                    rows.append(row)
+                    awaiting_result = True
+                else:
+                    row["title"].append(numbers.pop(0))
+            continue
+        
+        # Plain text: any numbers seen so far were part of the title
+        row["title"].extend(numbers)
+        numbers = []
+        row["title"].append(value)
+    
+    return rows, results
+
+
+def _ocr_subject(code, title, internal, external, total, result):
+    return {
+        "code": code,
+        "title": title,
+        "internal": internal,
+        "external": external,
+        "total": total,
+        "result": result,
+        "credits": credit_catalog.credits(code),
+        "points": get_grade_points(total, result)
+    }
+
+
 def parse_ocr_text(full_text):
     """
     Parse OCR.space output - works with flexible formatting.
     """
-    print("--- Running OCR Parser ---")
     subjects = []
     
     try:
-        # DEBUG: Print first 500 chars to see structure
-        print(f"OCR Output (first 500 chars):\n{full_text[:500]}\n")
-        
-        # --- FIX 1: More flexible subject pattern ---
-        # Works with: CODE NAME INT EXT TOTAL (on same or different lines)
-        subject_pattern = re.compile(
-            r"([A-Z]{3,}\d{3}[A-Z]?)"  # 1: Code
-            r"\s+"
-            r"(.+?)"                    # 2: Name (can have spaces/newlines)
-            r"\s+"
-            r"(\d{1,2})"                # 3: Internal (1-2 digits)
-            r"\s+"
-            r"(\d{1,2})"                # 4: External (1-2 digits)
-            r"\s+"
-            r"(\d{2,3})",               # 5: Total (2-3 digits)
-            re.DOTALL
-        )
-        
-        subject_matches = subject_pattern.findall(full_text)
-        print(f"  Found {len(subject_matches)} subjects")
+        log.debug("ocr_text", preview=full_text[:500])
         
-        # --- FIX 2: More flexible Result pattern ---
-        # Just find all P/F letters (they appear in a column)
-        results = re.findall(r'\b([PF])\b', full_text)
-        print(f"  Found {len(results)} results")
+        rows, results = assemble_ocr_rows(tokenize_ocr_text(full_text))
+        log.debug("ocr_rows", rows=len(rows), results=len(results))
         
-        # --- FIX 3: Debug output ---
-        if subject_matches:
-            print(f"  First subject: {subject_matches[0]}")
-        if results:
-            print(f"  Results list: {results[:10]}")
-        
-        # --- FIX 4: Handle mismatch gracefully ---
-        if not subject_matches:
-            print("⚠️  No subjects found. Trying alternative parsing...")
+        if not rows:
+            log.info("ocr_alternative_parser", reason="no_rows")
+            ALTERNATIVE_PARSER_HITS.inc(parser="ocr_line_mode")
             return parse_ocr_text_alternative(full_text)
         
-        # Use only as many results as subjects
-        results = results[:len(subject_matches)]
-        
-        if not results:
-            print("⚠️  No results (P/F) found. Assuming all PASS...")
-            results = ['P'] * len(subject_matches)
-        
-        if len(subject_matches) != len(results):
-            print(f"⚠️  Mismatch: {len(subject_matches)} subjects but {len(results)} results")
-            print(f"    Using first {min(len(subject_matches), len(results))} entries")
-        
-        # Process subjects
-        for i in range(min(len(subject_matches), len(results))):
-            match = subject_matches[i]
-            result = results[i]
+        # Prefer the P/F printed right after each row's marks. When the OCR
+        # engine read the result column separately, pair by position instead.
+        if all(row["result"] for row in rows):
+            results = [row["result"] for row in rows]
+        else:
+            results = results[:len(rows)]
+            if not results:
+                log.warning("ocr_results_missing", rows=len(rows), assumed="P")
+                results = ['P'] * len(rows)
+        
+        if len(rows) != len(results):
+            log.warning("ocr_result_mismatch", rows=len(rows), results=len(results))
+            SKIPPED_SUBJECTS.inc(len(rows) - len(results), reason="no_result")
+        
+        for row, result in zip(rows, results):
+            code = row["code"]
+            internal, external, total = row["marks"]
             
-            try:
-                code = match[0].strip()
-                title = match[1].strip().replace("\n", " ").replace("  ", " ")
-                internal = int(match[2])
-                external = int(match[3])
-                total = int(match[4])
-                
-                # Validate marks
-                if internal > 50 or external > 50 or total > 100:
-                    print(f"⚠️  Skipping {code} - marks seem invalid (I:{internal} E:{external} T:{total})")
-                    continue
-                
-                credits = CREDITS_MAP.get(code, 0)
-                points = get_grade_points(total, result)
-                
-                subjects.append({
-                    "code": code,
-                    "title": title,
-                    "internal": internal,
-                    "external": external,
-                    "total": total,
-                    "result": result,
-                    "credits": credits,
-                    "points": points
-                })
-                
-            except Exception as e:
-                print(f"⚠️  Error processing subject {i}: {e}")
+            # Validate marks against the course's maximums, after putting
+            # right a digit the internal + external == total check pins down
+            max_internal, max_external = max_marks(credit_catalog.get(code))
+            repaired = repair_marks(internal, external, total, max_internal, max_external)
+            if repaired:
+                log.info("ocr_marks_repaired", code=code, read=[internal, external, total], marks=list(repaired))
+                OCR_CORRECTIONS.inc(kind="marks")
+                internal, external, total = repaired
+            if internal > max_internal or external > max_external or total > max_internal + max_external:
+                log.warning("subject_skipped", code=code, reason="invalid_marks",
+                            internal=internal, external=external, total=total)
+                SKIPPED_SUBJECTS.inc(reason="invalid_marks")
                 continue
+            
+            subjects.append(_ocr_subject(code, " ".join(row["title"]), internal, external, total, result))
         
         return subjects if subjects else None
 
-    except Exception as e:
-        print(f"❌ Error in parse_ocr_text: {e}")
-        traceback.print_exc()
+    except Exception:
+        log.exception("ocr_parse_failed")
         return None
 
 
 def parse_ocr_text_alternative(full_text):
-    """Alternative parser if main parser fails."""
-    print("  Trying alternative parsing...")
+    """Alternative parser if main parser fails: rows must sit on one line."""
+    rows, _ = assemble_ocr_rows(tokenize_ocr_text(full_text), line_mode=True)
+    
+    subjects = []
+    for row in rows:
+        code = row["code"]
+        internal, external, total = row["marks"]
+        title = " ".join(row["title"]) or f"Subject {code}"
+        subjects.append(_ocr_subject(code, title, internal, external, total, row["result"] or 'P'))
+    
+    return subjects if subjects else None
+
+
+def parse_digital_text(full_text):
+    """Parse subjects from a PDF's embedded text layer."""
     subjects = []
     
-    # Split by lines and look for subject-like patterns
-    lines = full_text.split('\n')
+    for match in DIGITAL_SUBJECT_PATTERN.findall(full_text):
+        code = match[0].strip()
+        credits = credit_catalog.credits(code)
+        points = get_grade_points(int(match[4]), match[5].strip())
+        subjects.append({
+            "code": code,
+            "title": match[1].strip().replace("\n", " "),
+            "internal": int(match[2]),
+            "external": int(match[3]),
+            "total": int(match[4]),
+            "result": match[5].strip(),
+            "credits": credits,
+            "points": points
+        })
     
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        # Look for a line starting with subject code
-        if re.match(r'^[A-Z]{3,}\d{3}', line):
-            match = re.search(r'([A-Z]{3,}\d{3}[A-Z]?)\s+(.+)', line)
-            if match:
-                code = match.group(1)
-                rest = match.group(2)
-                
-                # Look for marks in next lines
-                marks_match = re.search(r'(\d{1,2})\s+(\d{1,2})\s+(\d{2,3})', rest)
-                if marks_match:
-                    internal = int(marks_match.group(1))
-                    external = int(marks_match.group(2))
-                    total = int(marks_match.group(3))
-                    
-                    # Look for P/F
-                    pf_match = re.search(r'([PF])', rest)
-                    result = pf_match.group(1) if pf_match else 'P'
-                    
-                    credits = CREDITS_MAP.get(code, 0)
-                    points = get_grade_points(total, result)
-                    
-                    subjects.append({
-                        "code": code,
-                        "title": f"Subject {code}",
-                        "internal": internal,
-                        "external": external,
-                        "total": total,
-                        "result": result,
-                        "credits": credits,
-                        "points": points
-                    })
+    return subjects
+
+
+MARK_COLUMNS = ("internal", "external", "total", "result")
+# Words whose vertical centre is this close above a code still belong to its row
+ROW_TOLERANCE = 3
+# Titles wrap onto at most this many lines; anything lower isn't part of the row
+MAX_ROW_LINES = 3
+
+
+def _find_columns(words):
+    """
+    Locate the results table header and derive each column's x-range.
+
+    Returns a dict with the y where the table body starts, the x below which
+    a word is a subject code, the x where the mark columns begin, and an
+    (x_lo, x_hi) range per mark column - or None if there's no header.
+    """
+    headers = {}
+    code_header = None
+    for x0, y0, x1, y1, text, *_ in words:
+        key = text.lower()
+        if key in MARK_COLUMNS and key not in headers:
+            headers[key] = (x0, y0, x1, y1)
+        elif key == "code" and code_header is None:
+            code_header = (x0, y0, x1, y1)
+    
+    if len(headers) < len(MARK_COLUMNS):
+        return None
+    
+    centres = [(headers[c][0] + headers[c][2]) / 2 for c in MARK_COLUMNS]
+    if centres != sorted(centres):
+        return None
+    
+    # Column boundaries sit halfway between neighbouring header centres;
+    # the outer edges mirror the nearest inner gap.
+    bounds = [centres[0] - (centres[1] - centres[0]) / 2]
+    bounds += [(a + b) / 2 for a, b in zip(centres, centres[1:])]
+    bounds.append(centres[-1] + (centres[-1] - centres[-2]) / 2)
+    
+    marks_start = bounds[0]
+    code_end = marks_start
+    if code_header:
+        # Codes are printed under the "Code" header, titles start right of it
+        code_end = code_header[2] + (code_header[2] - code_header[0])
+    
+    return {
+        # Multi-line headers ("Internal\nMarks") - body starts below the lowest header word
+        "body_top": max(h[3] for h in headers.values()),
+        "code_end": code_end,
+        "marks_start": marks_start,
+        "ranges": {c: (bounds[i], bounds[i + 1]) for i, c in enumerate(MARK_COLUMNS)},
+    }
+
+
+def _layout_rows(words, columns):
+    """
+    Group table words into rows with one merge pass over words sorted by height.
+
+    Every subject code in the code column opens a row; each other word goes
+    to the row whose code is the last one above it (within ROW_TOLERANCE)
+    unless it sits more than MAX_ROW_LINES lines below that code.
+    Words from the legend under the table onwards are ignored.
+    """
+    body = []
+    for x0, y0, x1, y1, text, *_ in words:
+        y_mid = (y0 + y1) / 2
+        if y_mid > columns["body_top"]:
+            body.append((y_mid, (x0 + x1) / 2, x0, y1 - y0, text))
+    body.sort()
+    
+    table_end = next((w[0] for w in body if TABLE_END_PATTERN.match(w[4])), None)
+    if table_end is not None:
+        body = [w for w in body if w[0] < table_end]
+    
+    rows = [{"code": text, "y": y_mid, "height": height, "title": [], "cells": {}}
+            for y_mid, x_mid, _, height, text in body
+            if x_mid < columns["code_end"] and SUBJECT_CODE_WORD.match(text)]
+    if not rows:
+        return rows
+    
+    current = -1
+    for y_mid, x_mid, x0, _, text in body:
+        while current + 1 < len(rows) and rows[current + 1]["y"] - ROW_TOLERANCE <= y_mid:
+            current += 1
+        if current < 0:
+            continue
+        row = rows[current]
+        if text == row["code"] and y_mid == row["y"]:
+            continue
+        if y_mid - row["y"] > row["height"] * MAX_ROW_LINES:
+            continue
+        
+        if x_mid < columns["marks_start"]:
+            row["title"].append((y_mid, x0, text))
+            continue
+        for column, (lo, hi) in columns["ranges"].items():
+            if lo <= x_mid < hi:
+                # First token in a cell wins - wrapped text below it is ignored
+                row["cells"].setdefault(column, text)
+                break
+    
+    return rows
+
+
+def _page_sections(words):
+    """
+    A page's words cut at each "Semester : N" heading, so that on a
+    consolidated card every semester's table (with its own header and
+    legend) is read on its own. A single card's page is one or two sections.
+    """
+    splits = sorted(word[1] for word, following in zip(words, words[1:])
+                    if word[4].lower() == "semester" and SEMESTER_WORD_AFTER.match(following[4]))
+    if not splits:
+        return [words]
+    bounds = [float("-inf")] + splits + [float("inf")]
+    return [[w for w in words if lo <= (w[1] + w[3]) / 2 < hi] for lo, hi in zip(bounds, bounds[1:])]
+
+
+def parse_digital_layout(doc, page_numbers):
+    """
+    Parse subjects from word bounding boxes instead of the text stream.
+
+    The table's column x-ranges are found once from the header and reused
+    on continuation pages, then each word is assigned to a row and column
+    in a single pass - parse time is linear in the number of words and
+    doesn't depend on how the text layer orders its line breaks.
+    Returns None if no results table header was found.
+    """
+    subjects = []
+    columns = None
+    
+    for words in (section for i in page_numbers for section in _page_sections(doc[i].get_text("words"))):
+        section_columns = _find_columns(words)
+        if section_columns:
+            columns = section_columns
+        elif columns:
+            # Continuation page without its own header: table runs from the top
+            columns = dict(columns, body_top=0)
+        else:
+            continue
         
-        i += 1
+        for row in _layout_rows(words, columns):
+            cells = row["cells"]
+            result = cells.get("result")
+            try:
+                internal = int(cells["internal"])
+                external = int(cells["external"])
+                total = int(cells["total"])
+            except (KeyError, ValueError):
+                SKIPPED_SUBJECTS.inc(reason="incomplete_row")
+                continue
+            if result not in ("P", "F"):
+                SKIPPED_SUBJECTS.inc(reason="no_result")
+                continue
+            
+            code = row["code"]
+            title = " ".join(text for _, _, text in sorted(row["title"]))
+            subjects.append({
+                "code": code,
+                "title": title,
+                "internal": internal,
+                "external": external,
+                "total": total,
+                "result": result,
+                "credits": credit_catalog.credits(code),
+                "points": get_grade_points(total, result)
+            })
     
-    return subjects if subjects else None
+    if columns is None:
+        return None
+    return subjects
 
 
-def parse_marks_card(pdf_file_path):
-    """Parse marks card PDF."""
-    full_text = ""
-    doc = None
+def read_text_layer(doc):
+    """
+    Read each page's text layer. Scanning stops as soon as the text read
+    so far holds the whole card, unless the next page starts another
+    semester's table (a consolidated card).
+
+    Returns (digital_pages, scanned_pages, complete): {page_number: text}
+    for pages with a text layer, the pages without one, and whether the
+    text layer alone holds the USN, name and the end of the table.
+    """
+    digital_pages = {}
+    scanned_pages = []
+    # Each marker only needs to be found once, so every page is searched at most once
+    pending_markers = [USN_PATTERN, NAME_PATTERN, TABLE_END_PATTERN]
     
+    with stage_timer("text_extraction"):
+        for i, page in enumerate(doc):
+            text = page.get_text()
+            if not pending_markers:
+                if not SEMESTER_PATTERN.search(text):
+                    log.debug("pages_skipped", complete_after=i, skipped=doc.page_count - i)
+                    break
+                # Another semester follows: read on to the end of its table
+                pending_markers = [TABLE_END_PATTERN]
+            if len(text.strip()) >= PAGE_TEXT_MIN_CHARS:
+                digital_pages[i] = text
+                pending_markers = [p for p in pending_markers if not p.search(text)]
+                headings = [match.end() for match in SEMESTER_PATTERN.finditer(text)]
+                if headings and TABLE_END_PATTERN not in pending_markers \
+                        and not TABLE_END_PATTERN.search(text, headings[-1]):
+                    # The page's last table has no legend yet, so it carries on over the page
+                    pending_markers.append(TABLE_END_PATTERN)
+            else:
+                scanned_pages.append(i)
+    
+    log.debug("text_layer", characters=sum(len(t) for t in digital_pages.values()), pages=len(digital_pages))
+    return digital_pages, scanned_pages, not pending_markers
+
+
+def open_document(source):
+    """Open a PDF from a file path, or straight from memory if given bytes."""
+    import fitz  # deferred: PyMuPDF is slow to import and only needed here
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+
+def parse_marks_card(pdf_file_path, progress=None, priority=PRIORITY_INTERACTIVE):
+    """
+    Parse marks card PDF (a file path, or the PDF's raw bytes).
+
+    `progress`, if given, is called as progress(stage, **details) at each
+    stage: opened, text_extracted, ocr_started, ocr_page, parsed.
+    `priority` ranks its OCR calls in scheduler.py.
+    """
+    return run_steps(parse_steps(pdf_file_path, progress),
+                     lambda tier, images: ocr_images(images, progress, ocr_priority(priority, tier)))
+
+
+def run_steps(steps, ocr):
+    """
+    Drive a parse_steps generator to its result, answering each request
+    for OCR with `ocr(tier, images)`.
+    """
     try:
-        doc = fitz.open(pdf_file_path)
-        print(f"✓ Opened PDF with {doc.page_count} pages")
-        
-        # Digital extraction
-        for page in doc:
-            full_text += page.get_text()
-        
-        print(f"✓ Digital extraction: {len(full_text)} characters")
-        
-        is_ocr = False
-        if len(full_text.strip()) < 200:
-            is_ocr = True
-            print(f"⚠️  Digital text minimal. Using OCR.space...")
-            full_text = extract_text_with_ocrspace(doc)
-        
-        print(f"✓ Total extracted: {len(full_text)} characters")
-        
-        if len(full_text.strip()) < 100:
-            return {"status": "error", "message": "Could not extract text from PDF."}
-        
-        # Extract USN and Name
-        usn_pattern = re.compile(r"University Seat Number\s*:?\s*(\w+)", re.IGNORECASE)
-        name_pattern = re.compile(r"Student Name\s*:?\s*(.+?)(?:\n|$)", re.IGNORECASE)
-        
-        usn_search = usn_pattern.search(full_text)
-        name_search = name_pattern.search(full_text)
-        
-        if not usn_search:
-            return {"status": "error", "message": "Could not find USN."}
-        if not name_search:
-            return {"status": "error", "message": "Could not find Name."}
-        
-        usn = usn_search.group(1).strip()
-        name = name_search.group(1).strip()
-        
-        # Parse subjects
-        subjects = []
-        
-        if is_ocr:
-            subjects = parse_ocr_text(full_text)
+        request = next(steps)
+        while True:
+            try:
+                page_texts = ocr(*request)
+            except Exception as e:
+                request = steps.throw(e)
+            else:
+                request = steps.send(page_texts)
+    except StopIteration as done:
+        return done.value
+
+
+def split_semesters(subjects, text):
+    """
+    Group the subjects of a consolidated card by the "Semester : N" block of
+    `text` each one is printed in: [(semester, subjects)] in semester order,
+    or None when the text holds fewer than two semesters. Subjects come in
+    text order, so one forward scan places them all, even a code that is
+    printed again in a later semester; a code read twice within one
+    semester keeps its first reading, as read_card does for a single card.
+    """
+    headings = [(match.start(), int(match.group(1))) for match in SEMESTER_PATTERN.finditer(text)]
+    if len({semester for _, semester in headings}) < 2:
+        return None
+    starts = [start for start, _ in headings]
+    blocks = {}
+    cursor = 0
+    for subject in subjects:
+        position = text.find(subject["code"], cursor)
+        if position < 0:
+            position = text.find(subject["code"])
         else:
-            print("--- Running Digital Parser ---")
-            subject_pattern = re.compile(
-                r"([A-Z]{3,}\d{3}[A-Z]?)\s+(.+?)\s+(\d+)\s+(\d+)\s+(\d+)\s+([PF])\s*",
-                re.DOTALL | re.MULTILINE
-            )
-            subject_matches = subject_pattern.findall(full_text)
-            
-            for match in subject_matches:
-                code = match[0].strip()
-                credits = CREDITS_MAP.get(code, 0)
-                points = get_grade_points(int(match[4]), match[5].strip())
-                subjects.append({
-                    "code": code,
-                    "title": match[1].strip().replace("\n", " "),
-                    "internal": int(match[2]),
-                    "external": int(match[3]),
-                    "total": int(match[4]),
-                    "result": match[5].strip(),
-                    "credits": credits,
-                    "points": points
-                })
-        
-        if not subjects:
-            return {"status": "error", "message": "Could not find subjects."}
-        
-        print(f"✓ Found {len(subjects)} subjects")
-        
-        # Calculate SGPA
+            cursor = position + len(subject["code"])
+        # Rows above the first heading belong to the first semester
+        semester = headings[max(0, bisect.bisect_right(starts, position) - 1)][1]
+        blocks.setdefault(semester, {}).setdefault(subject["code"], subject)
+    return [(semester, list(rows.values())) for semester, rows in sorted(blocks.items())]
+
+
+def read_card(doc, digital_text, digital_page_numbers, ocr_text):
+    """
+    Header and subjects from one reading of the card. Returns (card, error):
+    card holds usn, name, semester and subjects, and for a consolidated card
+    "semesters" as [{"semester", "subjects"}]; error is the message to give
+    when the text doesn't hold a card.
+    """
+    full_text = digital_text + ocr_text
+    if len(full_text.strip()) < 100:
+        return None, "Could not extract text from PDF."
+    
+    # Extract USN and Name
+    usn_search = USN_PATTERN.search(full_text)
+    name_search = NAME_PATTERN.search(full_text)
+    
+    if not usn_search:
+        return None, "Could not find USN."
+    if not name_search:
+        return None, "Could not find Name."
+    
+    semester_search = SEMESTER_PATTERN.search(full_text)
+    
+    # Parse subjects - each part with the parser that suits its source
+    subjects = []
+    
+    with stage_timer("parse"):
+        if digital_text.strip():
+            # Layout parser first; the text regex covers PDFs without a table header
+            subjects = parse_digital_layout(doc, digital_page_numbers)
+            if not subjects:
+                ALTERNATIVE_PARSER_HITS.inc(parser="digital_regex")
+                subjects = parse_digital_text(digital_text)
+        if ocr_text.strip():
+            # A consolidated card prints a code again in each semester it was
+            # sat; split_semesters dedupes those per semester instead
+            consolidated = len(set(SEMESTER_PATTERN.findall(full_text))) > 1
+            seen_codes = {s["code"] for s in subjects}
+            for subject in parse_ocr_text(ocr_text) or []:
+                if consolidated or subject["code"] not in seen_codes:
+                    seen_codes.add(subject["code"])
+                    subjects.append(subject)
+    
+    if not subjects:
+        return None, "Could not find subjects."
+    
+    card = {
+        "usn": usn_search.group(1).strip(),
+        "name": name_search.group(1).strip(),
+        "semester": int(semester_search.group(1)) if semester_search else None,
+        "subjects": subjects,
+    }
+    semesters = split_semesters(subjects, full_text)
+    if semesters:
+        card["semester"] = semesters[-1][0]
+        card["semesters"] = [{"semester": semester, "subjects": rows} for semester, rows in semesters]
+    return card, None
+
+
+def _better(attempt, best):
+    # A card beats an error; then fewer problems; ties go to the later, costlier reading
+    if best is None:
+        return True
+    if (attempt["card"] is None) != (best["card"] is None):
+        return attempt["card"] is not None
+    return len(attempt["problems"]) <= len(best["problems"])
+
+
+def read_tiers(doc, progress=None):
+    """
+    Read the card with the cheapest method that passes validation: the
+    text layer, then OCR_TIERS in order over the pages without one. A
+    generator: each OCR tier yields its rendered pages and is sent back
+    their text (see parse_steps).
+    Returns the best attempt as {"tier", "card", "error", "problems"}.
+    """
+    digital_pages, scanned_pages, complete = read_text_layer(doc)
+    digital_text = "".join(digital_pages[i] for i in sorted(digital_pages))
+    digital_page_numbers = sorted(digital_pages)
+    
+    tiers = []
+    if digital_pages or not scanned_pages:
+        tiers.append(("text_layer", None, None))
+    # Digital pages are never OCR'd: their text is what is printed. When the
+    # text layer already reached the end of the table, a page without text
+    # isn't part of the card either, so there's nothing left to OCR.
+    if scanned_pages and not complete:
+        tiers.extend(OCR_TIERS)
+    
+    best = None
+    for tier, dpi, roi in tiers:
+        ocr_text = ""
+        if dpi is not None:
+            pages = scanned_pages
+            if tier == OCR_TIERS[0][0]:
+                log.info("ocr_fallback", pages=len(pages))
+                OCR_FALLBACKS.inc()
+            _report(progress, "ocr_started", pages=len(pages), tier=tier)
+            try:
+                ocr_api_key()  # fail before rendering anything
+                images = render_pages(doc, pages, dpi, roi)
+                ocr_text = join_page_texts((yield tier, images))
+            except Exception as e:
+                if best is None or best["card"] is None:
+                    raise
+                # Keep the reading we have rather than fail the whole card
+                log.warning("tier_failed", tier=tier, error=str(e))
+                break
+        
+        _report(progress, "text_extracted", characters=len(digital_text) + len(ocr_text), tier=tier)
+        card, error = read_card(doc, digital_text, digital_page_numbers, ocr_text)
+        if card is None:
+            problems = [("unreadable", error)]
+        else:
+            problems = validate_card(card, digital_text + ocr_text, ocr=bool(ocr_text))
+        for rule, _ in problems:
+            VALIDATION_FAILURES.inc(tier=tier, rule=rule)
+        
+        attempt = {"tier": tier, "card": card, "error": error, "problems": problems}
+        if _better(attempt, best):
+            best = attempt
+        if not problems:
+            break
+        log.info("tier_escalated", tier=tier, problems=[message for _, message in problems[:5]])
+    
+    PARSE_TIERS.inc(tier=best["tier"])
+    return best
+
+
+def semester_grades(subjects):
+    """SGPA, percentage and the credit sums behind them for one semester's subjects."""
+    with stage_timer("sgpa"):
         total_credits_attempted = sum(s['credits'] for s in subjects)
         total_grade_points_earned = sum(s['points'] * s['credits'] for s in subjects)
         
@@ -324,21 +898,91 @@ def parse_marks_card(pdf_file_path):
         
         percentage = round(sgpa * 10, 2)
         percentage = max(0, min(100, percentage))
-        
-        return {
-            "status": "success",
-            "usn": usn,
-            "name": name,
-            "sgpa": sgpa,
-            "percentage": percentage,
-            "total_credits_attempted": total_credits_attempted,
-            "total_grade_points_earned": round(total_grade_points_earned, 2),
-            "subjects": subjects
-        }
     
+    return {
+        "sgpa": sgpa,
+        "percentage": percentage,
+        "total_credits_attempted": total_credits_attempted,
+        "total_grade_points_earned": round(total_grade_points_earned, 2),
+    }
+
+
+def build_result(card, problems=()):
+    """
+    The /upload response for a parsed card: its subjects plus SGPA. For a
+    consolidated card these are the latest semester's, and "semesters"
+    lists every semester's subjects and SGPA, oldest first.
+    """
+    semesters = card.get("semesters")
+    subjects = semesters[-1]["subjects"] if semesters else card["subjects"]
+    result = {
+        "status": "success",
+        "usn": card["usn"],
+        "name": card["name"],
+        "semester": card["semester"],
+        **semester_grades(subjects),
+        "subjects": subjects
+    }
+    warnings = [message for _, message in problems]
+    if semesters:
+        result["semesters"] = [{"semester": s["semester"], **semester_grades(s["subjects"]),
+                                "subjects": s["subjects"]} for s in semesters]
+    # No credits means no SGPA - don't let a 0.0 into the CGPA. The shipped
+    # catalog only lists some semesters, so say that's why
+    warnings += [f"Semester {s['semester']}: no credits known for its subjects "
+                 f"(not in the credit catalog yet), so no SGPA"
+                 for s in result.get("semesters") or [result] if s["subjects"] and not s["total_credits_attempted"]]
+    if warnings:
+        # Even the best reading didn't add up; say what to double-check
+        result["warnings"] = warnings
+    return result
+
+
+def parse_steps(pdf_file_path, progress=None):
+    """
+    parse_marks_card with the OCR calls left to the caller, so the same
+    parse can be driven by threads (run_steps) or by asyncio (async_app.py).
+
+    A generator: it yields (tier, {page_number: png}) whenever pages need
+    OCR and expects {page_number: text} to be sent back, or the OCR error
+    to be thrown in. Its return value is the result dict. Everything it
+    does between yields is CPU work on the document.
+    """
+    result = yield from _parse_marks_card(pdf_file_path, progress)
+    PARSES.inc(outcome=result["status"])
+    if result["status"] != "success":
+        log.warning("parse_unsuccessful", message=result.get("message"))
+    return result
+
+
+def _parse_marks_card(pdf_file_path, progress):
+    doc = None
+    
+    try:
+        with stage_timer("pdf_open"):
+            doc = open_document(pdf_file_path)
+        log.debug("pdf_opened", pages=doc.page_count)
+        _report(progress, "opened", pages=doc.page_count)
+        
+        attempt = yield from read_tiers(doc, progress)
+        card = attempt["card"]
+        if card is None:
+            return {"status": "error", "message": attempt["error"]}
+        
+        log.info("card_parsed", pages=doc.page_count, subjects=len(card["subjects"]), tier=attempt["tier"],
+                 semesters=len(card.get("semesters") or [card]))
+        _report(progress, "parsed", subjects=len(card["subjects"]))
+        return build_result(card, attempt["problems"])
+    
+    except MemoryError:
+        log.error("parse_out_of_memory")
+        return {"status": "error", "message": OUT_OF_MEMORY_MESSAGE}
+
+    except Overloaded as e:
+        return {"status": "error", "message": OCR_BUSY_MESSAGE, "retry_after": e.retry_after}
+
     except Exception as e:
-        print(f"❌ Error: {e}")
-        traceback.print_exc()
+        log.exception("parse_failed")
         return {"status": "error", "message": str(e)}
     
     finally:
@@ -349,6 +993,11 @@ def parse_marks_card(pdf_file_path):
                 pass
 
 
+def parse_marks_card_bytes(pdf_bytes):
+    """Parse a marks card PDF given as raw bytes, without a temp file."""
+    return parse_marks_card(bytes(pdf_bytes))
+
+
 if __name__ == "__main__":
     test_grade_logic()
     print("\n✓ parser.py ready!")
@@ -0,0 +1,328 @@
+"""
+Admission control for the rate-limited upstreams, OCR.space and Gemini.
+
+    from scheduler import ocr_scheduler, PRIORITY_INTERACTIVE
+    with ocr_scheduler.slot(cost=len(images), priority=PRIORITY_INTERACTIVE):
+        ...  # make `cost` OCR calls
+    async with ocr_scheduler.async_slot(cost, priority):   # async_app.py
+        ...
+
+Each upstream has a token bucket for its rate limit (*_RATE_PER_MINUTE,
+*_BURST) and a cap on calls in flight (*_MAX_IN_FLIGHT). Calls that can't
+start yet wait in a bounded priority queue: interactive uploads and tips
+first, then background jobs, then bulk uploads. A card's pages are admitted
+together, so quota is never spent on page 1 of a card whose page 2 is shed.
+
+Rather than letting a burst run into the upstream's limits, load is shed
+early with Overloaded, which the routes answer with 503 + Retry-After:
+
+- when the wait ahead would be over *_MAX_WAIT seconds - the client
+  would give up first, so the call would only burn quota;
+- when the queue holds *_MAX_QUEUED calls and the newcomer doesn't
+  outrank any of them (if it does, the lowest-ranked waiter is shed);
+- when a call has waited *_MAX_WAIT seconds after all.
+
+A 429 from the upstream pauses its bucket for the Retry-After time, so
+the queue waits it out instead of collecting more 429s. Digital cards
+never ask for OCR, so they never wait here.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from logs import get_logger
+from metrics import UPSTREAM_SHED, UPSTREAM_WAIT_SECONDS
+
+# Lower goes first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+PRIORITY_BULK = 20
+# Added for a re-read of a card that already has a usable reading, so it
+# yields to first reads of the same kind
+PRIORITY_RETRY = 5
+
+OCR_RATE_PER_MINUTE = float(os.getenv("OCR_RATE_PER_MINUTE", 600))
+OCR_BURST = int(os.getenv("OCR_BURST", 20))
+OCR_MAX_IN_FLIGHT = int(os.getenv("OCR_MAX_IN_FLIGHT", 32))
+OCR_MAX_QUEUED = int(os.getenv("OCR_MAX_QUEUED", 200))
+OCR_MAX_WAIT = float(os.getenv("OCR_MAX_WAIT", 30))
+
+GEMINI_RATE_PER_MINUTE = float(os.getenv("GEMINI_RATE_PER_MINUTE", 300))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", 20))
+GEMINI_MAX_IN_FLIGHT = int(os.getenv("GEMINI_MAX_IN_FLIGHT", 32))
+GEMINI_MAX_QUEUED = int(os.getenv("GEMINI_MAX_QUEUED", 200))
+GEMINI_MAX_WAIT = float(os.getenv("GEMINI_MAX_WAIT", 15))
+
+log = get_logger("scheduler")
+
+
+class Overloaded(Exception):
+    """An upstream call was shed; retry after `retry_after` seconds."""
+
+    def __init__(self, upstream, retry_after):
+        # Both in args, so it survives pickling between worker processes
+        super().__init__(upstream, retry_after)
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return f"{self.upstream} is busy, retry in {self.retry_after}s"
+
+
+def retry_after_header(response):
+    """Seconds from a response's Retry-After header, or None."""
+    value = response.headers.get("Retry-After", "")
+    return int(value) if value.isdigit() else None
+
+
+class _Waiter:
+    def __init__(self, cost, wake):
+        self.cost = cost
+        self.wake = wake  # wake(None) to start, wake(Overloaded) to shed
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+class Scheduler:
+    """
+    Token bucket + in-flight cap + bounded priority queue for one upstream.
+    A rate of 0 means no rate limit. Waiters are granted by one dispatcher
+    thread, so threads and asyncio tasks can wait in the same queue.
+    """
+
+    def __init__(self, name, rate_per_minute, burst, max_in_flight, max_queued, max_wait):
+        self.name = name
+        self.rate = rate_per_minute / 60
+        self.burst = max(1, burst)
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._queue = []  # heap of (priority, seq, waiter)
+        self._seq = itertools.count()
+        self._changed = threading.Condition()
+        self._dispatcher = None
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _token_delay(self, cost, now):
+        # Seconds until `cost` tokens are there; a card bigger than the
+        # burst only waits for a full bucket and leaves it in debt
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.rate <= 0:
+            return 0.0
+        return max(0.0, (min(cost, self.burst) - self._tokens) / self.rate)
+
+    def _fits(self, cost):
+        return self._in_flight == 0 or self._in_flight + cost <= self.max_in_flight
+
+    def _grant(self, waiter):
+        # Caller holds self._changed
+        if self.rate > 0:
+            self._tokens -= waiter.cost
+        self._in_flight += waiter.cost
+        waiter.granted = True
+        UPSTREAM_WAIT_SECONDS.observe(time.monotonic() - waiter.enqueued, upstream=self.name)
+
+    def _shed(self, reason, retry_after):
+        UPSTREAM_SHED.inc(upstream=self.name, reason=reason)
+        log.warning("upstream_shed", upstream=self.name, reason=reason, queued=len(self._queue),
+                    retry_after=retry_after)
+        return Overloaded(self.name, retry_after)
+
+    def _expected_wait(self, cost, priority, now):
+        # Time for the bucket to cover everyone who would go first, and us
+        ahead = sum(w.cost for p, _, w in self._queue if p <= priority)
+        pause = max(0.0, self._paused_until - now)
+        if self.rate <= 0:
+            return pause
+        return pause + max(0.0, (ahead + cost - self._tokens) / self.rate)
+
+    def _enqueue(self, cost, priority, wake):
+        """Start at once (returns None) or queue a waiter; raises Overloaded when shed."""
+        with self._changed:
+            now = time.monotonic()
+            self._refill(now)
+            waiter = _Waiter(cost, wake)
+            if not self._queue and self._fits(cost) and self._token_delay(cost, now) == 0:
+                self._grant(waiter)
+                return None
+
+            expected = self._expected_wait(cost, priority, now)
+            if expected > self.max_wait:
+                raise self._shed("wait", max(1, math.ceil(expected - self.max_wait)))
+            if len(self._queue) >= self.max_queued:
+                worst = max(self._queue, key=lambda entry: entry[:2])
+                if worst[0] <= priority:
+                    raise self._shed("queue_full", max(1, math.ceil(expected)))
+                self._queue.remove(worst)
+                heapq.heapify(self._queue)
+                displaced_wait = self._expected_wait(worst[2].cost, worst[0], now)
+                worst[2].wake(self._shed("displaced", max(1, math.ceil(displaced_wait))))
+
+            heapq.heappush(self._queue, (priority, next(self._seq), waiter))
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name=f"{self.name}-scheduler",
+                                                    daemon=True)
+                self._dispatcher.start()
+            self._changed.notify_all()
+            return waiter
+
+    def _dispatch(self):
+        with self._changed:
+            while True:
+                if not self._queue:
+                    self._changed.wait()
+                    continue
+                now = time.monotonic()
+                self._refill(now)
+
+                # Nobody waits past max_wait, whatever their place in the queue
+                expired = [entry for entry in self._queue if now - entry[2].enqueued >= self.max_wait]
+                if expired:
+                    for entry in expired:
+                        self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    for priority, _, waiter in expired:
+                        retry_after = max(1, math.ceil(self._expected_wait(waiter.cost, priority, now)))
+                        waiter.wake(self._shed("timeout", retry_after))
+                    continue
+
+                oldest = min(entry[2].enqueued for entry in self._queue)
+                next_expiry = oldest + self.max_wait - now
+                waiter = self._queue[0][2]
+                if not self._fits(waiter.cost):
+                    self._changed.wait(next_expiry)  # _release notifies
+                    continue
+                delay = self._token_delay(waiter.cost, now)
+                if delay > 0:
+                    self._changed.wait(min(delay, next_expiry))
+                    continue
+                heapq.heappop(self._queue)
+                self._grant(waiter)
+                waiter.wake(None)
+
+    def _release(self, cost):
+        with self._changed:
+            self._in_flight -= cost
+            self._changed.notify_all()
+
+    def _abandon(self, waiter):
+        # An asyncio waiter was cancelled: leave the queue, or give back what it was granted
+        with self._changed:
+            for entry in self._queue:
+                if entry[2] is waiter:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    return
+        if waiter.granted:
+            self._release(waiter.cost)
+
+    @contextmanager
+    def slot(self, cost=1, priority=PRIORITY_INTERACTIVE):
+        """Hold `cost` calls' worth of rate and concurrency; blocks while queued."""
+        cost = max(1, cost)
+        started = threading.Event()
+        outcome = []
+
+        def wake(error):
+            outcome.append(error)
+            started.set()
+
+        if self._enqueue(cost, priority, wake) is not None:
+            started.wait()
+            if outcome[0] is not None:
+                raise outcome[0]
+        try:
+            yield
+        finally:
+            self._release(cost)
+
+    @asynccontextmanager
+    async def async_slot(self, cost=1, priority=PRIORITY_INTERACTIVE):
+        """slot() for asyncio: waits without holding a thread."""
+        cost = max(1, cost)
+        loop = asyncio.get_running_loop()
+        started = loop.create_future()
+
+        def settle(error):
+            if not started.done():
+                started.set_result(error)
+
+        waiter = self._enqueue(cost, priority, lambda error: loop.call_soon_threadsafe(settle, error))
+        if waiter is not None:
+            try:
+                error = await started
+            except asyncio.CancelledError:
+                self._abandon(waiter)
+                raise
+            if error is not None:
+                raise error
+        try:
+            yield
+        finally:
+            self._release(cost)
+
+    def _take_token(self):
+        """0 once a token has been taken, else the seconds until one is there."""
+        with self._changed:
+            now = time.monotonic()
+            self._refill(now)
+            delay = self._token_delay(1, now)
+            if delay == 0 and self.rate > 0:
+                self._tokens -= 1
+            return delay
+
+    def _retry_wait(self, deadline):
+        delay = self._take_token()
+        if delay and time.monotonic() + delay > deadline:
+            raise self._shed("wait", max(1, math.ceil(delay)))
+        return delay
+
+    def acquire(self):
+        """
+        Take one token for a retry of a call that already holds a slot, so
+        the bucket counts every request actually sent. Waits for the token
+        up to max_wait, then raises Overloaded.
+        """
+        deadline = time.monotonic() + self.max_wait
+        delay = self._retry_wait(deadline)
+        while delay:
+            time.sleep(delay)
+            delay = self._retry_wait(deadline)
+
+    async def async_acquire(self):
+        """acquire() for asyncio."""
+        deadline = time.monotonic() + self.max_wait
+        delay = self._retry_wait(deadline)
+        while delay:
+            await asyncio.sleep(delay)
+            delay = self._retry_wait(deadline)
+
+    def pause(self, seconds):
+        """The upstream said slow down: grant nothing for `seconds`."""
+        with self._changed:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._changed.notify_all()
+        log.warning("upstream_paused", upstream=self.name, seconds=seconds)
+
+    def stats(self):
+        with self._changed:
+            return {"queued": len(self._queue), "in_flight": self._in_flight}
+
+
+ocr_scheduler = Scheduler("ocr", OCR_RATE_PER_MINUTE, OCR_BURST, OCR_MAX_IN_FLIGHT,
+                          OCR_MAX_QUEUED, OCR_MAX_WAIT)
+gemini_scheduler = Scheduler("gemini", GEMINI_RATE_PER_MINUTE, GEMINI_BURST, GEMINI_MAX_IN_FLIGHT,
+                             GEMINI_MAX_QUEUED, GEMINI_MAX_WAIT)
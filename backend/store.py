@@ -0,0 +1,193 @@
+import os
+import sqlite3
+import threading
+import time
+
+RESULTS_DB = os.getenv(
+    "RESULTS_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "results.sqlite3"),
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    usn TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS semesters (
+    usn TEXT NOT NULL,
+    semester INTEGER NOT NULL,
+    sgpa REAL NOT NULL,
+    credits_attempted INTEGER NOT NULL,
+    grade_points_earned REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (usn, semester)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS subjects (
+    usn TEXT NOT NULL,
+    semester INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    title TEXT NOT NULL,
+    internal INTEGER NOT NULL,
+    external INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    credits INTEGER NOT NULL,
+    points INTEGER NOT NULL,
+    PRIMARY KEY (usn, semester, code)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS subjects_by_code ON subjects (code);
+"""
+
+
+class ResultStore:
+    """
+    Parsed results persisted in SQLite, one row per (USN, semester) and per
+    (USN, semester, subject code).
+
+    WAL mode lets request threads read history while a worker is writing.
+    Each thread gets its own connection, since sqlite3 connections can't
+    be shared across threads.
+    """
+
+    def __init__(self, path=RESULTS_DB):
+        self.path = path
+        self._local = threading.local()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Durable at checkpoints, not every commit - fine for re-derivable data
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save_results(self, results_list):
+        """
+        Store several successful parse results in one transaction; a
+        consolidated card stores each of its semesters. Results without a
+        USN or semester are skipped. Returns the number of semesters saved.
+        """
+        now = time.time()
+        students, semesters, subjects, stale = [], [], [], []
+        for results in results_list:
+            if not results or results.get("status") != "success":
+                continue
+            usn, semester = results.get("usn"), results.get("semester")
+            if not usn or semester is None:
+                continue
+            usn = usn.upper()
+            students.append((usn, results["name"], now))
+            for graded in results.get("semesters") or [results]:
+                semester = graded["semester"]
+                semesters.append((usn, semester, graded["sgpa"], graded["total_credits_attempted"],
+                                  graded["total_grade_points_earned"], now))
+                stale.append((usn, semester))
+                subjects.extend(
+                    (usn, semester, s["code"], s["title"], s["internal"], s["external"],
+                     s["total"], s["result"], s["credits"], s["points"])
+                    for s in graded["subjects"]
+                )
+
+        if not semesters:
+            return 0
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO students VALUES (?, ?, ?)", students)
+            conn.executemany("INSERT OR REPLACE INTO semesters VALUES (?, ?, ?, ?, ?, ?)", semesters)
+            # A re-parsed semester replaces its subject list wholesale
+            conn.executemany("DELETE FROM subjects WHERE usn = ? AND semester = ?", stale)
+            conn.executemany("INSERT OR REPLACE INTO subjects VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", subjects)
+        return len(semesters)
+
+    def save_result(self, results):
+        return self.save_results([results])
+
+    def semester_sgpas(self, usn):
+        """[(semester, sgpa), ...] for a USN in semester order - one primary-key range scan."""
+        rows = self._connect().execute(
+            "SELECT semester, sgpa FROM semesters WHERE usn = ? ORDER BY semester",
+            (usn.upper(),),
+        )
+        return rows.fetchall()
+
+    def history(self, usn):
+        """Every stored semester for a USN with its subjects, or None."""
+        conn = self._connect()
+        usn = usn.upper()
+        student = conn.execute("SELECT name FROM students WHERE usn = ?", (usn,)).fetchone()
+        if not student:
+            return None
+        semesters = {
+            row[0]: {"semester": row[0], "sgpa": row[1], "total_credits_attempted": row[2],
+                     "total_grade_points_earned": row[3], "subjects": []}
+            for row in conn.execute(
+                "SELECT semester, sgpa, credits_attempted, grade_points_earned "
+                "FROM semesters WHERE usn = ? ORDER BY semester", (usn,))
+        }
+        for row in conn.execute(
+                "SELECT semester, code, title, internal, external, total, result, credits, points "
+                "FROM subjects WHERE usn = ? ORDER BY semester, code", (usn,)):
+            semesters[row[0]]["subjects"].append(dict(zip(
+                ("code", "title", "internal", "external", "total", "result", "credits", "points"), row[1:])))
+        return {"usn": usn, "name": student[0], "semesters": list(semesters.values())}
+
+    def cohort_records(self):
+        """(usn, semester, sgpa, {code: (total, result)}) for every stored semester."""
+        conn = self._connect()
+        records = {
+            (usn, semester): (sgpa, {})
+            for usn, semester, sgpa in conn.execute("SELECT usn, semester, sgpa FROM semesters")
+        }
+        for usn, semester, code, total, result in conn.execute(
+                "SELECT usn, semester, code, total, result FROM subjects"):
+            if (usn, semester) in records:
+                records[usn, semester][1][code] = (total, result)
+        return [(usn, semester, sgpa, subjects) for (usn, semester), (sgpa, subjects) in records.items()]
+
+
+def merge_past_sgpas(stored, typed, first_semester):
+    """
+    SGPAs of the semesters before `first_semester`, in semester order:
+    the stored (semester, sgpa) pairs where there are any, and the SGPAs
+    the user typed (semester 1 first) for the rest. Semesters with
+    neither are left out.
+    """
+    by_semester = {semester: sgpa for semester, sgpa in enumerate(typed, 1) if semester < first_semester}
+    by_semester.update((semester, sgpa) for semester, sgpa in stored if semester < first_semester)
+    return [by_semester[semester] for semester in sorted(by_semester)]
+
+
+result_store = ResultStore()
+
+
+def test_past_sgpas():
+    """Stored semesters win over typed ones; typed ones fill the gaps."""
+    print("Running past-SGPA merge checks...")
+    store = ResultStore(":memory:")
+    store.save_result({
+        "status": "success", "usn": "1ab23cs001", "name": "TEST", "semester": 2, "sgpa": 7.5,
+        "total_credits_attempted": 20, "total_grade_points_earned": 150, "subjects": [],
+    })
+    stored = store.semester_sgpas("1AB23CS001")
+    assert stored == [(2, 7.5)]
+    # Only semester 2 is stored; the user typed 1-3 for a semester 4 card
+    assert merge_past_sgpas(stored, [8.0, 6.0, 9.0], 4) == [8.0, 7.5, 9.0]
+    assert merge_past_sgpas(stored, [], 4) == [7.5]
+    assert merge_past_sgpas([], [8.0, 6.0, 9.0], 4) == [8.0, 6.0, 9.0]
+    # Typed semesters from the card's own semester on aren't past ones
+    assert merge_past_sgpas(stored, [8.0, 6.0, 9.0, 5.0], 3) == [8.0, 7.5]
+    print("✓ A partial stored history keeps the typed semesters it doesn't cover")
+
+
+if __name__ == "__main__":
+    test_past_sgpas()
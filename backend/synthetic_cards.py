@@ -0,0 +1,316 @@
+"""
+Synthetic VTU-style marks cards for benchmarks and load tests.
+
+    python synthetic_cards.py --subjects 12 --pages 2 --out card.pdf
+    python synthetic_cards.py --raster --out scan.pdf
+    python synthetic_cards.py --ocr-text --noise 0.3
+    python synthetic_cards.py --semesters 1,2,3,4 --out consolidated.pdf
+
+make_card() draws a card with PyMuPDF in the same layout as the real
+results page (header, "Subject Code ... Result" table, legend), so the
+layout parser sees what it sees in production. Tables longer than a page
+continue on the next page without a header, and `pages` beyond the table
+are filled with notes. make_consolidated_card() draws one table per
+semester, each under its own "Semester : N" heading, running on from page
+to page like a consolidated marks card. rasterize() turns a card into image-only pages
+(a scan, which takes the OCR path) and ocr_text() produces the text an
+OCR engine would return for it, optionally with OCR-style noise.
+"""
+import argparse
+import random
+import fitz
+from parser import get_grade_points
+from catalog import credit_catalog
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+FONT_SIZE = 12
+# x positions of the table columns, taken from the real card
+CODE_X, TITLE_X, INTERNAL_X, EXTERNAL_X, TOTAL_X, RESULT_X, DATE_X = 34, 102, 316, 374, 424, 473, 514
+ROW_HEIGHT = 40
+TITLE_LINE_HEIGHT = 17
+TITLE_WRAP = 22
+SEMESTER_HEADING_Y = 284
+# From a "Semester : N" heading down to its first row
+TABLE_HEADER_HEIGHT = 69
+FIRST_PAGE_TABLE_TOP = SEMESTER_HEADING_Y + TABLE_HEADER_HEIGHT
+CONTINUATION_TABLE_TOP = 60
+TABLE_BOTTOM = 780
+
+TITLE_WORDS = ["ANALYSIS", "DESIGN", "OF", "ALGORITHMS", "MICROCONTROLLERS", "DATABASE",
+               "MANAGEMENT", "SYSTEMS", "LAB", "&", "BIOLOGY", "FOR", "COMPUTER", "ENGINEERS",
+               "DISCRETE", "MATHEMATICAL", "STRUCTURES", "OPERATING", "NETWORKS", "THEORY"]
+# Real codes first, so synthetic cards get real credits from the catalog
+KNOWN_CODES = ["BCS401", "BCS402", "BCS403", "BCSL404", "BCS405A", "BBOC407", "BUHK408",
+               "BDSL456B", "BPEK459", "BCSL405", "BCSL406"]
+# Characters OCR engines commonly confuse, both ways
+OCR_CONFUSIONS = {"O": "0", "0": "O", "I": "1", "1": "I", "S": "5", "5": "S", "B": "8"}
+
+
+def random_subjects(count, seed=0):
+    """
+    `count` subjects with plausible marks within each code's catalog
+    maximums (50/50 when it isn't listed); about one in eight is failed.
+    """
+    rng = random.Random(seed)
+    subjects = []
+    for i in range(count):
+        code = KNOWN_CODES[i] if i < len(KNOWN_CODES) else f"BXX{400 + i:03d}"
+        entry = credit_catalog.get(code)
+        max_internal, max_external = (entry["max_internal"], entry["max_external"]) if entry else (50, 50)
+        failed = rng.random() < 0.125
+        if max_external:
+            internal = rng.randint(max_internal // 2, max_internal)
+            pass_mark = -(-max_external * 35 // 100)
+            external = rng.randint(0, pass_mark - 1) if failed else rng.randint(pass_mark, max_external)
+        else:
+            # Internal-only course: pass on 40% overall
+            pass_mark = max_internal * 40 // 100
+            internal = rng.randint(0, pass_mark - 1) if failed else rng.randint(pass_mark, max_internal)
+            external = 0
+        total = internal + external
+        result = "F" if failed else "P"
+        subjects.append({
+            "code": code,
+            "title": " ".join(rng.choice(TITLE_WORDS) for _ in range(rng.randint(1, 3))),
+            "internal": internal,
+            "external": external,
+            "total": total,
+            "result": result,
+            "credits": credit_catalog.credits(code),
+            "points": get_grade_points(total, result),
+        })
+    return subjects
+
+
+def expected_result(usn, name, semester, subjects):
+    """The parse_marks_card result a correct parse of the card gives."""
+    credits = sum(s["credits"] for s in subjects)
+    earned = sum(s["points"] * s["credits"] for s in subjects)
+    sgpa = round(earned / credits, 2) if credits > 0 else 0.0
+    return {
+        "status": "success",
+        "usn": usn,
+        "name": name,
+        "semester": semester,
+        "sgpa": sgpa,
+        "percentage": max(0, min(100, round(sgpa * 10, 2))),
+        "total_credits_attempted": credits,
+        "total_grade_points_earned": round(earned, 2),
+        "subjects": subjects,
+    }
+
+
+def _wrap(title):
+    lines, line = [], ""
+    for word in title.split():
+        if line and len(line) + 1 + len(word) > TITLE_WRAP:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}".strip()
+    return lines + [line]
+
+
+def _draw_header(page, usn, name):
+    page.insert_text((102, 135), "VTU PROVISIONAL RESULTS OF UG / PG June / July-2025 EXAMINATION.",
+                     fontsize=11, fontname="Times-Bold")
+    page.insert_text((34, 196), "University Seat Number", fontsize=FONT_SIZE, fontname="Times-Roman")
+    page.insert_text((358, 196), f": {usn}", fontsize=FONT_SIZE, fontname="Times-Roman")
+    page.insert_text((34, 221), "Student Name", fontsize=FONT_SIZE, fontname="Times-Roman")
+    page.insert_text((358, 221), f": {name}", fontsize=FONT_SIZE, fontname="Times-Roman")
+
+
+def _draw_table_header(page, y, semester):
+    """The "Semester : N" heading at `y` and the column headers under it; returns where rows start."""
+    page.insert_text((266, y), f"Semester : {semester}", fontsize=FONT_SIZE, fontname="Times-Roman")
+    for x, dy, text in [(40, 23, "Subject"), (45, 41, "Code"), (159, 23, "Subject Name"),
+                        (302, 23, "Internal"), (305, 41, "Marks"), (358, 23, "External"),
+                        (363, 41, "Marks"), (418, 23, "Total"), (460, 23, "Result"),
+                        (509, 23, "Announced"), (513, 41, "/ Updated")]:
+        page.insert_text((x, y + dy), text, fontsize=FONT_SIZE, fontname="Times-Roman")
+    return y + TABLE_HEADER_HEIGHT
+
+
+def _row_height(subject):
+    # Rows grow to fit titles that wrap onto a third line or more
+    return max(ROW_HEIGHT, TITLE_LINE_HEIGHT * len(_wrap(subject["title"])) + 23)
+
+
+def _draw_row(page, y, subject):
+    page.insert_text((CODE_X, y), subject["code"], fontsize=FONT_SIZE)
+    for offset, line in enumerate(_wrap(subject["title"])):
+        page.insert_text((TITLE_X, y + TITLE_LINE_HEIGHT * offset), line, fontsize=FONT_SIZE)
+    for x, key in ((INTERNAL_X, "internal"), (EXTERNAL_X, "external"), (TOTAL_X, "total"), (RESULT_X, "result")):
+        page.insert_text((x, y), str(subject[key]), fontsize=FONT_SIZE)
+    page.insert_text((DATE_X, y), "2025-07-", fontsize=FONT_SIZE)
+    page.insert_text((DATE_X + 17, y + TITLE_LINE_HEIGHT), "31", fontsize=FONT_SIZE)
+
+
+def _draw_notes(page, y):
+    page.insert_text((34, y), "Nomenclature / Abbreviations", fontsize=FONT_SIZE, fontname="Times-Bold")
+    for i, line in enumerate(["P -> PASS   F -> FAIL   A -> ABSENT   W -> WITHHELD",
+                              "This is a provisional result; verify with the marks card."]):
+        page.insert_text((34, y + 18 * (i + 1)), line, fontsize=10)
+
+
+def _draw_table(doc, page, y, subjects):
+    """Rows from `y` down, then the legend, breaking onto new pages; returns (page, y) below it."""
+    for subject in subjects:
+        height = _row_height(subject)
+        if y + height > TABLE_BOTTOM:
+            page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+            y = CONTINUATION_TABLE_TOP
+        _draw_row(page, y, subject)
+        y += height
+    if y + 60 > TABLE_BOTTOM:
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        y = CONTINUATION_TABLE_TOP
+    _draw_notes(page, y + 10)
+    return page, y + 70
+
+
+def make_card(subjects=9, pages=1, seed=0, usn="1AB23CS001", name="TEST STUDENT", semester=4):
+    """
+    Draw a digital marks card. Returns (pdf_bytes, expected_result).
+    `subjects` is a count or a list of subject dicts (see random_subjects).
+    """
+    if isinstance(subjects, int):
+        subjects = random_subjects(subjects, seed)
+
+    doc = fitz.open()
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    _draw_header(page, usn, name)
+    _draw_table(doc, page, _draw_table_header(page, SEMESTER_HEADING_Y, semester), subjects)
+
+    while doc.page_count < pages:
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        for i in range(30):
+            page.insert_text((34, 60 + 22 * i), f"Note {i + 1}: results are subject to revaluation.", fontsize=10)
+
+    data = doc.tobytes()
+    doc.close()
+    return data, expected_result(usn, name, semester, subjects)
+
+
+def make_consolidated_card(semesters=(2, 3, 4), subjects=9, seed=0, usn="1AB23CS001", name="TEST STUDENT"):
+    """
+    Draw a consolidated card with a table per semester. Returns (pdf_bytes,
+    expected_result): the latest semester's result, with every semester
+    under "semesters" as parse_marks_card gives them. Semesters reuse the
+    catalog's codes with different marks, as a re-sat subject would.
+    """
+    doc = fitz.open()
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    _draw_header(page, usn, name)
+    y = SEMESTER_HEADING_Y
+    graded = []
+    for i, semester in enumerate(semesters):
+        rows = random_subjects(subjects, seed + i)
+        if y + TABLE_HEADER_HEIGHT + ROW_HEIGHT > TABLE_BOTTOM:
+            page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+            y = CONTINUATION_TABLE_TOP
+        page, y = _draw_table(doc, page, _draw_table_header(page, y, semester), rows)
+        graded.append(expected_result(usn, name, semester, rows))
+
+    data = doc.tobytes()
+    doc.close()
+    expected = dict(graded[-1])
+    expected["semesters"] = [{key: value for key, value in result.items() if key not in ("status", "usn", "name")}
+                             for result in graded]
+    return data, expected
+
+
+def rasterize(pdf_bytes, dpi=150):
+    """The same card with every page replaced by an image of it - no text layer."""
+    source = fitz.open(stream=pdf_bytes, filetype="pdf")
+    scanned = fitz.open()
+    for page in source:
+        pix = page.get_pixmap(dpi=dpi)
+        scanned.new_page(width=page.rect.width, height=page.rect.height).insert_image(
+            page.rect, stream=pix.tobytes("png"))
+    data = scanned.tobytes()
+    source.close()
+    scanned.close()
+    return data
+
+
+def ocr_text(expected, noise=0.0, seed=0, misreads=0.0):
+    """
+    What OCR.space returns for the card in `expected`: one subject per line
+    under a plain header. With `noise` > 0 that share of rows get OCR damage -
+    titles split onto a second line, stray '|' column rules, doubled spaces
+    and confused characters in the titles. `misreads` is the share of rows
+    whose subject code has one character confused.
+    """
+    rng = random.Random(seed)
+    lines = [
+        "VTU PROVISIONAL RESULTS OF UG / PG June / July-2025 EXAMINATION.",
+        f"University Seat Number : {expected['usn']}",
+        f"Student Name : {expected['name']}",
+    ]
+    for semester in expected.get("semesters") or [expected]:
+        lines.append(f"Semester : {semester['semester']}")
+        lines.append("Subject Code Subject Name Internal Marks External Marks Total Result Announced / Updated on")
+        lines.extend(_ocr_rows(semester["subjects"], noise, rng, misreads))
+    lines.append("Nomenclature / Abbreviations")
+    lines.append("P -> PASS F -> FAIL A -> ABSENT W -> WITHHELD")
+    return "\n".join(lines)
+
+
+def _misread(code, rng):
+    spots = [i for i, c in enumerate(code) if c in OCR_CONFUSIONS]
+    if not spots:
+        return code
+    i = rng.choice(spots)
+    return code[:i] + OCR_CONFUSIONS[code[i]] + code[i + 1:]
+
+
+def _ocr_rows(subjects, noise, rng, misreads=0.0):
+    lines = []
+    for s in subjects:
+        code = _misread(s["code"], rng) if misreads and rng.random() < misreads else s["code"]
+        title = s["title"]
+        marks = f"{s['internal']} {s['external']} {s['total']} {s['result']}"
+        if rng.random() >= noise:
+            lines.append(f"{code} {title} {marks} 2025-07-31")
+            continue
+        title = "".join(OCR_CONFUSIONS.get(c, c) if rng.random() < 0.1 else c for c in title)
+        damage = rng.randrange(3)
+        if damage == 0:
+            words = title.split()
+            cut = max(1, len(words) // 2)
+            lines.append(f"{code} {' '.join(words[:cut])} {marks}")
+            lines.append(" ".join(words[cut:]) + " 2025-07-31")
+        elif damage == 1:
+            lines.append(f"| {code} | {title} | {marks.replace(' ', ' | ')} |")
+        else:
+            lines.append(f"{code}  {title}   {marks}  2025-07-  31")
+    return lines
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Generate a synthetic marks card")
+    arg_parser.add_argument("--subjects", type=int, default=9)
+    arg_parser.add_argument("--pages", type=int, default=1)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--raster", action="store_true", help="image-only pages, like a scan")
+    arg_parser.add_argument("--ocr-text", action="store_true", help="print OCR-style text instead of a PDF")
+    arg_parser.add_argument("--noise", type=float, default=0.0, help="share of OCR rows to damage")
+    arg_parser.add_argument("--misreads", type=float, default=0.0, help="share of OCR rows with a misread code")
+    arg_parser.add_argument("--semesters", help="comma-separated semesters for a consolidated card, e.g. 3,4")
+    arg_parser.add_argument("--out", default="synthetic_card.pdf")
+    args = arg_parser.parse_args()
+
+    if args.semesters:
+        semesters = [int(s) for s in args.semesters.split(",")]
+        pdf, expected = make_consolidated_card(semesters, args.subjects, args.seed)
+    else:
+        pdf, expected = make_card(args.subjects, args.pages, args.seed)
+    if args.ocr_text:
+        print(ocr_text(expected, args.noise, args.seed, args.misreads))
+    else:
+        if args.raster:
+            pdf = rasterize(pdf)
+        with open(args.out, "wb") as f:
+            f.write(pdf)
+        print(f"✓ Wrote {args.out}: {len(expected['subjects'])} subjects, SGPA {expected['sgpa']}")
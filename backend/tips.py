@@ -0,0 +1,393 @@
+"""
+AI study tips from Gemini, cached by student profile.
+
+A tip only depends on a coarse profile of the result - the SGPA band, the
+weakest passed subject and the failed subjects - so during result season
+thousands of students share a few hundred distinct prompts. Tips are kept
+in a TTL/LRU cache keyed on that profile, identical requests in flight at
+the same time share one Gemini call, and calls go over a pooled keep-alive
+session.
+
+stream_tip/tip_events relay a tip while Gemini is still writing it, so
+the user sees the first words after one chunk instead of the whole answer.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import requests
+from http_client import get_session, post_with_retries
+from logs import get_logger
+from metrics import stage_timer, STAGE_SECONDS
+from scheduler import gemini_scheduler, Overloaded, retry_after_header
+
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-preview-09-2025")
+GEMINI_TIMEOUT = 20
+# A streamed tip is abandoned if Gemini goes quiet for this long (seconds)
+GEMINI_STREAM_IDLE_TIMEOUT = 10
+# Cached tips are reused for this long (seconds)
+TIP_CACHE_TTL = int(os.getenv("TIP_CACHE_TTL", 6 * 60 * 60))
+TIP_CACHE_MAX_ENTRIES = int(os.getenv("TIP_CACHE_MAX_ENTRIES", 4096))
+# Students whose SGPAs fall in the same band of this width get the same tip
+SGPA_BAND = 0.5
+
+log = get_logger("tips")
+
+SYSTEM_INSTRUCTION = "You are a helpful and encouraging academic tutor for a data science engineering student."
+
+
+# Gemini answers these when we are over its rate or it is overloaded
+BUSY_STATUS = (429, 503)
+BUSY_MESSAGE = "The AI tutor is busy right now. Please retry shortly."
+
+
+class TipError(Exception):
+    """
+    A tip couldn't be produced; `status` is the HTTP status to answer with,
+    and `retry_after` (seconds) is set when Gemini was too busy.
+    """
+
+    def __init__(self, message, status=500, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.retry_after = retry_after
+
+
+def busy_error(e):
+    """TipError for a call shed by gemini_scheduler, or refused by Gemini as over its limits."""
+    if isinstance(e, Overloaded):
+        return TipError(BUSY_MESSAGE, 503, e.retry_after)
+    return TipError(BUSY_MESSAGE, 503, retry_after_header(e.response) or 10)
+
+
+# Fields tip_profile/build_prompt read from each subject, when present
+SUBJECT_FIELD_TYPES = {"code": str, "title": str, "result": str, "credits": (int, float), "points": (int, float)}
+
+
+def tip_request(data):
+    """(subjects, sgpa) from a /get-ai-tip body. Raises TipError (400) when it's malformed."""
+    if not isinstance(data, dict):
+        raise TipError("Request body must be a JSON object", 400)
+    subjects = data.get('subjects')
+    if not subjects:
+        raise TipError("No subject data provided", 400)
+    if not isinstance(subjects, list):
+        raise TipError("subjects must be a list", 400)
+    for i, subject in enumerate(subjects):
+        if not isinstance(subject, dict):
+            raise TipError(f"subjects[{i}] must be an object", 400)
+        for field, types in SUBJECT_FIELD_TYPES.items():
+            value = subject.get(field)
+            if field in subject and (not isinstance(value, types) or isinstance(value, bool)):
+                raise TipError(f"subjects[{i}].{field} has the wrong type", 400)
+    return subjects, data.get('sgpa')
+
+
+def tip_profile(subjects, sgpa):
+    """
+    The parts of a result the tip depends on, as a dict with a hashable
+    "key": SGPA band, weakest passed subject (code and points) and the
+    sorted codes of failed subjects.
+    """
+    try:
+        band = int(float(sgpa) / SGPA_BAND) * SGPA_BAND
+    except (TypeError, ValueError):
+        band = None
+
+    passed = [s for s in subjects if s.get('result') == 'P' and s.get('credits', 0) > 0]
+    # Ties go to the lower code so the same card always picks the same subject
+    worst = min(passed, key=lambda s: (s.get('points', 0), s.get('code', ''))) if passed else None
+    failed = sorted((s for s in subjects if s.get('result') == 'F'), key=lambda s: s.get('code', ''))
+
+    key = (
+        band,
+        worst and worst.get('code'),
+        worst and worst.get('points'),
+        tuple(s.get('code') for s in failed),
+    )
+    return {"key": key, "band": band, "worst": worst, "failed": failed}
+
+
+def build_prompt(profile):
+    band, worst, failed = profile["band"], profile["worst"], profile["failed"]
+    if band is None or (worst is None and not failed):
+        return "A VTU data science student just got their results. Provide one paragraph of concise, positive study advice."
+
+    prompt = (f"A VTU data science student just got their 4th sem results. "
+              f"Their SGPA was between {band:.1f} and {band + SGPA_BAND:.1f}. ")
+    if failed:
+        prompt += f"They failed: {', '.join(s.get('title') or s.get('code') for s in failed)}. "
+        if worst:
+            prompt += f"Their worst *passed* subject was {worst.get('title')} (Grade Points: {worst.get('points')}). "
+        prompt += "Please provide one paragraph of concise, actionable study advice focusing on how to recover from the failed subjects and improve."
+    else:
+        prompt += (f"Their worst passed subject was {worst.get('title')} (Grade Points: {worst.get('points')}). "
+                   f"Please provide one paragraph of concise, actionable study advice on how to improve this specific subject.")
+    return prompt
+
+
+def gemini_request(prompt, method="generateContent"):
+    """(url, headers, payload) for a Gemini call; raises TipError without an API key."""
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise TipError("API key not configured.")
+    url = f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:{method}"
+    headers = {"Content-Type": "application/json", "x-goog-api-key": api_key}
+    payload = {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "systemInstruction": {"parts": [{"text": SYSTEM_INSTRUCTION}]},
+    }
+    return url, headers, payload
+
+
+def fetch_tip(prompt):
+    """One generateContent call over the pooled session, admitted by gemini_scheduler."""
+    url, headers, payload = gemini_request(prompt)
+    try:
+        with gemini_scheduler.slot(), stage_timer("ai_tip"):
+            response = post_with_retries(get_session("gemini"), url, retries=1, limiter=gemini_scheduler,
+                                         headers=headers, json=payload, timeout=GEMINI_TIMEOUT)
+        return response.json()['candidates'][0]['content']['parts'][0]['text']
+    except Overloaded as e:
+        raise busy_error(e) from None
+    except requests.exceptions.Timeout:
+        raise TipError("AI server (Gemini) timed out. Please try again.", 504) from None
+    except requests.exceptions.RequestException as e:
+        if e.response is not None and e.response.status_code in BUSY_STATUS:
+            raise busy_error(e) from None
+        log.error("gemini_request_failed", error=str(e))
+        raise TipError(f"AI server error: {e}") from None
+    except (KeyError, IndexError, ValueError):
+        raise TipError("Failed to parse AI response.") from None
+
+
+class _Pending:
+    """A Gemini call in flight for some profile; duplicates wait on it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.tip = None
+        self.error = None
+
+
+class TipCache:
+    """
+    Tips by profile key, evicted after `ttl` seconds or least recently used
+    beyond `max_entries`. Failed calls aren't cached.
+    """
+
+    def __init__(self, ttl=TIP_CACHE_TTL, max_entries=TIP_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._tips = OrderedDict()
+        self._pending = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _fresh(self, key):
+        # Caller holds self._lock
+        entry = self._tips.get(key)
+        if entry is None:
+            return None
+        expires_at, tip = entry
+        if expires_at < time.monotonic():
+            del self._tips[key]
+            return None
+        self._tips.move_to_end(key)
+        return tip
+
+    def get(self, key):
+        """The cached tip for `key`, or None."""
+        with self._lock:
+            tip = self._fresh(key)
+            if tip is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return tip
+
+    def put(self, key, tip):
+        with self._lock:
+            self._tips[key] = (time.monotonic() + self.ttl, tip)
+            self._tips.move_to_end(key)
+            while len(self._tips) > self.max_entries:
+                self._tips.popitem(last=False)
+
+    def get_or_fetch(self, key, fetch):
+        """Return (tip, cached), calling `fetch()` once for all concurrent misses on `key`."""
+        with self._lock:
+            tip = self._fresh(key)
+            if tip is not None:
+                self.hits += 1
+                return tip, True
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                self.misses += 1
+                pending = self._pending[key] = _Pending()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.tip, True
+
+        try:
+            pending.tip = fetch()
+            self.put(key, pending.tip)
+            return pending.tip, False
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.done.set()
+
+    async def get_or_fetch_async(self, key, fetch):
+        """
+        get_or_fetch for the asyncio server: `fetch()` returns an awaitable,
+        and concurrent misses on `key` await the same task. Only call it
+        from the one event loop.
+        """
+        with self._lock:
+            tip = self._fresh(key)
+            if tip is not None:
+                self.hits += 1
+                return tip, True
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            async def fetch_and_cache():
+                tip = await fetch()
+                self.put(key, tip)
+                return tip
+
+            task = self._tasks[key] = asyncio.ensure_future(fetch_and_cache())
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        # Shielded, so one caller going away doesn't cancel the call for the rest
+        return await asyncio.shield(task), not leader
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._tips), "hits": self.hits,
+                    "misses": self.misses, "coalesced": self.coalesced}
+
+
+tip_cache = TipCache()
+
+
+def get_tip(subjects, sgpa):
+    """Return (tip, cached) for a parsed result. Raises TipError."""
+    profile = tip_profile(subjects, sgpa)
+    return tip_cache.get_or_fetch(profile["key"], lambda: fetch_tip(build_prompt(profile)))
+
+
+def sse_line_texts(line):
+    """Text pieces in one line of a streamGenerateContent?alt=sse response."""
+    if not line or not line.startswith("data:"):
+        return []
+    chunk = json.loads(line[len("data:"):])
+    # The last chunk can carry only a finishReason (or a safety block) and no content
+    candidates = chunk.get('candidates') or [{}]
+    parts = (candidates[0].get('content') or {}).get('parts') or []
+    return [part['text'] for part in parts if part.get('text')]
+
+
+def _stream_texts(response):
+    """Text pieces from a streamGenerateContent?alt=sse response."""
+    # chunk_size=None hands over each chunk as it arrives instead of
+    # waiting for a 512-byte buffer to fill
+    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+        yield from sse_line_texts(line)
+
+
+def stream_tip(subjects, sgpa):
+    """
+    Yield the tip in pieces as Gemini generates it; a cached tip comes as a
+    single piece. The finished tip is cached for later requests. Closing
+    the generator (the client went away) closes the upstream connection
+    straight away, so an abandoned tip stops costing a worker and tokens.
+    Raises TipError.
+    """
+    profile = tip_profile(subjects, sgpa)
+    tip = tip_cache.get(profile["key"])
+    if tip is not None:
+        yield tip
+        return
+
+    url, headers, payload = gemini_request(build_prompt(profile), "streamGenerateContent")
+    response = None
+    pieces = []
+    start = time.perf_counter()
+    try:
+        # The slot is held until the stream ends, as that is how long the call is in flight
+        with gemini_scheduler.slot():
+            response = get_session("gemini").post(
+                url, params={"alt": "sse"}, headers=headers, json=payload, stream=True,
+                timeout=(5, GEMINI_STREAM_IDLE_TIMEOUT),
+            )
+            if response.status_code == 429:
+                gemini_scheduler.pause(retry_after_header(response) or 10)
+            response.raise_for_status()
+            for text in _stream_texts(response):
+                if not pieces:
+                    STAGE_SECONDS.observe(time.perf_counter() - start, stage="ai_tip_first_chunk")
+                pieces.append(text)
+                yield text
+    except Overloaded as e:
+        raise busy_error(e) from None
+    except requests.exceptions.Timeout:
+        raise TipError("AI server (Gemini) timed out. Please try again.", 504) from None
+    except requests.exceptions.RequestException as e:
+        if e.response is not None and e.response.status_code in BUSY_STATUS:
+            raise busy_error(e) from None
+        log.error("gemini_request_failed", error=str(e))
+        raise TipError(f"AI server error: {e}") from None
+    except (KeyError, IndexError, ValueError):
+        raise TipError("Failed to parse AI response.") from None
+    finally:
+        if response is not None:
+            response.close()
+
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="ai_tip_stream")
+    if pieces:
+        tip_cache.put(profile["key"], "".join(pieces))
+
+
+def tip_error_body(e):
+    body = {"status": "error", "message": e.message}
+    if e.retry_after:
+        body["retry_after"] = e.retry_after
+    return body
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def tip_events(subjects, sgpa):
+    """stream_tip as Server-Sent Events: "chunk"s of text, then "done" or "error"."""
+    tips = stream_tip(subjects, sgpa)
+    try:
+        for text in tips:
+            yield sse_event("chunk", {"text": text})
+        yield sse_event("done", {"status": "success"})
+    except TipError as e:
+        yield sse_event("error", tip_error_body(e))
+    finally:
+        tips.close()
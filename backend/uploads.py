@@ -0,0 +1,90 @@
+import hashlib
+import os
+import tempfile
+from flask import Request
+
+# Uploads up to this size never touch the disk; bigger ones are spilled to a
+# temp file so a handful of huge PDFs can't exhaust worker memory.
+UPLOAD_SPILL_THRESHOLD = int(os.getenv("UPLOAD_SPILL_THRESHOLD", 8 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class UploadRequest(Request):
+    """
+    Keep multipart file parts in memory up to UPLOAD_SPILL_THRESHOLD.
+    Werkzeug's default writes anything over 500 KB to a temp file, which
+    is exactly the disk round trip the in-memory upload path avoids.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPILL_THRESHOLD, mode="rb+")
+
+
+class PdfUpload:
+    """
+    An uploaded PDF read off the request stream, with its SHA-256.
+
+    `source` is the raw bytes when the upload fit under the spill
+    threshold and a temp file path otherwise - parse_marks_card accepts
+    either. Call close() to remove the spill file.
+    """
+
+    def __init__(self, digest, size, data=None, path=None):
+        self.digest = digest
+        self.size = size
+        self.data = data
+        self.path = path
+
+    @property
+    def source(self):
+        return self.data if self.data is not None else self.path
+
+    def detach(self):
+        """A PdfUpload that takes over this one's source; close() here no longer removes it."""
+        owner = PdfUpload(self.digest, self.size, self.data, self.path)
+        self.data = self.path = None
+        return owner
+
+    def close(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+        self.data = None
+
+
+def read_pdf_upload(stream, spill_threshold=UPLOAD_SPILL_THRESHOLD):
+    """
+    Read an upload stream in chunks, hashing as we go. The bytes stay in
+    memory unless they grow past `spill_threshold`, at which point what we
+    have so far and the rest of the stream go to a temp file instead.
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    spill = None
+    size = 0
+
+    try:
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            if spill is not None:
+                spill.write(chunk)
+                continue
+            buffer += chunk
+            if size > spill_threshold:
+                spill = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
+                spill.write(buffer)
+                buffer = None
+    except Exception:
+        if spill is not None:
+            spill.close()
+            os.remove(spill.name)
+        raise
+
+    if spill is not None:
+        spill.close()
+        return PdfUpload(digest.hexdigest(), size, path=spill.name)
+    return PdfUpload(digest.hexdigest(), size, data=bytes(buffer))
@@ -0,0 +1,115 @@
+"""
+Cheap consistency checks on a parsed marks card.
+
+parse_marks_card reads a card with the cheapest method first (text layer,
+then low-DPI OCR, then full-page OCR) and only moves on to the next one
+when these checks fail, so each rule here stands for "a better reading
+could change the answer":
+
+- the header (USN, name) and at least one subject were found
+- every subject-code-like word in the text became a subject row
+- internal + external == total, within the catalog's maximum marks
+- P/F agrees with the marks (VTU: 40% in the internal assessment, 35% in
+  the external exam and 40% overall)
+- codes are in the credit catalog, when the catalog covers this card at all
+
+The marks and catalog rules only apply to OCR readings: a text layer
+holds exactly what is printed, so re-reading it can't fix those.
+
+    python validation.py    # self-check the pass rule
+"""
+import math
+import re
+from catalog import credit_catalog
+from ocr_codes import snap_code
+
+MIN_INTERNAL_SHARE = 0.40
+MIN_EXTERNAL_SHARE = 0.35
+MIN_TOTAL_SHARE = 0.40
+DEFAULT_MAX_INTERNAL = 50
+DEFAULT_MAX_EXTERNAL = 50
+
+CODE_IN_TEXT = re.compile(r"\b[A-Z]{3,}\d{3}[A-Z]?\b")
+
+
+def max_marks(entry):
+    """(max internal, max external) from a catalog entry, or the usual 50/50 without one."""
+    # Some courses have no external exam (max_external 0), so 0 is a real maximum
+    if entry:
+        return entry["max_internal"], entry["max_external"]
+    return DEFAULT_MAX_INTERNAL, DEFAULT_MAX_EXTERNAL
+
+
+def marks_problems(subject, entry=None):
+    """[(rule, message)] for one subject's marks; `entry` is its catalog entry, if any."""
+    code = subject["code"]
+    internal, external, total = subject["internal"], subject["external"], subject["total"]
+    max_internal, max_external = max_marks(entry)
+    problems = []
+    if internal + external != total:
+        problems.append(("marks_sum", f"{code}: {internal} + {external} != {total}"))
+    if internal > max_internal or external > max_external:
+        problems.append(("marks_range", f"{code}: marks above {max_internal}/{max_external}"))
+    # Short of the internal minimum, a student isn't eligible for the external exam at all
+    passed = (internal >= math.ceil(MIN_INTERNAL_SHARE * max_internal)
+              and external >= math.ceil(MIN_EXTERNAL_SHARE * max_external)
+              and total >= MIN_TOTAL_SHARE * (max_internal + max_external))
+    if subject["result"] != ("P" if passed else "F"):
+        problems.append(("result", f"{code}: {subject['result']} with {internal} internal, {external} external, "
+                                   f"{total} total"))
+    return problems
+
+
+def validate_card(card, text, ocr=True):
+    """
+    [(rule, message)] for a card read from `text`; empty when it looks
+    right. `card` holds usn, name and subjects as parse_marks_card builds them.
+    """
+    problems = []
+    if not card.get("usn") or not card.get("name"):
+        problems.append(("header", "USN or name missing"))
+    subjects = card.get("subjects") or []
+    if not subjects:
+        return problems + [("subjects", "no subjects found")]
+
+    parsed = {s["code"] for s in subjects}
+    codes = set(CODE_IN_TEXT.findall(text))
+    if ocr:
+        # The OCR parser snaps misread codes to the catalog; count them the same way
+        codes = {snap_code(code) or code for code in codes}
+    missing = codes - parsed
+    if missing:
+        problems.append(("subject_count", f"{len(missing)} subject row(s) not parsed: {', '.join(sorted(missing))}"))
+    if not ocr:
+        return problems
+
+    entries = {code: credit_catalog.get(code) for code in parsed}
+    for subject in subjects:
+        problems.extend(marks_problems(subject, entries[subject["code"]]))
+    # A mix of known and unknown codes suggests misreads; all unknown just
+    # means the catalog doesn't cover this branch
+    unknown = sorted(code for code, entry in entries.items() if entry is None)
+    if unknown and len(unknown) < len(entries):
+        problems.append(("catalog", f"codes not in the catalog: {', '.join(unknown)}"))
+    return problems
+
+
+def test_pass_rule():
+    """The P/F rule against rows as printed on a real card (4THSEM.pdf)."""
+    print("Running pass rule checks...")
+    rows = [
+        ("BCS401", 47, 29, 76, "P", None),
+        ("BCS405A", 45, 10, 55, "F", None),     # failed the external exam
+        ("BPEK459", 75, 0, 75, "P", {"max_internal": 100, "max_external": 0}),
+        ("BCS403", 15, 31, 46, "F", None),      # 46 overall, but short of the internal minimum
+    ]
+    for code, internal, external, total, result, entry in rows:
+        subject = {"code": code, "internal": internal, "external": external, "total": total, "result": result}
+        assert marks_problems(subject, entry) == [], (code, marks_problems(subject, entry))
+    flipped = {"code": "BCS403", "internal": 15, "external": 31, "total": 46, "result": "P"}
+    assert [rule for rule, _ in marks_problems(flipped)] == ["result"]
+    print("✓ P/F agrees with the VTU minimums")
+
+
+if __name__ == "__main__":
+    test_pass_rule()
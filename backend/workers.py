@@ -0,0 +1,322 @@
+"""
+Supervised worker processes for parsing marks cards.
+
+    from workers import parse_pool
+    future = parse_pool.submit(pdf_bytes_or_path, progress=job.report)
+    result = future.result()
+
+Rendering scans for OCR is where a parse can take a lot of memory, and
+PyMuPDF processes grow the longer they live. Each worker parses one card at
+a time under an address-space limit of PARSE_WORKER_JOB_MEMORY_MB above its
+size at start, so a runaway scan fails that one card instead of getting the
+box OOM-killed. A worker is replaced after PARSE_WORKER_MAX_JOBS cards,
+once its RSS passes PARSE_WORKER_MAX_RSS_MB, or after running out of
+memory. One that dies or hangs past PARSE_WORKER_JOB_TIMEOUT is killed and
+replaced; only its card fails.
+
+Bulk uploads always parse here. PARSE_MODE=workers sends single uploads
+and background jobs here too (see parse_card); the default, "inline",
+parses them on the request or job thread.
+
+Workers don't call OCR.space themselves: each round of page images is
+sent back to the supervisor thread, which makes the calls from this
+process, so the rate limits in scheduler.py hold across all workers.
+"""
+import atexit
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from parser import (parse_marks_card, parse_steps, run_steps, ocr_images, ocr_priority,
+                    OUT_OF_MEMORY_MESSAGE)
+from scheduler import PRIORITY_INTERACTIVE
+from logs import get_logger
+from metrics import registry, WORKER_RECYCLES
+
+PARSE_MODE = os.getenv("PARSE_MODE", "inline")
+# BULK_MAX_WORKERS is the older name, from when only bulk uploads used processes
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", os.getenv("BULK_MAX_WORKERS", os.cpu_count() or 1)))
+PARSE_WORKER_MAX_JOBS = int(os.getenv("PARSE_WORKER_MAX_JOBS", 50))
+PARSE_WORKER_MAX_RSS_MB = int(os.getenv("PARSE_WORKER_MAX_RSS_MB", 400))
+# Address space, not RSS: thread stacks and malloc arenas reserve a few
+# hundred MB of it that is never touched, so keep this generous
+PARSE_WORKER_JOB_MEMORY_MB = int(os.getenv("PARSE_WORKER_JOB_MEMORY_MB", 1024))
+PARSE_WORKER_JOB_TIMEOUT = float(os.getenv("PARSE_WORKER_JOB_TIMEOUT", 300))
+# How long parse() waits for a card, queueing and OCR included
+PARSE_WAIT_TIMEOUT = float(os.getenv("PARSE_WAIT_TIMEOUT", 900))
+
+MB = 1024 * 1024
+
+log = get_logger("workers")
+
+
+class WorkerCrashed(Exception):
+    pass
+
+
+def memory_usage():
+    """(virtual size, resident size) of this process in bytes, or None without /proc."""
+    try:
+        with open("/proc/self/statm") as f:
+            size, resident = f.read().split()[:2]
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        return int(size) * page_size, int(resident) * page_size
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _limit_memory(budget_mb):
+    try:
+        import resource
+    except ImportError:
+        return  # Windows: no limit, workers are only recycled
+    usage = memory_usage()
+    if usage is None or budget_mb <= 0:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = usage[0] + budget_mb * MB
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _worker_main(conn, budget_mb):
+    """Parse each source received on `conn` until told to stop (None)."""
+    _limit_memory(budget_mb)
+    send_lock = threading.Lock()
+
+    def progress(stage, **details):
+        with send_lock:
+            conn.send(("progress", stage, details))
+
+    def ocr(tier, images):
+        # Done by the supervisor; the answer is ("texts", texts) or ("error", exception)
+        with send_lock:
+            conn.send(("ocr", tier, images))
+        kind, value = conn.recv()
+        if kind == "error":
+            raise value
+        return value
+
+    while True:
+        try:
+            source = conn.recv()
+        except EOFError:
+            return
+        except MemoryError:
+            # No room to even receive the card; report it and let the pool replace us
+            with send_lock:
+                conn.send(("done", {"status": "error", "message": OUT_OF_MEMORY_MESSAGE}, {}, None))
+            return
+        if source is None:
+            return
+        result = run_steps(parse_steps(source, progress), ocr)
+        usage = memory_usage()
+        with send_lock:
+            conn.send(("done", result, registry.drain(), usage[1] if usage else None))
+
+
+def _get_context():
+    # Fork workers from a clean single-threaded server rather than the
+    # threaded app process; Windows only has spawn
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["workers"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class WorkerPool:
+    """
+    A fixed number of worker processes, each driven by a supervisor thread
+    that feeds it one card at a time and replaces it when needed.
+    submit() returns a concurrent.futures.Future.
+    """
+
+    def __init__(self, size=PARSE_WORKERS, max_jobs=PARSE_WORKER_MAX_JOBS,
+                 max_rss_mb=PARSE_WORKER_MAX_RSS_MB, job_memory_mb=PARSE_WORKER_JOB_MEMORY_MB,
+                 job_timeout=PARSE_WORKER_JOB_TIMEOUT):
+        self.size = max(1, size)
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss_mb * MB
+        self.job_memory_mb = job_memory_mb
+        self.job_timeout = job_timeout
+        self._tasks = queue.SimpleQueue()
+        self._threads = []
+        self._workers = {}
+        self._context = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _start(self):
+        # Caller holds self._lock
+        self._context = _get_context()
+        for index in range(self.size):
+            thread = threading.Thread(target=self._supervise, args=(index,),
+                                      name=f"parse-supervisor-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        atexit.register(self.shutdown)
+
+    def submit(self, source, progress=None, priority=PRIORITY_INTERACTIVE):
+        """Queue a parse of `source` (PDF bytes or a path); `progress` and `priority` as for parse_marks_card."""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Worker pool is shut down")
+            if not self._threads:
+                self._start()
+        self._tasks.put((future, source, progress, priority))
+        return future
+
+    def parse(self, source, progress=None, priority=PRIORITY_INTERACTIVE, timeout=PARSE_WAIT_TIMEOUT):
+        """Parse on a worker and wait for the result, at most `timeout` seconds."""
+        future = self.submit(source, progress, priority)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise WorkerCrashed(f"No parse result after {timeout:g}s") from None
+
+    def stats(self):
+        with self._lock:
+            alive = sum(1 for process, _ in self._workers.values() if process.is_alive())
+        return {"workers": alive, "queued": self._tasks.qsize()}
+
+    def _spawn(self, index):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_conn, self.job_memory_mb),
+                                        name=f"parse-worker-{index}", daemon=True)
+        process.start()
+        child_conn.close()
+        with self._lock:
+            self._workers[index] = (process, parent_conn)
+        log.debug("worker_started", worker=index, pid=process.pid)
+        return process, parent_conn
+
+    def _retire(self, index, reason, kill=False):
+        with self._lock:
+            process, conn = self._workers.pop(index)
+        WORKER_RECYCLES.inc(reason=reason)
+        if kill:
+            process.kill()
+        else:
+            try:
+                conn.send(None)
+            except OSError:
+                process.kill()
+        process.join(5)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        conn.close()
+        event = log.warning if kill else log.debug if reason == "shutdown" else log.info
+        event("worker_retired", worker=index, pid=process.pid, reason=reason, exitcode=process.exitcode)
+
+    def _run(self, conn, source, progress, priority):
+        """Hand one card to a worker, relay its progress and make its OCR calls; returns (result, rss)."""
+        conn.send(source)
+        deadline = time.monotonic() + self.job_timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not conn.poll(remaining):
+                raise TimeoutError()
+            message = conn.recv()
+            if message[0] == "progress":
+                if progress:
+                    progress(message[1], **message[2])
+                continue
+            if message[0] == "ocr":
+                _, tier, images = message
+                try:
+                    reply = ("texts", ocr_images(images, progress, ocr_priority(priority, tier)))
+                except Exception as e:
+                    reply = ("error", e)
+                try:
+                    conn.send(reply)
+                except Exception:
+                    # Not every exception pickles; the message is what the parse reports
+                    conn.send(("error", Exception(str(reply[1]))))
+                # Waiting on OCR isn't the worker hanging
+                deadline = time.monotonic() + self.job_timeout
+                continue
+            _, result, metrics, rss = message
+            registry.merge(metrics)
+            return result, rss
+
+    def _supervise(self, index):
+        conn = None
+        jobs = 0
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+            future, source, progress, priority = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            if conn is None:
+                _, conn = self._spawn(index)
+                jobs = 0
+
+            try:
+                result, rss = self._run(conn, source, progress, priority)
+            except TimeoutError:
+                self._retire(index, "timeout", kill=True)
+                conn = None
+                future.set_exception(WorkerCrashed(f"Parsing took longer than {self.job_timeout:g}s"))
+                continue
+            except (EOFError, OSError):
+                # Killed from outside (OOM killer) or crashed inside MuPDF
+                self._retire(index, "crashed", kill=True)
+                conn = None
+                future.set_exception(WorkerCrashed("Worker crashed while parsing this file"))
+                continue
+            except Exception as e:
+                # A message that didn't unpickle, an unexpected reply, a failing
+                # progress callback: the worker's state is unknown, so replace it
+                log.exception("worker_failed", worker=index)
+                self._retire(index, "error", kill=True)
+                conn = None
+                future.set_exception(WorkerCrashed(f"Worker failed while parsing this file: {e}"))
+                continue
+            future.set_result(result)
+
+            jobs += 1
+            reason = None
+            if result.get("message") == OUT_OF_MEMORY_MESSAGE:
+                reason = "out_of_memory"
+            elif self.max_jobs and jobs >= self.max_jobs:
+                reason = "max_jobs"
+            elif self.max_rss and rss and rss > self.max_rss:
+                reason = "rss"
+            if reason:
+                self._retire(index, reason)
+                conn = None
+
+        if conn is not None:
+            self._retire(index, "shutdown")
+
+    def shutdown(self):
+        """Stop every worker once it finishes its current card."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            threads = list(self._threads)
+        for _ in threads:
+            self._tasks.put(None)
+
+
+parse_pool = WorkerPool()
+
+
+def parse_card(source, progress=None, priority=PRIORITY_INTERACTIVE):
+    """parse_marks_card, run on a supervised worker when PARSE_MODE=workers."""
+    if PARSE_MODE != "workers":
+        return parse_marks_card(source, progress, priority)
+    try:
+        return parse_pool.parse(source, progress, priority)
+    except WorkerCrashed as e:
+        return {"status": "error", "message": str(e)}
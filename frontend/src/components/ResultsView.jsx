@@ -1,4 +1,4 @@
-import React, { useState, useMemo, useEffect } from 'react';
+import React, { useState, useMemo, useEffect, useRef } from 'react';
 import SpotlightCard from './ui/SpotlightCard';
 import MagneticButton from './ui/MagneticButton';
 import { Sparkles, RefreshCcw, BrainCircuit, Loader2, Calculator, Download, Printer, TrendingUp, PieChart } from 'lucide-react';
@@ -20,9 +20,29 @@ const getPointsFromTotal = (total) => {
 
 const getResultFromTotal = (total) => (parseInt(total, 10) >= 40 ? 'P' : 'F');
 
+// Splits a Server-Sent Events buffer into complete events and the unfinished rest
+const parseSseEvents = (buffer) => {
+    const blocks = buffer.split('\n\n');
+    const rest = blocks.pop();
+    const events = blocks.map(block => {
+        let type = 'message';
+        let data = '';
+        block.split('\n').forEach(line => {
+            if (line.startsWith('event:')) type = line.slice(6).trim();
+            else if (line.startsWith('data:')) data += line.slice(5).trim();
+        });
+        return { type, data: data ? JSON.parse(data) : null };
+    });
+    return { events, rest };
+};
+
 const ResultsView = ({ data, onReset }) => {
     const [aiTip, setAiTip] = useState(null);
     const [tipLoading, setTipLoading] = useState(false);
+    const tipRequest = useRef(null);
+
+    // Leaving the page hangs up on the tip stream so the server stops generating it
+    useEffect(() => () => tipRequest.current?.abort(), []);
 
     // What-If Mode State
     const [whatIfMode, setWhatIfMode] = useState(false);
@@ -66,23 +86,52 @@ const ResultsView = ({ data, onReset }) => {
 
     const fetchAiTip = async () => {
         setTipLoading(true);
+        tipRequest.current?.abort();
+        const controller = new AbortController();
+        tipRequest.current = controller;
         try {
-            const response = await fetch('http://localhost:5000/get-ai-tip', {
+            // The tip is streamed, so text shows up while Gemini is still writing it
+            const response = await fetch('http://localhost:5000/get-ai-tip/stream', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
                     subjects: data.subjects,
                     sgpa: data.sgpa,
                 }),
+                signal: controller.signal,
             });
-            const result = await response.json();
-            if (result.status === 'success') {
-                setAiTip(result.tip);
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let tip = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                const parsed = parseSseEvents(buffer + decoder.decode(value, { stream: true }));
+                buffer = parsed.rest;
+                for (const event of parsed.events) {
+                    if (tipRequest.current !== controller) return;
+                    if (event.type === 'chunk') {
+                        tip += event.data.text;
+                        setAiTip(tip);
+                    } else if (event.type === 'error') {
+                        throw new Error(event.data.message);
+                    }
+                }
             }
         } catch (error) {
-            console.error('Failed to fetch AI tip', error);
+            if (error.name !== 'AbortError') {
+                console.error('Failed to fetch AI tip', error);
+            }
         } finally {
-            setTipLoading(false);
+            // A newer request has taken over; leave the spinner to it
+            if (tipRequest.current === controller) {
+                tipRequest.current = null;
+                setTipLoading(false);
+            }
         }
     };
 